@@ -1,18 +1,65 @@
 import os
-from flask import Flask, request, render_template, jsonify
+import sys
+import atexit
+import csv
+import json
+import hmac
+import base64
+import random
+import click
+from collections import Counter
+from contextlib import ExitStack
+from itertools import groupby, chain
+from flask import (
+    Flask,
+    Response,
+    request,
+    render_template,
+    jsonify,
+    g,
+    has_request_context,
+    stream_with_context,
+)
+from werkzeug.datastructures import ETags
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from sqlalchemy import text
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text, event, inspect, tuple_
+from sqlalchemy.orm import Session as OrmSession, validates, object_session
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from threading import Lock
 from uuid import uuid4
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 
 from utils.validators import (
     validate_nhs_number,
     format_postcode,
     is_valid_appointment_status,
     is_valid_state_change,
-    check_if_missed_appointment,
+    is_missed,
+    parse_duration,
 )
+from utils.intervals import find_overlaps, free_intervals
+from utils.cache import TTLCache
+from utils.changefeed import LocalChangeFeed, PostgresChangeFeed
+from utils.search import normalize_name, TrigramIndex
+from utils.postcodes import PostcodeDirectory, build_postcode_directory, read_postcode_list
+from utils.replicas import ReplicaRouter
+from utils.archive import archive_file_name, append_archive_chunk, read_archive_chunk
+from utils.export import encode_ndjson, encode_csv, gzip_stream
+from utils.datamigrations import DataMigration, run_data_migration
+from utils.admission import AdmissionController, ConcurrencyLimit, retry_after_header
+from utils.sharding import ShardRouter, gather_sorted, merge_shards, rebalance
+from utils.counters import INSERTS, add_to_counts
+from utils.lookups import NameLookup
+from utils.snapshot import SnapshotWriter, read_snapshot, dump_table, load_rows
+from utils.sqlite import UTCDateTime, ISODate, SingleWriter, sqlite_pragmas, apply_pragmas
+from utils.profiling import CallProfiler, ProfileStore
+from utils.duplicates import find_duplicates
+from utils.audit import AuditLog, RotatingFileWriter, database_writer
 
 from logging import getLogger, basicConfig, INFO, DEBUG
 
@@ -21,16 +68,382 @@ basicConfig(level=DEBUG)
 
 app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("SQLALCHEMY_DATABASE_URI")
+# How long, in seconds, a clinician's bookings for a day are cached for availability searches
+app.config["AVAILABILITY_CACHE_TTL"] = float(os.environ.get("AVAILABILITY_CACHE_TTL", 30))
+# Where appointment change events come from: "local" only sees changes made by this process,
+# "postgres" shares them between all the workers using the database
+app.config["CHANGE_FEED"] = os.environ.get("CHANGE_FEED", "local")
+# How often, in seconds, to send a keep-alive to idle event stream clients
+app.config["EVENTS_HEARTBEAT"] = float(os.environ.get("EVENTS_HEARTBEAT", 15))
+# How many event streams each worker serves at once, or 0 for no limit. Each holds a thread for as
+# long as it is connected, so this keeps the rest of the worker's threads for other requests.
+app.config["EVENTS_MAX_STREAMS"] = int(os.environ.get("EVENTS_MAX_STREAMS", 4))
+# How long, in seconds, a write can take to commit. Syncs re-send anything changed this recently,
+# in case an earlier change is still to be committed.
+app.config["SYNC_SETTLE_TIME"] = float(os.environ.get("SYNC_SETTLE_TIME", 5))
+# How many days deleted records are remembered for. Sync cursors older than this are refused.
+app.config["SYNC_TOMBSTONE_RETENTION_DAYS"] = int(os.environ.get("SYNC_TOMBSTONE_RETENTION_DAYS", 30))
+# A postcode directory file, built with `flask build-postcode-directory`. If set, postcodes must
+# exist in it as well as being well-formed.
+app.config["POSTCODE_DIRECTORY"] = os.environ.get("POSTCODE_DIRECTORY")
+# Where archived appointments are written to, and how old they must be to be archived by default
+app.config["ARCHIVE_DIRECTORY"] = os.environ.get("ARCHIVE_DIRECTORY", "archive")
+app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", 365))
+# Read replicas of the database, as comma-separated connection strings. GET requests read from
+# these, and everything else uses SQLALCHEMY_DATABASE_URI.
+app.config["SQLALCHEMY_REPLICA_URIS"] = [
+    uri.strip() for uri in os.environ.get("SQLALCHEMY_REPLICA_URIS", "").split(",") if uri.strip()
+]
+# How often, in seconds, to check each replica is up, and how far behind the primary it can be
+app.config["REPLICA_CHECK_INTERVAL"] = float(os.environ.get("REPLICA_CHECK_INTERVAL", 10))
+app.config["REPLICA_MAX_LAG"] = float(os.environ.get("REPLICA_MAX_LAG", 5))
+# Shards for patients and their appointments, as comma-separated connection strings. If set, each
+# patient and their appointments are kept in one of these, chosen by their NHS number, and
+# everything else is kept in SQLALCHEMY_DATABASE_URI. Shards can only be added to the end.
+app.config["SQLALCHEMY_SHARD_URIS"] = [
+    uri.strip() for uri in os.environ.get("SQLALCHEMY_SHARD_URIS", "").split(",") if uri.strip()
+]
+app.config["SQLALCHEMY_BINDS"] = {
+    **{f"replica_{i}": uri for i, uri in enumerate(app.config["SQLALCHEMY_REPLICA_URIS"])},
+    **{f"shard_{i}": uri for i, uri in enumerate(app.config["SQLALCHEMY_SHARD_URIS"])},
+}
+# Load shedding, off by default. How many requests of each class (read, write, export, stream) each
+# worker handles at once, how long, in seconds, a request can queue for before it is turned away,
+# and how many requests a second each client can make of each class, in bursts of up to ADMISSION_BURST.
+app.config["ADMISSION_CONTROL"] = os.environ.get("ADMISSION_CONTROL", "false").lower() == "true"
+app.config["ADMISSION_LIMITS"] = {
+    route_class.strip(): int(limit)
+    for route_class, limit in (
+        item.split("=") for item in os.environ.get("ADMISSION_LIMITS", "read=32,write=8,export=2").split(",") if item
+    )
+}
+app.config["ADMISSION_QUEUE_TIMEOUT"] = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 0.5))
+app.config["ADMISSION_RATE"] = float(os.environ.get("ADMISSION_RATE", 20))
+app.config["ADMISSION_BURST"] = float(os.environ.get("ADMISSION_BURST", 40))
+# How many proxies (e.g. a load balancer) are in front of the app. Their X-Forwarded-For headers
+# are trusted this many hops back, so that clients are told apart by their own addresses, for rate
+# limiting and the audit log, rather than all sharing the nearest proxy's.
+app.config["PROXY_HOPS"] = int(os.environ.get("PROXY_HOPS", 0))
+# For a SQLite database (e.g. sqlite:////var/lib/panda/panda.db): how long, in milliseconds, to wait
+# for another process's write to finish, and how much of the database file, in bytes, to memory map
+app.config["SQLITE_BUSY_TIMEOUT"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))
+app.config["SQLITE_MMAP_SIZE"] = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# Profiling, off by default. Requests with an X-Profile-Token header matching PROFILE_TOKEN are
+# profiled, as is a random PROFILE_SAMPLE_RATE fraction of all requests. The most recent PROFILE_KEEP
+# profiles are kept in PROFILE_DIRECTORY, and listed by /admin/profiles, given the token.
+app.config["PROFILE_TOKEN"] = os.environ.get("PROFILE_TOKEN")
+app.config["PROFILE_SAMPLE_RATE"] = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+app.config["PROFILE_DIRECTORY"] = os.environ.get("PROFILE_DIRECTORY", "profiles")
+app.config["PROFILE_KEEP"] = int(os.environ.get("PROFILE_KEEP", 200))
+# Who read or changed which patients and appointments is recorded to AUDIT_LOG: "database" (the
+# audit_event table), "file" (newline-delimited JSON at AUDIT_FILE, rotated at AUDIT_FILE_MAX_BYTES),
+# or "none". The user is taken from the AUDIT_USER_HEADER header, which whatever authenticates
+# requests should set. Events are queued in memory (up to AUDIT_QUEUE_SIZE of them) and written in
+# the background, AUDIT_BATCH_SIZE at a time, waiting up to AUDIT_FLUSH_INTERVAL seconds to fill a
+# batch. A request waits up to AUDIT_QUEUE_TIMEOUT seconds for space in a full queue. Events that
+# can't be written, even one at a time, are written to AUDIT_DEAD_LETTER_FILE instead.
+app.config["AUDIT_LOG"] = os.environ.get("AUDIT_LOG", "database")
+app.config["AUDIT_USER_HEADER"] = os.environ.get("AUDIT_USER_HEADER", "X-User")
+app.config["AUDIT_FILE"] = os.environ.get("AUDIT_FILE", "audit/audit-{pid}.ndjson")
+app.config["AUDIT_FILE_MAX_BYTES"] = int(os.environ.get("AUDIT_FILE_MAX_BYTES", 100 * 1024 * 1024))
+app.config["AUDIT_FILE_BACKUPS"] = int(os.environ.get("AUDIT_FILE_BACKUPS", 10))
+app.config["AUDIT_QUEUE_SIZE"] = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+app.config["AUDIT_BATCH_SIZE"] = int(os.environ.get("AUDIT_BATCH_SIZE", 500))
+app.config["AUDIT_FLUSH_INTERVAL"] = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 0.5))
+app.config["AUDIT_QUEUE_TIMEOUT"] = float(os.environ.get("AUDIT_QUEUE_TIMEOUT", 0.1))
+app.config["AUDIT_DEAD_LETTER_FILE"] = os.environ.get("AUDIT_DEAD_LETTER_FILE", "audit/dead-letter-{pid}.ndjson")
+
+replica_router = ReplicaRouter(
+    check_interval=app.config["REPLICA_CHECK_INTERVAL"], max_lag=app.config["REPLICA_MAX_LAG"]
+)
+
+
+class RoutingSession(Session):
+    """A session which sends the reads of GET requests to a read replica, if there is a healthy one.
+
+    Everything else goes to the primary: writes, reads by other requests, and any reads in a GET
+    request after it has written something, so that it sees its own writes. Anything that must not
+    miss a recent write can pin the session to the primary with use_primary.
+
+    A replica is chosen once per request, and all its reads go there, so that they see the data as
+    of one moment, rather than as of each replica's lag in turn.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.reads_from_replica():
+            if "replica" not in self.info:
+                self.info["replica"] = replica_router.choose()
+            if self.info["replica"] is not None:
+                return self.info["replica"]
+
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def reads_from_replica(self) -> bool:
+        return (
+            not self._flushing
+            and not self.info.get("use_primary")
+            and has_request_context()
+            and is_read_request()
+        )
+
+
+# POST endpoints which only read, and so are treated like GETs
+READ_ONLY_ENDPOINTS = {"batch_get_patients", "batch_get_appointments"}
+
+
+def is_read_request() -> bool:
+    return request.method in ("GET", "HEAD") or request.endpoint in READ_ONLY_ENDPOINTS
+
+
+shard_router = ShardRouter(
+    [f"shard_{i}" for i in range(len(app.config["SQLALCHEMY_SHARD_URIS"]))],
+    # Appointments are kept with their patient
+    keys={"patient": "nhs_number", "appointment": "patient"},
+)
+
+
+class ShardingSession(ShardedSession, Session):
+    """A session which keeps patients and appointments in the shard chosen by shard_router.
+
+    Reads that don't say which patients they are for are sent to every shard in turn, and the rows
+    from each are put together. Anything that relies on the order of those rows must sort them
+    again, with gather_sorted. Read replicas aren't used, as each shard is its own primary.
+    """
+
+    def __init__(self, db, **kwargs):
+        shards = {shard_id: db.engines[shard_id] for shard_id in shard_router.shard_ids}
+        shards[shard_router.default] = db.engine
+        super().__init__(db=db, shards=shards, **shard_router.session_options(), **kwargs)
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = shard_router.default
+        elif mapper is not None:
+            mapper = inspect(mapper)
+
+        return super().get_bind(mapper, shard_id=shard_id, instance=instance, clause=clause, **kwargs)
+
+
+db = SQLAlchemy(
+    app, session_options={"class_": ShardingSession if len(shard_router) else RoutingSession}
+)
+
+with app.app_context():
+    for bind_key in app.config["SQLALCHEMY_BINDS"]:
+        if bind_key.startswith("replica_"):
+            replica_router.add(bind_key, db.engines[bind_key])
+
+    # SQLite, for running on a single machine without a database server
+    for engine in db.engines.values():
+        if engine.dialect.name == "sqlite":
+            apply_pragmas(
+                engine,
+                sqlite_pragmas(
+                    busy_timeout=app.config["SQLITE_BUSY_TIMEOUT"], mmap_size=app.config["SQLITE_MMAP_SIZE"]
+                ),
+            )
+
+    if db.engine.dialect.name == "sqlite":
+        # Without this, threads that write at once fight over SQLite's lock, rather than queueing
+        SingleWriter(timeout=app.config["SQLITE_BUSY_TIMEOUT"] / 1000).attach(db.session.session_factory.class_)
+
+
+def use_primary():
+    """Send the rest of this request's reads to the primary, rather than a replica."""
+    db.session.info["use_primary"] = True
+
+
+@app.teardown_request
+def forget_replica(exception):
+    # The next request, even in the same session, chooses its own
+    db.session.info.pop("replica", None)
+
+
+# Patient names are searched through a trigram index, where Postgres has the pg_trgm extension to
+# provide one. It isn't part of the models, as not every database can create it.
+PATIENT_SEARCH_INDEX = "ix_patient_search_key_trgm"
+
+
+def include_in_migrations(object, name, type_, reflected, compare_to):
+    return not (type_ == "index" and name == PATIENT_SEARCH_INDEX)
+
+
+# Flask-Migrate pulls in alembic, which is slow to import and only used by the `flask db` commands,
+# so it is only set up when the app is loaded by the flask CLI, and not when it is being served.
+if click.get_current_context(silent=True) is not None:
+    from flask_migrate import Migrate
+
+    # Migrations are written as batch operations, which SQLite needs to change a table
+    migrate = Migrate(app, db, include_object=include_in_migrations, render_as_batch=True)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# When the process started, or the container if the entrypoint says, to report how long it takes to
+# serve its first request
+if "PANDA_START_TIME" in os.environ:
+    started_at = datetime.fromtimestamp(float(os.environ["PANDA_START_TIME"]), timezone.utc)
+else:
+    started_at = utcnow()
+first_request_served = False
+
+
+@app.after_request
+def report_time_to_first_request(response):
+    global first_request_served
+    if not first_request_served:
+        first_request_served = True
+        startup_time = (utcnow() - started_at).total_seconds()
+        logger.info(f"Served the first request {startup_time:.2f} seconds after starting up")
+    return response
+
+
+if app.config["PROXY_HOPS"]:
+    hops = app.config["PROXY_HOPS"]
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+if app.config["ADMISSION_CONTROL"]:
+    app.extensions["admission"] = AdmissionController(
+        app.config["ADMISSION_LIMITS"],
+        queue_timeout=app.config["ADMISSION_QUEUE_TIMEOUT"],
+        rate=app.config["ADMISSION_RATE"],
+        burst=app.config["ADMISSION_BURST"],
+    )
+
+
+def route_class() -> str:
+    """Which class of route the request is for, for admission control."""
+    if request.path.startswith("/events"):
+        return "stream"
+    if request.path.startswith("/export/"):
+        return "export"
+    if is_read_request():
+        return "read"
+    return "write"
+
+
+@app.before_request
+def admit_request():
+    controller = app.extensions.get("admission")
+    if controller is None:
+        return None
+
+    admission = controller.admit(route_class(), request.remote_addr)
+    if not admission.admitted:
+        response = jsonify({"message": admission.message})
+        response.status_code = admission.status
+        response.headers["Retry-After"] = retry_after_header(admission.retry_after)
+        return response
+
+    g.admission = admission
+
+
+@app.after_request
+def release_admission_on_close(response):
+    # Streamed responses are still being handled until they are closed
+    admission = g.pop("admission", None)
+    if admission is not None:
+        response.call_on_close(admission.release)
+    return response
+
+
+@app.teardown_request
+def release_admission(exception):
+    # If the request failed before it had a response
+    admission = g.pop("admission", None)
+    if admission is not None:
+        admission.release()
+
+
+if app.config["PROFILE_TOKEN"] or app.config["PROFILE_SAMPLE_RATE"] > 0:
+    app.extensions["profiles"] = ProfileStore(app.config["PROFILE_DIRECTORY"], keep=app.config["PROFILE_KEEP"])
+
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+def has_profile_token() -> bool:
+    token = app.config["PROFILE_TOKEN"]
+    given = request.headers.get("X-Profile-Token")
+    return bool(token) and given is not None and hmac.compare_digest(given, token)
+
+
+@app.before_request
+def start_profiling():
+    profiles = app.extensions.get("profiles")
+    if profiles is None or request.path.startswith("/admin/"):
+        return None
+
+    if has_profile_token():
+        trigger = "header"
+    elif random.random() < app.config["PROFILE_SAMPLE_RATE"]:
+        trigger = "sampled"
+    else:
+        return None
+
+    profiler = CallProfiler()
+    g.profile = (profiles.new_id(), trigger, profiler, utcnow())
+    profiler.start()
+
+
+@app.after_request
+def tell_profile_id(response):
+    profile = g.get("profile")
+    if profile is not None:
+        profile_id, trigger = profile[:2]
+        if trigger == "header":
+            response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+@app.teardown_request
+def save_profile(exception):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+
+    profile_id, trigger, profiler, started = profile
+    profiler.stop()
+    duration = (utcnow() - started).total_seconds()
+    try:
+        app.extensions["profiles"].save(
+            profile_id,
+            profiler.folded(),
+            {
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "trigger": trigger,
+                "duration_ms": round(duration * 1000, 3),
+                "captured_at": started.isoformat(),
+            },
+        )
+        logger.info(f"Profiled {request.method} {request.path} in {duration * 1000:.1f}ms as {profile_id}")
+    except OSError as e:
+        logger.error(f"Failed to save the profile of {request.method} {request.path}: {e}")
 
 
 class Patient(db.Model):
     nhs_number = db.Column(db.String(10), primary_key=True)
     name = db.Column(db.String(255), nullable=False)
-    date_of_birth = db.Column(db.Date, nullable=False)
+    # The name, normalized by normalize_name for searching
+    search_key = db.Column(db.String(255), nullable=False)
+    date_of_birth = db.Column(ISODate, nullable=False)
     postcode = db.Column(db.String(10), nullable=False)
+    # Bumped on every UPDATE, and checked in the WHERE clause so that concurrent writers can't
+    # silently overwrite each other
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    # When the record was last written, so that clients can sync just what has changed
+    updated_at = db.Column(UTCDateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = (db.Index("ix_patient_updated_at", "updated_at", "nhs_number"),)
+
+    @validates("name")
+    def update_search_key(self, key, name):
+        self.search_key = normalize_name(name)
+        return name
 
     def __repr__(self):
         return "<Patient {}>".format(self.nhs_number)
@@ -41,18 +454,157 @@ class Patient(db.Model):
             "name": self.name,
             "date_of_birth": self.date_of_birth.isoformat(),
             "postcode": self.postcode,
+            "version": self.version,
         }
 
 
+@event.listens_for(Patient.__table__, "after_create")
+def create_patient_search_index(target, connection, **kw):
+    if connection.dialect.name != "postgresql":
+        return
+
+    available = connection.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar()
+    if not available:
+        logger.warning("The pg_trgm extension is not available, so patient search will not be indexed")
+        return
+
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(
+        text(
+            f"CREATE INDEX IF NOT EXISTS {PATIENT_SEARCH_INDEX} ON patient USING gin (search_key gin_trgm_ops)"
+        )
+    )
+
+
+class Clinician(db.Model):
+    """A clinician, whose appointments refer to them by ID rather than repeating their name."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+
+
+class Department(db.Model):
+    """A department, which appointments refer to by ID, as for Clinician."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+
+
+def copy_name_to_shards(table):
+    """Make an on_create for a NameLookup, which copies each new name into every shard.
+
+    Each shard keeps its own copy of the clinicians and departments, with the IDs given by the
+    primary, so that its appointments can refer to them and be joined to them in the shard.
+    """
+
+    def on_create(session, name, id):
+        if not isinstance(session, ShardingSession):
+            return
+        for shard_id in shard_router.shard_ids:
+            dialect = session.get_bind(shard_id=shard_id).dialect.name
+            session.execute(
+                INSERTS[dialect](table).values(id=id, name=name).on_conflict_do_nothing(),
+                bind_arguments={"shard_id": shard_id},
+            )
+
+    return on_create
+
+
+clinician_names = NameLookup(Clinician, on_create=copy_name_to_shards(Clinician.__table__))
+department_names = NameLookup(Department, on_create=copy_name_to_shards(Department.__table__))
+# On every session, not just the app's, so that the CLI's and tests' sessions can add names too
+clinician_names.attach(OrmSession)
+department_names.attach(OrmSession)
+
+
 class Appointment(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
     patient = db.Column(db.String(10), nullable=False)
     status = db.Column(db.String(50), nullable=False)
-    time = db.Column(db.DateTime(timezone=True), nullable=False)
+    time = db.Column(UTCDateTime, nullable=False)
     duration = db.Column(db.String(10), nullable=False)
-    clinician = db.Column(db.String(255), nullable=False)
-    department = db.Column(db.String(255), nullable=False)
+    # Given and returned as names, through the clinician and department properties below
+    clinician_id = db.Column(db.Integer, db.ForeignKey("clinician.id"), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey("department.id"), nullable=False)
     postcode = db.Column(db.String(10), nullable=False)
+    # Derived from time + duration on every write, so that appointments can be compared in the database
+    end_time = db.Column(UTCDateTime, nullable=False)
+    # See Patient.version
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    # See Patient.updated_at
+    updated_at = db.Column(UTCDateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = (
+        # Used to look for double bookings. Putting end_time before time means that the index scan
+        # for "ends after this starts, and starts before this ends" only covers the appointments
+        # that end after the new one starts, not the clinician's whole history.
+        db.Index("ix_appointment_clinician_end_time", "clinician_id", "end_time", "time"),
+        # Used to find the clinicians working in a department
+        db.Index("ix_appointment_department_clinician", "department_id", "clinician_id"),
+        db.Index("ix_appointment_updated_at", "updated_at", "id"),
+    )
+
+    # The names of the clinician and department are looked up from their IDs, which are cached.
+    # Names that aren't cached yet are kept until the appointment is flushed, then looked up, and
+    # added to their table if they're new, by resolve_appointment_names. In queries, these compare
+    # the names with a subquery per row, so filter on the IDs (e.g. from clinician_names) or join
+    # to Clinician and Department instead wherever that matters.
+    @hybrid_property
+    def clinician(self):
+        return self.get_name("clinician", clinician_names)
+
+    @clinician.setter
+    def clinician(self, name):
+        self.set_name("clinician", clinician_names, name)
+
+    @clinician.expression
+    def clinician(cls):
+        return db.select(Clinician.name).where(Clinician.id == cls.clinician_id).scalar_subquery()
+
+    @hybrid_property
+    def department(self):
+        return self.get_name("department", department_names)
+
+    @department.setter
+    def department(self, name):
+        self.set_name("department", department_names, name)
+
+    @department.expression
+    def department(cls):
+        return db.select(Department.name).where(Department.id == cls.department_id).scalar_subquery()
+
+    def get_name(self, field: str, lookup):
+        pending = self.__dict__.get("_pending_names", {})
+        if field in pending:
+            return pending[field]
+        return lookup.name_for(object_session(self) or db.session, getattr(self, f"{field}_id"))
+
+    def set_name(self, field: str, lookup, name: str):
+        pending = self.__dict__.setdefault("_pending_names", {})
+        id = lookup.cached_id(name)
+        if id is not None:
+            pending.pop(field, None)
+            setattr(self, f"{field}_id", id)
+            return
+
+        pending[field] = name
+        if inspect(self).persistent:
+            # Nothing mapped has changed yet, so make sure the flush still sees the appointment
+            flag_modified(self, f"{field}_id")
+
+    def resolve_names(self, session):
+        """Set the IDs of any names given since the last flush, adding the names that are new."""
+        pending = self.__dict__.get("_pending_names")
+        if not pending:
+            return
+
+        lookups = {"clinician": clinician_names, "department": department_names}
+        for field, name in list(pending.items()):
+            setattr(self, f"{field}_id", lookups[field].id_for(session, name, create=True))
+            del pending[field]
 
     def serialize(self):
         return {
@@ -64,623 +616,3417 @@ class Appointment(db.Model):
             "clinician": self.clinician,
             "department": self.department,
             "postcode": self.postcode,
+            "version": self.version,
         }
 
 
-@app.route("/")
-def home():
-    try:
-        conn = db.engine.connect()
+class ArchivedAppointment(db.Model):
+    """Where to find an appointment which has been moved out of the database, into an archive file."""
 
-        # Execute SQL query using SQLAlchemy
-        logger.debug("Executing test SQL query...")
-        result = conn.execute(
-            text(
-                "SELECT table_name FROM information_schema.tables WHERE table_schema='public';"
-            )
-        )
-        logger.debug("SQL query executed!")
+    id = db.Column(db.String(36), primary_key=True)
+    # The file name of the archive, within the ARCHIVE_DIRECTORY
+    archive = db.Column(db.String(255), nullable=False)
+    # Where the chunk holding the appointment starts in the archive
+    chunk_offset = db.Column(db.BigInteger, nullable=False)
+    archived_at = db.Column(UTCDateTime, nullable=False, default=utcnow)
 
-        # Fetch all tables
-        tables = [row for row in result]
-        logger.debug("Fetched all tables!")
 
-        return render_template("home.html", tables=tables)
+def get_archived_appointments(ids) -> dict:
+    """Read archived appointments back from their archives, keyed by ID. IDs that aren't archived are left out.
 
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        return str(e)
+    Each chunk of an archive that holds any of the appointments is only read once.
+    """
+    chunks = {}
+    for archived in fetch_by_ids(ArchivedAppointment, ArchivedAppointment.id, ids).values():
+        chunks.setdefault((archived.archive, archived.chunk_offset), set()).add(archived.id)
+
+    appointments = {}
+    for (archive, offset), chunk_ids in chunks.items():
+        path = os.path.join(app.config["ARCHIVE_DIRECTORY"], archive)
+        for record in read_archive_chunk(path, offset):
+            if record["id"] in chunk_ids:
+                appointments[record["id"]] = record
+
+    return appointments
+
+
+def get_archived_appointment(id):
+    """Read an archived appointment back from its archive. Returns None if it isn't archived."""
+    return get_archived_appointments([id]).get(id)
+
+
+class AuditEvent(db.Model):
+    """A record of someone reading or changing a patient or appointment. Rows are only ever added."""
+
+    # SQLite only numbers rows itself for an INTEGER primary key
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    at = db.Column(UTCDateTime, nullable=False)
+    # Who, as given by the AUDIT_USER_HEADER header, and where from
+    actor = db.Column(db.String(255))
+    address = db.Column(db.String(45))
+    # "read", "create", "update" or "delete"
+    action = db.Column(db.String(10), nullable=False)
+    # "patient" or "appointment", and its NHS number or ID, or "*" for many of them at once
+    kind = db.Column(db.String(20), nullable=False)
+    key = db.Column(db.String(36), nullable=False)
+    endpoint = db.Column(db.String(100))
+    # For reads of many records at once, like exports, the query string they were chosen by
+    filters = db.Column(db.String(500))
+
+    __table_args__ = (
+        # For finding everyone who has seen a patient's records
+        db.Index("ix_audit_event_kind_key_at", "kind", "key", "at"),
+        db.Index("ix_audit_event_at", "at"),
+    )
 
 
-# POST /patients/ - Add a new patient
-@app.route("/patients/", methods=["POST"])
-def add_patient():
-    """
-    Handles the POST request to add a new patient to the database.
+# The database refuses to change or delete audit events, whoever asks. Alembic doesn't compare
+# triggers, so the migrations create this themselves.
+AUDIT_APPEND_ONLY_TRIGGERS = {
+    "postgresql": [
+        "CREATE OR REPLACE FUNCTION audit_event_append_only() RETURNS trigger AS $$ "
+        "BEGIN RAISE EXCEPTION 'Audit events can not be changed or deleted'; END; $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER audit_event_append_only BEFORE UPDATE OR DELETE ON audit_event "
+        "FOR EACH ROW EXECUTE FUNCTION audit_event_append_only()",
+    ],
+    "sqlite": [
+        "CREATE TRIGGER audit_event_no_update BEFORE UPDATE ON audit_event "
+        "BEGIN SELECT RAISE(ABORT, 'Audit events can not be changed or deleted'); END",
+        "CREATE TRIGGER audit_event_no_delete BEFORE DELETE ON audit_event "
+        "BEGIN SELECT RAISE(ABORT, 'Audit events can not be changed or deleted'); END",
+    ],
+}
+
+
+@event.listens_for(AuditEvent.__table__, "after_create")
+def create_audit_append_only_triggers(target, connection, **kw):
+    for statement in AUDIT_APPEND_ONLY_TRIGGERS.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+
+if app.config["AUDIT_LOG"] != "none":
+    if app.config["AUDIT_LOG"] == "file":
+        audit_writer = RotatingFileWriter(
+            app.config["AUDIT_FILE"],
+            max_bytes=app.config["AUDIT_FILE_MAX_BYTES"],
+            backups=app.config["AUDIT_FILE_BACKUPS"],
+        )
+    else:
+        with app.app_context():
+            audit_writer = database_writer(db.engine, AuditEvent.__table__)
+
+    app.extensions["audit"] = AuditLog(
+        audit_writer,
+        max_queue=app.config["AUDIT_QUEUE_SIZE"],
+        batch_size=app.config["AUDIT_BATCH_SIZE"],
+        flush_interval=app.config["AUDIT_FLUSH_INTERVAL"],
+        put_timeout=app.config["AUDIT_QUEUE_TIMEOUT"],
+        dead_letter=RotatingFileWriter(
+            app.config["AUDIT_DEAD_LETTER_FILE"],
+            max_bytes=app.config["AUDIT_FILE_MAX_BYTES"],
+            backups=app.config["AUDIT_FILE_BACKUPS"],
+        ),
+    )
+    # Write out what is still queued when the worker exits
+    atexit.register(app.extensions["audit"].close)
+
+
+def audit_event(action: str, kind: str, key: str, filters: str = None) -> dict:
+    """Describe the current request reading or changing a record, for the audit log."""
+    event = {
+        "at": utcnow(),
+        "actor": request.headers.get(app.config["AUDIT_USER_HEADER"]),
+        "address": request.remote_addr,
+        "action": action,
+        "kind": kind,
+        "key": key,
+        "endpoint": request.endpoint,
+        "filters": filters,
+    }
+    # Whatever the client sent is cut to fit its column, as one event that can't be written would
+    # fail the whole batch it is in
+    for column in ["actor", "address", "key", "endpoint", "filters"]:
+        if event[column] is not None:
+            event[column] = event[column][: AuditEvent.__table__.c[column].type.length]
+    return event
 
-    Endpoint: `/patients/`
-    Method: POST
 
-    Description:
-    This endpoint is responsible for adding a new patient record to the database.
-    It first checks whether the NHS number is already taken. If it is, a 409 Conflict
-    response is returned. It then validates the NHS number and the postcode. If either
-    is invalid, a 400 Bad Request response is returned. If all validations pass, a new
-    patient record is created, added to the database, and a 201 Created response is returned.
+def audit_reads(kind: str, keys):
+    """Record that the current request was sent the patients or appointments with these keys."""
+    audit_log = app.extensions.get("audit")
+    if audit_log is None:
+        return
 
-    Request Body:
-        - nhs_number (str): The NHS number of the patient, must be a 10-character string.
-        - name (str): The name of the patient.
-        - date_of_birth (str): The date of birth of the patient in YYYY-MM-DD format.
-        - postcode (str): The postcode of the patient.
+    for key in keys:
+        audit_log.record(audit_event("read", kind, key))
 
-    Responses:
-        - 201 Created: The patient record was successfully added to the database.
-        - 400 Bad Request: Returned if the NHS number or postcode is invalid.
-        - 409 Conflict: Returned if a patient with the provided NHS number already exists.
 
-    Example Request Body:
-    ```json
-    {
-        "nhs_number": "string (10 characters)",
-        "name": "string",
-        "date_of_birth": "YYYY-MM-DD",
-        "postcode": "string"
-    }
-    ```
+def audit_bulk_read(kind: str):
+    """Record that the current request was sent many patients or appointments, chosen by its query string.
 
-    Returns:
-        - JSON response with a message indicating the result of the operation.
+    Exports and syncs can send thousands of records, too many to record one by one, so the request
+    is recorded once, with the filters that say which records it was sent.
     """
-    logger.info(f"Adding a patient record...")
-    data = request.get_json()
-
-    # First, check that that NHS number is not taken
-    patient = db.session.get(Patient, data["nhs_number"])
-    if patient:
-        logger.info(
-            f"Patient record with NHS number: {data['nhs_number']} already exists"
-        )
-        return jsonify({"message": "Patient already exists"}), 409
+    audit_log = app.extensions.get("audit")
+    if audit_log is not None:
+        audit_log.record(audit_event("read", kind, "*", request.query_string.decode(errors="replace")))
+
+
+@event.listens_for(db.session, "after_flush")
+def stage_audit_events(session, flush_context):
+    # Changes made by the CLI, like archiving, aren't anyone's request, so aren't recorded
+    audit_log = app.extensions.get("audit")
+    if audit_log is None or not has_request_context():
+        return
+
+    for action, records in [("create", session.new), ("update", session.dirty), ("delete", session.deleted)]:
+        for record in records:
+            if isinstance(record, Patient):
+                kind, key = "patient", record.nhs_number
+            elif isinstance(record, Appointment):
+                kind, key = "appointment", record.id
+            else:
+                continue
 
-    # Validate the NHS number
-    if not validate_nhs_number(data["nhs_number"]):
-        logger.info(f"Invalid NHS number: {data['nhs_number']}")
-        return jsonify({"message": "Invalid NHS number"}), 400
+            if action == "update" and not session.is_modified(record):
+                continue
+            audit_log.stage(session, audit_event(action, kind, key))
 
-    # Format the postcode
-    data["postcode"] = format_postcode(data["postcode"])
-    if not data["postcode"]:
-        logger.info(f"[{data['nhs_number']}] Invalid postcode: {data['postcode']}")
-        return jsonify({"message": "Invalid postcode"}), 400
 
-    # Create the new patient record
-    new_patient = Patient(
-        nhs_number=data["nhs_number"],
-        name=data["name"],
-        date_of_birth=data["date_of_birth"],
-        postcode=data["postcode"],
-    )
-    logger.info(f"Adding patient record with NHS number: {new_patient.nhs_number}")
-    db.session.add(new_patient)
-    db.session.commit()
-    logger.info(f"Patient {new_patient.nhs_number} added successfully")
+@event.listens_for(db.session, "after_commit")
+def record_audit_events(session):
+    audit_log = app.extensions.get("audit")
+    if audit_log is not None:
+        audit_log.commit(session)
 
-    return jsonify({"message": "Patient added successfully"}), 201
 
+@event.listens_for(db.session, "after_rollback")
+def discard_audit_events(session):
+    audit_log = app.extensions.get("audit")
+    if audit_log is not None:
+        audit_log.rollback(session)
 
-# GET /patients/<id>/ - Retrieve details of a specific patient
-@app.route("/patients/<nhs_number>/", methods=["GET"])
-def get_patient(nhs_number):
-    """
-    Handles the GET request to retrieve details of a specific patient using the NHS number.
 
-    Endpoint: `/patients/<nhs_number>/`
-    Method: GET
+class Tombstone(db.Model):
+    """A record of a deleted patient or appointment, so that syncing clients can remove it too."""
 
-    Description:
-    This endpoint is responsible for retrieving and returning the details of a specific
-    patient from the database using the NHS number. If the patient is found, a JSON object
-    containing the patient's details is returned with a 200 OK response. If the patient is
-    not found, a 404 Not Found response is returned.
+    id = db.Column(db.Integer, primary_key=True)
+    # "patient" or "appointment"
+    kind = db.Column(db.String(20), nullable=False)
+    key = db.Column(db.String(36), nullable=False)
+    deleted_at = db.Column(UTCDateTime, nullable=False, default=utcnow)
 
-    Path Parameters:
-        - nhs_number (str): The NHS number of the patient to retrieve. Must be a 10-character string.
+    __table_args__ = (db.Index("ix_tombstone_deleted_at", "deleted_at", "id"),)
 
-    Responses:
-        - 200 OK: Successfully retrieved the patient details. The patient's details are returned
-                in the response body in JSON format.
-        - 404 Not Found: Returned if no patient record is found with the provided NHS number.
 
-    Returns:
-        - JSON response containing the patient's details if found.
+class DataMigrationCheckpoint(db.Model):
+    """How far a data migration has got, so that it can be resumed if it is interrupted."""
 
-    Example Response Body:
-    ```json
-    {
-        "nhs_number": "string (10 characters)",
-        "name": "string",
-        "date_of_birth": "YYYY-MM-DD",
-        "postcode": "string"
-    }
-    ```
-    """
-    logger.info(f"Retrieving patient record with NHS number: {nhs_number}")
-    patient = db.session.get(Patient, nhs_number)
+    name = db.Column(db.String(100), primary_key=True)
+    # The key of the last record done
+    position = db.Column(db.String(255))
+    # How many records have been visited, and how many of them were changed
+    records = db.Column(db.Integer, nullable=False, default=0)
+    changed = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(UTCDateTime, nullable=False, default=utcnow)
+    updated_at = db.Column(UTCDateTime, nullable=False, default=utcnow)
+    finished_at = db.Column(UTCDateTime)
 
-    if not patient:
-        logger.info(f"Patient record with NHS number: {nhs_number} not found")
-        return jsonify({"message": "Patient not found"}), 404
 
-    logger.debug(f"Found patient record with NHS number: {nhs_number}")
+# How many rows each count is split across. See AppointmentCounter.
+STATS_COUNTER_SLOTS = 16
 
-    return (
-        jsonify(patient.serialize()),
-        200,
-    )
 
+class AppointmentCounter(db.Model):
+    """A running count of the appointments on a day (in UTC), in a department, with a status.
 
-# PUT /patients/<id>/ - Update details of a specific patient
-@app.route("/patients/<nhs_number>/", methods=["PUT"])
-def update_patient(nhs_number):
+    Counts are kept up to date in the same transaction as every write, by update_stats_counters,
+    so that /stats/summary doesn't have to count the appointments. Each count is split across
+    STATS_COUNTER_SLOTS rows, and each transaction adds to one at random, so that concurrent writers
+    rarely wait on each other's row locks. The count is the sum of the slots.
     """
-    Handles the PUT request to update details of a specific patient using the NHS number.
 
-    Endpoint: `/patients/<nhs_number>/`
-    Method: PUT
+    day = db.Column(db.Date, primary_key=True)
+    department = db.Column(db.String(255), primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
 
-    Description:
-    This endpoint is responsible for updating the details of a specific patient in the
-    database using the NHS number. All fields in the request body are optional. If the
-    patient is found and the provided data is valid, the patient's details are updated,
-    and a 200 OK response is returned. If the patient is not found or if any provided
-    data is invalid, appropriate error responses are returned.
 
-    Path Parameters:
-        - nhs_number (str): The NHS number of the patient to update. Must be a 10-character string.
+class PatientCounter(db.Model):
+    """A running count of the patients, split across slots, as for AppointmentCounter."""
 
-    Request Body:
-        - name (str, optional): The new name of the patient.
-        - date_of_birth (str, optional): The new date of birth of the patient in YYYY-MM-DD format.
-        - postcode (str, optional): The new postcode of the patient.
+    slot = db.Column(db.SmallInteger, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
 
-    Responses:
-        - 200 OK: Successfully updated the patient details. A success message is returned in the response body.
-        - 400 Bad Request: Returned if any provided field is invalid, or the date of birth or postcode is invalid.
-        - 404 Not Found: Returned if no patient record is found with the provided NHS number.
 
-    Returns:
-        - JSON response with a message indicating the result of the operation.
+def appointment_counter_key(time, department, status):
+    if isinstance(time, str):
+        time = datetime.fromisoformat(time)
 
-    Example Request Body (all fields are optional):
-    ```json
-    {
-        "name": "string",
-        "date_of_birth": "YYYY-MM-DD",
-        "postcode": "string"
-    }
-    ```
-    """
+    return (time.astimezone(timezone.utc).date(), department, status)
 
-    logger.info(f"Updating patient record with NHS number: {nhs_number}")
-    patient = db.session.get(Patient, nhs_number)
-    try:
-        if not patient:
-            logger.info(f"Patient record with NHS number: {nhs_number} not found")
-            return jsonify({"message": "Patient not found"}), 404
 
-        logger.info(f"Found patient record with NHS number: {nhs_number}")
-        data: dict = request.get_json()
+def add_to_stats_counters(connection, appointments: Counter, patients: int):
+    """Add to the appointment counts, keyed by appointment_counter_key, and the count of patients."""
+    slot = random.randrange(STATS_COUNTER_SLOTS)
+    add_to_counts(
+        connection,
+        AppointmentCounter.__table__,
+        [
+            {"day": day, "department": department, "status": status, "slot": slot, "count": count}
+            for (day, department, status), count in sorted(appointments.items())
+            if count
+        ],
+    )
+    if patients:
+        add_to_counts(connection, PatientCounter.__table__, [{"slot": slot, "count": patients}])
 
-        # Can we update the NHS number?
-        # patient.nhs_number = data["nhs_number"]
 
-        # If we got a postcode, make sure it's valid
-        if "postcode" in data:
-            data["postcode"] = format_postcode(data["postcode"])
+@event.listens_for(db.session, "after_flush")
+def update_stats_counters(session, flush_context):
+    # The session still lists what was flushed, with the values appointments had before
+    appointments = Counter()
+    patients = 0
+    for record in session.new:
+        if isinstance(record, Appointment):
+            appointments[appointment_counter_key(record.time, record.department, record.status)] += 1
+        elif isinstance(record, Patient):
+            patients += 1
 
-            # And if it's not, return an error
-            if not data["postcode"]:
-                logger.info(f"[{nhs_number}] Invalid postcode: {data['postcode']}")
-                return jsonify({"message": "Invalid postcode"}), 400
+    for record in chain(session.dirty, session.deleted):
+        if not isinstance(record, Appointment):
+            continue
 
-        # Default to the existing value if the new value is not provided
-        fields = ["name", "date_of_birth", "postcode"]
-        for field in data.keys():
-            if field not in fields:
-                return jsonify({"message": "Invalid field"}), 400
+        state = inspect(record)
+        old = {}
+        for field in ["time", "department_id", "status"]:
+            history = state.attrs[field].history
+            old[field] = history.deleted[0] if history.deleted else getattr(record, field)
+        old["department"] = department_names.name_for(session, old.pop("department_id"))
 
-        for field in fields:
-            if field in data:
-                logger.info(
-                    f"Updating patient record field: {field} from {getattr(patient, field)} to {data[field]}"
-                )
-                setattr(patient, field, data[field])
+        appointments[appointment_counter_key(**old)] -= 1
+        if record not in session.deleted:
+            appointments[appointment_counter_key(record.time, record.department, record.status)] += 1
 
-        db.session.commit()
+    patients -= sum(isinstance(record, Patient) for record in session.deleted)
+
+    if any(appointments.values()) or patients:
+        add_to_stats_counters(session.connection(), appointments, patients)
+
+
+@event.listens_for(db.session, "before_flush")
+def pin_writes_to_primary(session, flush_context, instances):
+    # Once a request has written something, it reads from the primary so that it sees it
+    session.info["use_primary"] = True
+
+
+@event.listens_for(db.session, "before_flush")
+def record_tombstones(session, flush_context, instances):
+    for record in session.deleted:
+        if isinstance(record, Patient):
+            session.add(Tombstone(kind="patient", key=record.nhs_number))
+        elif isinstance(record, Appointment):
+            session.add(Tombstone(kind="appointment", key=record.id))
+
+
+@event.listens_for(OrmSession, "before_flush")
+def resolve_appointment_names(session, flush_context, instances):
+    for appointment in chain(session.new, session.dirty):
+        if isinstance(appointment, Appointment):
+            appointment.resolve_names(session)
+
+
+def appointment_end_time(appointment) -> datetime:
+    """Calculate the time an appointment finishes, from its start time and duration."""
+    start_time = appointment.time
+    if isinstance(start_time, str):
+        start_time = datetime.fromisoformat(start_time)
+
+    return start_time + parse_duration(appointment.duration)
+
+
+@event.listens_for(Appointment, "before_insert")
+@event.listens_for(Appointment, "before_update")
+def set_appointment_end_time(mapper, connection, appointment):
+    appointment.end_time = appointment_end_time(appointment)
+
+
+def find_clinician_conflict(appointment_id, clinician, start_time, end_time):
+    """Find an appointment that overlaps the given time slot for the clinician.
+
+    Cancelled appointments don't occupy the clinician, and the appointment being written is
+    excluded so that it doesn't conflict with itself. Returns the first conflicting Appointment,
+    or None if the clinician is free.
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        # Serialise bookings for the same clinician until this transaction ends, so that two
+        # concurrent requests can't both see the same free slot and book it.
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:clinician))"),
+            {"clinician": clinician},
+        )
+
+    clinician_id = clinician_names.id_for(db.session, clinician)
+    if clinician_id is None:
+        # A new clinician has nothing booked yet
+        return None
+
+    # Don't flush the appointment being written before we've decided whether to keep it
+    with db.session.no_autoflush:
+        return db.session.execute(
+            db.select(Appointment)
+            .where(
+                Appointment.clinician_id == clinician_id,
+                Appointment.end_time > start_time,
+                Appointment.time < end_time,
+                Appointment.status != "cancelled",
+                Appointment.id != appointment_id,
+            )
+            .limit(1)
+        ).scalar()
+
+
+# Each clinician's (non-cancelled) bookings for a UTC day, keyed by (clinician, date)
+availability_cache = TTLCache(ttl=app.config["AVAILABILITY_CACHE_TTL"])
+
+# The longest window that can be searched for free slots in one request
+MAX_AVAILABILITY_WINDOW = timedelta(days=31)
+
+
+def availability_cache_keys(clinician, start_time, end_time):
+    """List the (clinician, date) availability cache keys that a time slot falls into."""
+    if isinstance(start_time, str):
+        start_time = datetime.fromisoformat(start_time)
+
+    day = start_time.astimezone(timezone.utc).date()
+    last_day = max(day, (end_time - timedelta(microseconds=1)).astimezone(timezone.utc).date())
+
+    keys = []
+    while day <= last_day:
+        keys.append((clinician, day))
+        day += timedelta(days=1)
+
+    return keys
+
+
+@event.listens_for(db.session, "before_flush")
+def collect_availability_changes(session, flush_context, instances):
+    """Note which clinician-days each appointment about to be flushed was and will be booked for."""
+    keys = session.info.setdefault("availability_keys", set())
+    for appointment in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(appointment, Appointment):
+            continue
+
+        # The end time isn't recalculated until the appointment is flushed, so is still the old one
+        if appointment.end_time is not None:
+            state = inspect(appointment)
+            old = {}
+            for field in ["clinician_id", "time"]:
+                history = state.attrs[field].history
+                old[field] = history.deleted[0] if history.deleted else getattr(appointment, field)
+            old["clinician"] = clinician_names.name_for(session, old.pop("clinician_id"))
+
+            keys.update(
+                availability_cache_keys(old["clinician"], old["time"], appointment.end_time)
+            )
+
+        keys.update(
+            availability_cache_keys(
+                appointment.clinician, appointment.time, appointment_end_time(appointment)
+            )
+        )
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_availability_cache(session):
+    availability_cache.invalidate(session.info.pop("availability_keys", ()))
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_availability_changes(session):
+    session.info.pop("availability_keys", None)
+
+
+def clinician_busy_intervals(clinicians, window_start, window_end) -> dict:
+    """Get the times that clinicians are booked for, within a window.
+
+    Bookings are cached per clinician per (UTC) day. Any clinician-days that aren't cached are
+    fetched from the database in a single range query, which covers all of the clinicians at once.
+
+    Returns a dictionary of clinician names to lists of (start, end) intervals. These are the
+    clinician's non-cancelled appointments on the days the window covers, so may extend outside it.
+    """
+    days = [key[1] for key in availability_cache_keys(None, window_start, window_end)]
+
+    busy = {clinician: [] for clinician in clinicians}
+    missing = {}
+    for clinician in clinicians:
+        for day in days:
+            cached = availability_cache.get((clinician, day))
+            if cached is None:
+                missing.setdefault(clinician, set()).add(day)
+            else:
+                busy[clinician].extend(cached)
+
+    if not missing:
+        return busy
+
+    # Fetch every missing day, from the first to the last, for every clinician with one missing
+    first_day = min(min(missing_days) for missing_days in missing.values())
+    last_day = max(max(missing_days) for missing_days in missing.values())
+    range_start = datetime.combine(first_day, datetime.min.time(), tzinfo=timezone.utc)
+    range_end = datetime.combine(
+        last_day + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc
+    )
+    logger.debug(f"Fetching bookings for {len(missing)} clinicians, {first_day} to {last_day}")
+
+    fetched = {
+        key: []
+        for clinician in missing
+        for key in availability_cache_keys(clinician, range_start, range_end)
+    }
+    rows = db.session.execute(
+        db.select(Appointment.time, Appointment.end_time, Clinician.name.label("clinician"))
+        .join(Clinician, Appointment.clinician_id == Clinician.id)
+        .where(
+            Clinician.name.in_(missing),
+            Appointment.end_time > range_start,
+            Appointment.time < range_end,
+            Appointment.status != "cancelled",
+        )
+    )
+    for row in rows:
+        for key in availability_cache_keys(row.clinician, row.time, row.end_time):
+            if key in fetched:
+                fetched[key].append((row.time, row.end_time))
+
+    for (clinician, day), intervals in fetched.items():
+        availability_cache.set((clinician, day), intervals)
+        if day in missing[clinician]:
+            busy[clinician].extend(intervals)
+
+    return busy
+
+
+def parse_query_time(value: str) -> datetime:
+    """Parse a time given in a query parameter. Times without a timezone are taken to be UTC."""
+    # A "+" in an unencoded query string is decoded as a space
+    parsed = datetime.fromisoformat(value.strip().replace(" ", "+"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def parse_availability_window():
+    """Parse the from, to, and length query parameters of an availability search.
+
+    `from` defaults to now, `to` to a week after `from`, and `length` to 15 minutes. Times without
+    a timezone are taken to be UTC.
+
+    Returns a (window_start, window_end, length) tuple, or None if the parameters are invalid.
+    """
+    try:
+        if "from" in request.args:
+            window_start = parse_query_time(request.args["from"])
+        else:
+            window_start = datetime.now(timezone.utc)
+
+        if "to" in request.args:
+            window_end = parse_query_time(request.args["to"])
+        else:
+            window_end = window_start + timedelta(days=7)
+    except ValueError:
+        return None
+
+    length = parse_duration(request.args.get("length", "15m"))
+
+    if window_end <= window_start or window_end - window_start > MAX_AVAILABILITY_WINDOW:
+        return None
+    if length <= timedelta(0):
+        return None
+
+    return window_start, window_end, length
+
+
+def serialize_free_intervals(intervals, tzinfo):
+    return [
+        {"start": start.astimezone(tzinfo).isoformat(), "end": end.astimezone(tzinfo).isoformat()}
+        for start, end in intervals
+    ]
+
+
+if app.config["CHANGE_FEED"] == "postgres":
+    change_feed = PostgresChangeFeed(app.config["SQLALCHEMY_DATABASE_URI"])
+else:
+    change_feed = LocalChangeFeed()
+
+# Whether or not admission control is on, as every stream ties up a thread
+event_streams = None
+if app.config["EVENTS_MAX_STREAMS"]:
+    event_streams = ConcurrencyLimit(app.config["EVENTS_MAX_STREAMS"], max_queue=0)
+
+
+def change_event(event_type: str, appointment) -> dict:
+    """Describe a change to an appointment, for the change feed."""
+    start_time = appointment.time
+    if isinstance(start_time, datetime):
+        start_time = start_time.isoformat()
+
+    return {
+        "event": event_type,
+        "id": appointment.id,
+        "patient": appointment.patient,
+        "status": appointment.status,
+        "time": start_time,
+        "clinician": appointment.clinician,
+        "department": appointment.department,
+        "version": appointment.version,
+    }
+
+
+@event.listens_for(db.session, "before_flush")
+def stage_deleted_appointment_events(session, flush_context, instances):
+    # Deleted appointments are described before they're gone
+    for appointment in session.deleted:
+        if isinstance(appointment, Appointment):
+            change_feed.stage(session, change_event("deleted", appointment))
+
+
+@event.listens_for(db.session, "after_flush")
+def stage_appointment_events(session, flush_context):
+    for appointment in session.new:
+        if isinstance(appointment, Appointment):
+            change_feed.stage(session, change_event("created", appointment))
+
+    for appointment in session.dirty:
+        if not isinstance(appointment, Appointment) or not session.is_modified(appointment):
+            continue
+
+        # Appointments passing without the patient attending get their own event
+        old_status = inspect(appointment).attrs.status.history.deleted
+        if old_status and old_status[0] != "missed" and appointment.status == "missed":
+            change_feed.stage(session, change_event("missed", appointment))
+        else:
+            change_feed.stage(session, change_event("updated", appointment))
+
+
+@event.listens_for(db.session, "after_commit")
+def publish_appointment_events(session):
+    change_feed.commit(session)
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_appointment_events(session):
+    change_feed.rollback(session)
+
+
+def encode_sync_cursor(positions: dict) -> str:
+    """Pack the position reached in each table into an opaque cursor string."""
+    data = {
+        table: [timestamp.isoformat(), key] for table, (timestamp, key) in positions.items()
+    }
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def decode_sync_cursor(cursor: str) -> dict:
+    """Unpack a cursor from encode_sync_cursor. Raises ValueError if the cursor is invalid."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {
+            table: (datetime.fromisoformat(data[table][0]), data[table][1])
+            for table in ["patients", "appointments", "deleted"]
+        }
+    except (TypeError, KeyError, IndexError, AttributeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid sync cursor: {e}")
+
+
+def changed_since(model, timestamp_column, key_column, position, limit):
+    """Fetch the rows of a table changed after a position, in order, through its timestamp index.
+
+    Returns up to limit rows, and whether there are more to come.
+    """
+    query = db.select(model).order_by(timestamp_column, key_column).limit(limit + 1)
+    if position is not None:
+        query = query.where(tuple_(timestamp_column, key_column) > tuple_(*position))
+
+    rows = db.session.execute(query).scalars().all()
+    if len(shard_router):
+        rows = gather_sorted(
+            rows, key=lambda row: (getattr(row, timestamp_column.key), getattr(row, key_column.key))
+        )
+    return rows[:limit], len(rows) > limit
+
+
+def settled_position(position, last_seen, minimum_key):
+    """Work out where the next sync of a table that we've caught up on should start from.
+
+    A write can be timestamped some time before it commits, so we might not have seen everything
+    timestamped shortly before the most recent change we did see. Rather than risk skipping those,
+    the next sync goes back to SYNC_SETTLE_TIME ago and re-sends anything changed since then.
+    """
+    horizon = (utcnow() - timedelta(seconds=app.config["SYNC_SETTLE_TIME"]), minimum_key)
+    if last_seen is not None and last_seen < horizon:
+        return last_seen
+
+    # Never move a cursor backwards past where an earlier sync had already got to
+    if position is not None and position > horizon:
+        return position
+
+    return horizon
+
+
+# Patient names, for databases that can't index them for search themselves
+patient_search_index = TrigramIndex()
+patient_search_index_lock = Lock()
+patient_search_index_watermark = None
+
+
+def refresh_patient_search_index():
+    """Bring the in-memory patient search index up to date with the database.
+
+    The first call loads every patient. After that, only the patients changed or deleted since the
+    last refresh are fetched, through the same indexes as /sync uses, so that changes made by other
+    workers are picked up too.
+    """
+    global patient_search_index_watermark
+
+    # A replica could be behind by more than the settle time, and we would skip what it's missing
+    use_primary()
+
+    with patient_search_index_lock:
+        patients = db.select(Patient.updated_at, Patient.nhs_number, Patient.search_key)
+        tombstones = db.select(Tombstone.deleted_at, Tombstone.key).where(
+            Tombstone.kind == "patient"
+        )
+
+        changes = []
+        if patient_search_index_watermark is None:
+            changes += [(row.updated_at, row.nhs_number, row.search_key) for row in db.session.execute(patients)]
+        else:
+            # Go back a little, to catch any writes that committed after we last looked
+            since = patient_search_index_watermark - timedelta(
+                seconds=app.config["SYNC_SETTLE_TIME"]
+            )
+            patients = patients.where(Patient.updated_at >= since)
+            tombstones = tombstones.where(Tombstone.deleted_at >= since)
+            changes += [(row.updated_at, row.nhs_number, row.search_key) for row in db.session.execute(patients)]
+            changes += [(row.deleted_at, row.key, None) for row in db.session.execute(tombstones)]
+
+        # Apply the changes in the order they were made, in case a patient was deleted and re-added
+        for changed_at, nhs_number, search_key in sorted(changes, key=lambda change: change[0]):
+            if search_key is None:
+                patient_search_index.remove(nhs_number)
+            else:
+                patient_search_index.add(nhs_number, search_key)
+
+            if patient_search_index_watermark is None or changed_at > patient_search_index_watermark:
+                patient_search_index_watermark = changed_at
+
+
+postcode_directory = None
+postcode_directory_lock = Lock()
+
+
+def is_known_postcode(postcode: str) -> bool:
+    """Check a formatted postcode against the POSTCODE_DIRECTORY, if there is one.
+
+    The directory is opened on first use, and shared by every request this worker handles.
+    Without a directory, every well-formed postcode is taken to exist.
+    """
+    global postcode_directory
+
+    path = app.config["POSTCODE_DIRECTORY"]
+    if not path:
+        return True
+
+    with postcode_directory_lock:
+        if postcode_directory is None or postcode_directory.path != path:
+            logger.info(f"Opening postcode directory {path}")
+            postcode_directory = PostcodeDirectory(path)
+
+    return postcode in postcode_directory
+
+
+# The most IDs a batch-get can ask for, and how many are fetched in each query
+BATCH_GET_MAX_IDS = 1000
+BATCH_GET_CHUNK_SIZE = 500
+
+
+def fetch_by_ids(model, key_column, ids) -> dict:
+    """Fetch the records with the given keys, with one IN query per BATCH_GET_CHUNK_SIZE of them.
+
+    Returns a dict of the records found, keyed by their key.
+    """
+    ids = list(ids)
+    records = {}
+    for i in range(0, len(ids), BATCH_GET_CHUNK_SIZE):
+        chunk = ids[i : i + BATCH_GET_CHUNK_SIZE]
+        for record in db.session.scalars(db.select(model).where(key_column.in_(chunk))):
+            records[getattr(record, key_column.key)] = record
+    return records
+
+
+def batch_get_ids():
+    """Read the IDs from the body of a batch-get request, in order and without duplicates.
+
+    Returns None if the body isn't a list of at most BATCH_GET_MAX_IDS string IDs.
+    """
+    data = request.get_json(silent=True)
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+        return None
+    if len(ids) > BATCH_GET_MAX_IDS:
+        return None
+
+    return list(dict.fromkeys(ids))
+
+
+def precondition_failed(record, if_match=None) -> bool:
+    """Check the request's If-Match header against the current version of a record.
+
+    Returns True if the client sent an If-Match header that does not match the record's version,
+    i.e. the client last saw an older copy of the record. Requests without If-Match always pass.
+    if_match can be given instead of the header, as the ETags it would hold.
+    """
+    if if_match is None:
+        if_match = request.if_match
+    if not if_match:
+        return False
+
+    return not if_match.contains(str(record.version))
+
+
+def versioned_response(record, status_code=200):
+    """Serialize a record into a JSON response, with its version as the ETag."""
+    response = jsonify(record.serialize())
+    response.status_code = status_code
+    response.set_etag(str(record.version))
+    return response
+
+
+@app.route("/")
+def home():
+    try:
+        # Inspect the database through SQLAlchemy, which knows how to list tables in each one
+        logger.debug("Listing the tables in the database...")
+        tables = [(table_name,) for table_name in inspect(db.engine).get_table_names()]
+        logger.debug("Fetched all tables!")
+
+        return render_template("home.html", tables=tables)
+
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+        return str(e)
+
+
+# POST /patients/ - Add a new patient
+@app.route("/patients/", methods=["POST"])
+def add_patient():
+    """
+    Handles the POST request to add a new patient to the database.
+
+    Endpoint: `/patients/`
+    Method: POST
+
+    Description:
+    This endpoint is responsible for adding a new patient record to the database.
+    It first checks whether the NHS number is already taken. If it is, a 409 Conflict
+    response is returned. It then validates the NHS number and the postcode. If either
+    is invalid, a 400 Bad Request response is returned. If all validations pass, a new
+    patient record is created, added to the database, and a 201 Created response is returned.
+
+    Request Body:
+        - nhs_number (str): The NHS number of the patient, must be a 10-character string.
+        - name (str): The name of the patient.
+        - date_of_birth (str): The date of birth of the patient in YYYY-MM-DD format.
+        - postcode (str): The postcode of the patient.
+
+    Responses:
+        - 201 Created: The patient record was successfully added to the database.
+        - 400 Bad Request: Returned if the NHS number or postcode is invalid.
+        - 409 Conflict: Returned if a patient with the provided NHS number already exists.
+
+    Example Request Body:
+    ```json
+    {
+        "nhs_number": "string (10 characters)",
+        "name": "string",
+        "date_of_birth": "YYYY-MM-DD",
+        "postcode": "string"
+    }
+    ```
+
+    Returns:
+        - JSON response with a message indicating the result of the operation.
+    """
+    logger.info(f"Adding a patient record...")
+    result, code = add_patient_record(request.get_json())
+    if code != 201:
+        return jsonify(result), code
+
+    db.session.commit()
+    logger.info(f"Patient {result['nhs_number']} added successfully")
+    return jsonify({"message": result["message"]}), code
+
+
+def add_patient_record(data: dict):
+    """Validate a new patient and add them to the session, without committing.
+
+    Returns the result, with a message, and its HTTP status code. Used by POST /patients/ and /batch.
+    """
+    # First, check that that NHS number is not taken
+    patient = db.session.get(Patient, data["nhs_number"])
+    if patient:
+        logger.info(
+            f"Patient record with NHS number: {data['nhs_number']} already exists"
+        )
+        return {"message": "Patient already exists"}, 409
+
+    # Validate the NHS number
+    if not validate_nhs_number(data["nhs_number"]):
+        logger.info(f"Invalid NHS number: {data['nhs_number']}")
+        return {"message": "Invalid NHS number"}, 400
+
+    # Format the postcode
+    data["postcode"] = format_postcode(data["postcode"])
+    if not data["postcode"]:
+        logger.info(f"[{data['nhs_number']}] Invalid postcode: {data['postcode']}")
+        return {"message": "Invalid postcode"}, 400
+    if not is_known_postcode(data["postcode"]):
+        logger.info(f"[{data['nhs_number']}] Unknown postcode: {data['postcode']}")
+        return {"message": "Unknown postcode"}, 400
+
+    # Create the new patient record
+    new_patient = Patient(
+        nhs_number=data["nhs_number"],
+        name=data["name"],
+        date_of_birth=data["date_of_birth"],
+        postcode=data["postcode"],
+    )
+    logger.info(f"Adding patient record with NHS number: {new_patient.nhs_number}")
+    db.session.add(new_patient)
+    return {"message": "Patient added successfully", "nhs_number": new_patient.nhs_number}, 201
+
+
+# GET /patients/search - Search for patients by name
+@app.route("/patients/search", methods=["GET"])
+def search_patients():
+    """
+    Handles the GET request to search for patients by name.
+
+    Endpoint: `/patients/search`
+    Method: GET
+
+    Description:
+    This endpoint finds the patients whose names contain every word of the query, in any order.
+    Both are normalized before being compared, so the search ignores case, accents on Latin
+    letters, and punctuation, and works for any script. e.g. "जगन्नाथ महावीर" finds
+    "महावीर, जगन्नाथ", and "zoe o'brien" finds "Zoë O'Brien".
+
+    On Postgres, the search uses a trigram index on the normalized names. On other databases, each
+    worker keeps a trigram index of the names in memory, which is kept up to date as patients change.
+
+    Query Parameters:
+        - q (str): The name, or parts of the name, to search for.
+        - limit (int, optional): The most patients to return. Defaults to 20, at most 100.
+
+    Responses:
+        - 200 OK: The matching patients, ordered by name, are returned in the response body.
+        - 400 Bad Request: Returned if the query is empty, or the limit is invalid.
+
+    Example Response Body:
+    ```json
+    {
+        "patients": [
+            {
+                "nhs_number": "string (10 characters)",
+                "name": "string",
+                "date_of_birth": "YYYY-MM-DD",
+                "postcode": "string",
+                "version": 1
+            }
+        ]
+    }
+    ```
+    """
+    query = normalize_name(request.args.get("q", ""))
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        limit = 0
+
+    if not query or not 0 < limit <= 100:
+        logger.info(f"Invalid patient search: {request.args}")
+        return jsonify({"message": "Invalid search"}), 400
+
+    logger.info(f"Searching for patients matching: {query}")
+    if db.session.get_bind().dialect.name == "postgresql":
+        statement = db.select(Patient)
+        for word in query.split():
+            statement = statement.where(Patient.search_key.contains(word, autoescape=True))
+
+        patients = db.session.execute(
+            statement.order_by(Patient.search_key, Patient.nhs_number).limit(limit)
+        ).scalars().all()
+        if len(shard_router):
+            patients = gather_sorted(
+                patients, key=lambda patient: (patient.search_key, patient.nhs_number), limit=limit
+            )
+    else:
+        refresh_patient_search_index()
+        nhs_numbers = patient_search_index.search(query, limit)
+
+        found = {
+            patient.nhs_number: patient
+            for patient in db.session.execute(
+                db.select(Patient).where(Patient.nhs_number.in_(nhs_numbers))
+            ).scalars()
+        }
+        patients = [found[nhs_number] for nhs_number in nhs_numbers if nhs_number in found]
+
+    logger.info(f"Found {len(patients)} patients matching: {query}")
+    audit_reads("patient", [patient.nhs_number for patient in patients])
+    return jsonify({"patients": [patient.serialize() for patient in patients]}), 200
+
+
+# POST /patients/batch-get - Retrieve details of many patients at once
+@app.route("/patients/batch-get", methods=["POST"])
+def batch_get_patients():
+    """
+    Handles the POST request to retrieve the details of many patients in one go.
+
+    Endpoint: `/patients/batch-get`
+    Method: POST
+
+    Description:
+    This endpoint returns the details of every patient asked for, as `GET /patients/<nhs_number>/`
+    would, in one round trip. The patients are fetched together, with one query per 500 NHS
+    numbers. The results are keyed by NHS number, and every NHS number asked for has an entry,
+    including those which were not found. Although it is a POST, it only reads.
+
+    Request Body:
+        - ids (list): The NHS numbers of the patients, at most 1000 of them.
+
+    Responses:
+        - 200 OK: The results are returned in the response body.
+        - 400 Bad Request: Returned if the request body is not a list of at most 1000 NHS numbers.
+
+    Example Request Body:
+    ```json
+    {
+        "ids": ["string (10 characters)", "string (10 characters)"]
+    }
+    ```
+
+    Example Response Body:
+    ```json
+    {
+        "results": {
+            "string (10 characters)": {"code": 200, "patient": {"nhs_number": "string", "...": "..."}},
+            "string (10 characters)": {"code": 404, "message": "Patient not found"}
+        }
+    }
+    ```
+    """
+    ids = batch_get_ids()
+    if ids is None:
+        logger.info("Patient batch-get did not contain a list of IDs")
+        return jsonify({"message": "Invalid batch"}), 400
+
+    logger.info(f"Retrieving {len(ids)} patients")
+    patients = fetch_by_ids(Patient, Patient.nhs_number, ids)
+
+    results = {}
+    for nhs_number in ids:
+        if nhs_number in patients:
+            results[nhs_number] = {"code": 200, "patient": patients[nhs_number].serialize()}
+        else:
+            results[nhs_number] = {"code": 404, "message": "Patient not found"}
+
+    logger.info(f"Found {len(patients)} of {len(ids)} patients")
+    audit_reads("patient", patients)
+    return jsonify({"results": results}), 200
+
+
+# GET /patients/<id>/ - Retrieve details of a specific patient
+@app.route("/patients/<nhs_number>/", methods=["GET"])
+def get_patient(nhs_number):
+    """
+    Handles the GET request to retrieve details of a specific patient using the NHS number.
+
+    Endpoint: `/patients/<nhs_number>/`
+    Method: GET
+
+    Description:
+    This endpoint is responsible for retrieving and returning the details of a specific
+    patient from the database using the NHS number. If the patient is found, a JSON object
+    containing the patient's details is returned with a 200 OK response. If the patient is
+    not found, a 404 Not Found response is returned.
+
+    Path Parameters:
+        - nhs_number (str): The NHS number of the patient to retrieve. Must be a 10-character string.
+
+    Responses:
+        - 200 OK: Successfully retrieved the patient details. The patient's details are returned
+                in the response body in JSON format, and the record version in the ETag header.
+        - 404 Not Found: Returned if no patient record is found with the provided NHS number.
+
+    Returns:
+        - JSON response containing the patient's details if found.
+
+    Example Response Body:
+    ```json
+    {
+        "nhs_number": "string (10 characters)",
+        "name": "string",
+        "date_of_birth": "YYYY-MM-DD",
+        "postcode": "string",
+        "version": 1
+    }
+    ```
+    """
+    logger.info(f"Retrieving patient record with NHS number: {nhs_number}")
+    patient = db.session.get(Patient, nhs_number)
+
+    if not patient:
+        logger.info(f"Patient record with NHS number: {nhs_number} not found")
+        return jsonify({"message": "Patient not found"}), 404
+
+    logger.debug(f"Found patient record with NHS number: {nhs_number}")
+    audit_reads("patient", [nhs_number])
+
+    return versioned_response(patient)
+
+
+# PUT /patients/<id>/ - Update details of a specific patient
+@app.route("/patients/<nhs_number>/", methods=["PUT"])
+def update_patient(nhs_number):
+    """
+    Handles the PUT request to update details of a specific patient using the NHS number.
+
+    Endpoint: `/patients/<nhs_number>/`
+    Method: PUT
+
+    Description:
+    This endpoint is responsible for updating the details of a specific patient in the
+    database using the NHS number. All fields in the request body are optional. If the
+    patient is found and the provided data is valid, the patient's details are updated,
+    and a 200 OK response is returned. If the patient is not found or if any provided
+    data is invalid, appropriate error responses are returned.
+
+    If an `If-Match` header is given, the update is only applied if it matches the patient's
+    current version (as returned in the ETag header of a GET). The version is also checked when
+    the UPDATE is written, so a concurrent update between our read and our write is rejected too.
+
+    Path Parameters:
+        - nhs_number (str): The NHS number of the patient to update. Must be a 10-character string.
+
+    Headers:
+        - If-Match (str, optional): The ETag of the version of the patient the client last saw.
+
+    Request Body:
+        - name (str, optional): The new name of the patient.
+        - date_of_birth (str, optional): The new date of birth of the patient in YYYY-MM-DD format.
+        - postcode (str, optional): The new postcode of the patient.
+
+    Responses:
+        - 200 OK: Successfully updated the patient details. A success message is returned in the response body.
+        - 400 Bad Request: Returned if any provided field is invalid, or the date of birth or postcode is invalid.
+        - 404 Not Found: Returned if no patient record is found with the provided NHS number.
+        - 412 Precondition Failed: Returned if the patient has been modified since the version
+                given in If-Match, or by a concurrent request.
+
+    Returns:
+        - JSON response with a message indicating the result of the operation.
+
+    Example Request Body (all fields are optional):
+    ```json
+    {
+        "name": "string",
+        "date_of_birth": "YYYY-MM-DD",
+        "postcode": "string"
+    }
+    ```
+    """
+
+    logger.info(f"Updating patient record with NHS number: {nhs_number}")
+    try:
+        result, code = update_patient_record(nhs_number, request.get_json())
+        if code != 200:
+            return jsonify(result), code
+
+        db.session.commit()
+        logger.info(
+            f"Database updated for patient record with NHS number: {nhs_number}"
+        )
+        response = jsonify({"message": result["message"]})
+        response.set_etag(str(db.session.get(Patient, nhs_number).version))
+        return response, 200
+    except StaleDataError:
+        db.session.rollback()
+        logger.info(f"[{nhs_number}] Patient was modified by a concurrent request")
+        return jsonify({"message": "Patient has been modified"}), 412
+    except:
+        logger.info(
+            f"Failed to parse data for patient record with NHS number: {nhs_number}"
+        )
+        return jsonify({"message": "Failed to parse data"}), 404
+
+
+def update_patient_record(nhs_number: str, data: dict, if_match=None):
+    """Validate changes to a patient and make them in the session, without committing.
+
+    Returns the result, with a message, and its HTTP status code. Used by PUT /patients/<nhs_number>/
+    and /batch.
+    """
+    patient = db.session.get(Patient, nhs_number)
+    if not patient:
+        logger.info(f"Patient record with NHS number: {nhs_number} not found")
+        return {"message": "Patient not found"}, 404
+
+    logger.info(f"Found patient record with NHS number: {nhs_number}")
+
+    if precondition_failed(patient, if_match):
+        logger.info(f"[{nhs_number}] If-Match does not match version {patient.version}")
+        return {"message": "Patient has been modified"}, 412
+
+    # Can we update the NHS number?
+    # patient.nhs_number = data["nhs_number"]
+
+    # If we got a postcode, make sure it's valid
+    if "postcode" in data:
+        data["postcode"] = format_postcode(data["postcode"])
+
+        # And if it's not, return an error
+        if not data["postcode"]:
+            logger.info(f"[{nhs_number}] Invalid postcode: {data['postcode']}")
+            return {"message": "Invalid postcode"}, 400
+        if not is_known_postcode(data["postcode"]):
+            logger.info(f"[{nhs_number}] Unknown postcode: {data['postcode']}")
+            return {"message": "Unknown postcode"}, 400
+
+    # Default to the existing value if the new value is not provided
+    fields = ["name", "date_of_birth", "postcode"]
+    for field in data.keys():
+        if field not in fields:
+            return {"message": "Invalid field"}, 400
+
+    for field in fields:
+        if field in data:
+            logger.info(
+                f"Updating patient record field: {field} from {getattr(patient, field)} to {data[field]}"
+            )
+            setattr(patient, field, data[field])
+
+    return {"message": "Patient updated successfully", "nhs_number": nhs_number}, 200
+
+
+# DELETE /patients/<id>/ - Remove a patient
+@app.route("/patients/<nhs_number>/", methods=["DELETE"])
+def delete_patient(nhs_number):
+    """
+    Handles the DELETE request to remove a specific patient using the NHS number.
+
+    Endpoint: `/patients/<nhs_number>/`
+    Method: DELETE
+
+    Description:
+    This endpoint is responsible for deleting a specific patient record from the database
+    using the NHS number. If the patient is found, the record is deleted, and a 200 OK
+    response along with a success message is returned. If the patient is not found, a
+    404 Not Found response is returned.
+
+    Path Parameters:
+        - nhs_number (str): The NHS number of the patient to delete. Must be a 10-character string.
+
+    Headers:
+        - If-Match (str, optional): The ETag of the version of the patient the client last saw.
+
+    Responses:
+        - 200 OK: Successfully deleted the patient record. A success message is returned in the response body.
+        - 404 Not Found: Returned if no patient record is found with the provided NHS number.
+        - 412 Precondition Failed: Returned if the patient has been modified since the version
+                given in If-Match, or by a concurrent request.
+
+    Returns:
+        - JSON response with a message indicating the result of the operation.
+        - HTTP status code indicating the result of the operation.
+
+    """
+    logger.info(f"Deleting patient record with NHS number: {nhs_number}")
+    result, code = delete_patient_record(nhs_number)
+    if code != 200:
+        return jsonify(result), code
+
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        logger.info(f"[{nhs_number}] Patient was modified by a concurrent request")
+        return jsonify({"message": "Patient has been modified"}), 412
+    logger.info(f"Patient record with NHS number: {nhs_number} deleted successfully")
+    return jsonify({"message": result["message"]}), 200
+
+
+def delete_patient_record(nhs_number: str, if_match=None):
+    """Delete a patient in the session, without committing.
+
+    Returns the result, with a message, and its HTTP status code. Used by
+    DELETE /patients/<nhs_number>/ and /batch.
+    """
+    patient = db.session.get(Patient, nhs_number)
+    if not patient:
+        logger.info(f"Patient record with NHS number: {nhs_number} not found")
+        return {"message": "Patient not found"}, 404
+
+    logger.info(f"Found patient record with NHS number: {nhs_number}")
+    if precondition_failed(patient, if_match):
+        logger.info(f"[{nhs_number}] If-Match does not match version {patient.version}")
+        return {"message": "Patient has been modified"}, 412
+
+    db.session.delete(patient)
+    return {"message": "Patient deleted successfully", "nhs_number": nhs_number}, 200
+
+
+# POST /appointments/ - Add a new appointment
+@app.route("/appointments/", methods=["POST"])
+def add_appointment():
+    """
+    Handles the POST request to add a new appointment to the database.
+
+    Endpoint: `/appointments/`
+    Method: POST
+
+    Description:
+    This endpoint is responsible for adding a new appointment record to the database.
+    It performs various validations such as checking whether the appointment ID, if provided,
+    is already taken, validating the NHS number, formatting and validating the postcode, and
+    validating the appointment status. The clinician must also be free for the whole appointment,
+    i.e. they must not have another appointment (that isn't cancelled) which overlaps it. If all
+    validations pass, a new appointment record is created, added to the database, and a 201
+    Created response is returned.
+
+    Request Body:
+        - id (str, optional): The ID of the appointment. If not provided, a new one is generated.
+        - patient (str): The NHS number of the patient.
+        - status (str): The status of the appointment.
+        - time (str): The date and time of the appointment in YYYY-MM-DDTHH:MM:SS+TZ format.
+        - duration (str): The duration of the appointment.
+        - clinician (str): The clinician for the appointment.
+        - department (str): The department where the appointment is scheduled.
+        - postcode (str): The postcode for the appointment location.
+
+    Responses:
+        - 201 Created: The appointment record was successfully added to the database.
+        - 400 Bad Request: Returned if there is an invalid NHS number, postcode, or appointment status.
+        - 409 Conflict: Returned if an appointment with the provided ID already exists, or the
+                clinician is already booked for some of the appointment's time.
+
+    Returns:
+        - JSON response with a message indicating the result of the operation and the ID of the created appointment.
+        - HTTP status code indicating the result of the operation.
+
+    Example Request Body:
+    ```json
+    {
+        "id": "string (optional)",
+        "patient": "string (NHS number)",
+        "status": "string",
+        "time": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "duration": "string",
+        "clinician": "string",
+        "department": "string",
+        "postcode": "string"
+    }
+    ```
+    """
+    logger.info(f"Adding a new appointment...")
+    result, code = add_appointment_record(request.get_json())
+    if code != 201:
+        return jsonify(result), code
+
+    db.session.commit()
+    logger.info(f"Appointment {result['id']} added successfully")
+    return jsonify(result), 201
+
+
+def add_appointment_record(data: dict):
+    """Validate a new appointment and add it to the session, without committing.
+
+    Returns the result, with a message, and its HTTP status code. Used by POST /appointments/ and
+    /batch.
+    """
+    # First, check that that appointment ID is not taken
+    if "id" in data:
+        appointment = db.session.get(Appointment, data["id"])
+        if appointment or db.session.get(ArchivedAppointment, data["id"]):
+            logger.info(f"Appointment with ID: {data['id']} already exists")
+            return {"message": "Appointment already exists"}, 409
+
+    # Validate the NHS number
+    if not validate_nhs_number(data["patient"]):
+        logger.info(f"Invalid NHS number: {data['patient']}")
+        return {"message": "Invalid NHS number"}, 400
+
+    # Format the postcode
+    data["postcode"] = format_postcode(data["postcode"])
+    if not data["postcode"]:
+        logger.info(f"[{data['id']}] Invalid postcode: {data['postcode']}")
+        return {"message": "Invalid postcode"}, 400
+    if not is_known_postcode(data["postcode"]):
+        logger.info(f"[{data['id']}] Unknown postcode: {data['postcode']}")
+        return {"message": "Unknown postcode"}, 400
+
+    # Validate the appointment status
+    if not is_valid_appointment_status(data["status"]):
+        logger.info(f"Invalid appointment status: {data['status']}")
+        return {"message": "Invalid appointment status"}, 400
+
+    # Create the new appointment
+    new_appointment = Appointment(
+        # If the ID is provided, use it, otherwise generate a new one
+        id=data.get("id", str(uuid4())),
+        patient=data["patient"],
+        status=data["status"],
+        # This parses timezones, from 2026-05-24T11:30:00+01:00
+        time=datetime.fromisoformat(data["time"]),
+        duration=data["duration"],
+        clinician=data["clinician"],
+        department=data["department"],
+        postcode=data["postcode"],
+    )
+    logger.info(f"Adding appointment with ID: {new_appointment.id}")
+
+    # If the appointment date has passed, and the status is still "active" we need to set it to "missed"
+    missed_appointment = is_missed(new_appointment.status, appointment_end_time(new_appointment))
+    if missed_appointment:
+        new_appointment.status = "missed"
+        logger.info(
+            f"[{new_appointment.id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
+        )
+
+    # Make sure we aren't double-booking the clinician
+    if new_appointment.status != "cancelled":
+        conflict = find_clinician_conflict(
+            new_appointment.id,
+            new_appointment.clinician,
+            new_appointment.time,
+            appointment_end_time(new_appointment),
+        )
+        if conflict:
+            logger.info(
+                f"[{new_appointment.id}] {new_appointment.clinician} is already booked for appointment {conflict.id}"
+            )
+            return {"message": "Clinician is already booked", "conflict": conflict.id}, 409
+
+    db.session.add(new_appointment)
+    return {"message": "Appointment added successfully", "id": new_appointment.id}, 201
+
+
+# GET /appointments/<id>/ - Retrieve details of a specific appointment
+@app.route("/appointments/<id>/", methods=["GET"])
+def get_appointment(id):
+    """
+    Handles the GET request to retrieve details of a specific appointment using the appointment ID.
+
+    Endpoint: `/appointments/<id>/`
+    Method: GET
+
+    Description:
+    This endpoint is responsible for retrieving and returning the details of a specific
+    appointment from the database using the appointment ID. If the appointment is found,
+    a JSON object containing the appointment's details is returned with a 200 OK response.
+    If the appointment is not found, a 404 Not Found response is returned. Additionally,
+    it checks whether an active appointment is missed and updates the status if necessary.
+    Appointments which have been archived are read back from their archive, and flagged as
+    archived.
+
+    Path Parameters:
+        - id (str): The ID of the appointment to retrieve.
+
+    Responses:
+        - 200 OK: Successfully retrieved the appointment details. The appointment's details
+                are returned in the response body in JSON format, and the record version in the
+                ETag header. Archived appointments have "archived": true, and no ETag.
+        - 404 Not Found: Returned if no appointment record is found with the provided ID.
+
+    Returns:
+        - JSON response containing the appointment's details if found.
+        - HTTP status code indicating the result of the operation.
+
+    Example Response Body:
+    ```json
+    {
+        "id": "string",
+        "patient": "string (NHS number)",
+        "status": "string",
+        "time": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "duration": "string",
+        "clinician": "string",
+        "department": "string",
+        "postcode": "string",
+        "version": 1
+    }
+    ```
+    """
+    logger.info(f"Retrieving appointment with ID: {id}")
+    appointment = db.session.get(Appointment, id)
+    if appointment:
+        logger.info(f"Found appointment with ID: {id}")
+
+        # check if appointment is missed
+        missed_appointment = is_missed(appointment.status, appointment.end_time)
+        if missed_appointment:
+            appointment.status = "missed"
+            logger.info(
+                f"[{appointment.id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
+            )
+            try:
+                db.session.commit()
+                logger.info(f"Appointment {appointment.id} updated successfully")
+            except StaleDataError:
+                # Someone else changed the appointment under us (e.g. marked it as attended),
+                # so their change wins and we report the appointment as it now stands.
+                db.session.rollback()
+                logger.info(f"[{id}] Appointment was modified by a concurrent request")
+                appointment = db.session.get(Appointment, id, populate_existing=True)
+                if not appointment:
+                    return jsonify({"message": "Appointment not found"}), 404
+
+        audit_reads("appointment", [id])
+        return versioned_response(appointment)
+
+    archived_appointment = get_archived_appointment(id)
+    if archived_appointment:
+        logger.info(f"Found appointment with ID: {id} in the archive")
+        audit_reads("appointment", [id])
+        return jsonify({**archived_appointment, "archived": True}), 200
+
+    logger.info(f"Appointment with ID: {id} not found")
+    return jsonify({"message": "Appointment not found"}), 404
+
+
+# PUT /appointments/<id>/ - Update details of a specific appointment
+@app.route("/appointments/<id>/", methods=["PUT"])
+def update_appointment(id):
+    """
+    Handles the PUT request to update details of a specific appointment using the appointment ID.
+
+    Endpoint: `/appointments/<id>/`
+    Method: PUT
+
+    Description:
+    This endpoint is responsible for updating the details of a specific appointment in the
+    database using the appointment ID. It performs various validations such as checking
+    whether the appointment ID exists, validating the NHS number, formatting and validating
+    the postcode, and validating the appointment status and state change. If the time, duration,
+    clinician or status change, the clinician must still be free for the whole appointment. If all
+    validations pass, the appointment details are updated, and a 200 OK response is returned.
+
+    If an `If-Match` header is given, the update is only applied if it matches the appointment's
+    current version (as returned in the ETag header of a GET). The version is also checked when
+    the UPDATE is written, so a concurrent update between our read and our write is rejected too.
+
+    Path Parameters:
+        - id (str): The ID of the appointment to update.
+
+    Headers:
+        - If-Match (str, optional): The ETag of the version of the appointment the client last saw.
+
+    Request Body:
+        - patient (str, optional): The NHS number of the patient.
+        - status (str, optional): The status of the appointment.
+        - time (str, optional): The date and time of the appointment in YYYY-MM-DDTHH:MM:SS+TZ format.
+        - duration (str, optional): The duration of the appointment, e.g. 1h30m, or 1h, or 30m.
+        - clinician (str, optional): The clinician for the appointment.
+        - department (str, optional): The department where the appointment is scheduled.
+        - postcode (str, optional): The postcode for the appointment location.
+
+    Responses:
+        - 200 OK: Successfully updated the appointment details. A success message is returned in the response body.
+        - 400 Bad Request: Returned if there is an invalid field, NHS number, postcode, appointment status, or state change,
+          or if the appointment would move to another patient while patients are sharded.
+        - 404 Not Found: Returned if no appointment record is found with the provided ID.
+        - 409 Conflict: Returned if the clinician is already booked for some of the appointment's time,
+                or the appointment has been archived.
+        - 412 Precondition Failed: Returned if the appointment has been modified since the version
+                given in If-Match, or by a concurrent request.
+
+    Returns:
+        - JSON response with a message indicating the result of the operation.
+
+    Example Request Body:
+    ```json
+    {
+        "patient": "string (NHS number)",
+        "status": "string",
+        "time": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "duration": "HHhMMm",
+        "clinician": "string",
+        "department": "string",
+        "postcode": "string"
+    }
+    ```
+    """
+    logger.info(f"Updating appointment with ID: {id}")
+    result, code = update_appointment_record(id, request.get_json())
+    if code != 200:
+        # Undo any changes made before the update was refused
+        db.session.rollback()
+        return jsonify(result), code
+
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        logger.info(f"[{id}] Appointment was modified by a concurrent request")
+        return jsonify({"message": "Appointment has been modified"}), 412
+
+    logger.info(f"Appointment {id} updated successfully")
+    response = jsonify({"message": result["message"]})
+    response.set_etag(str(db.session.get(Appointment, id).version))
+    return response, 200
+
+
+def update_appointment_record(id: str, data: dict, if_match=None):
+    """Validate changes to an appointment and make them in the session, without committing.
+
+    Returns the result, with a message, and its HTTP status code. If the changes are refused, some
+    of them may already have been made, so the session must be rolled back. Used by
+    PUT /appointments/<id>/ and /batch.
+    """
+    appointment = db.session.get(Appointment, id)
+    if not appointment:
+        if db.session.get(ArchivedAppointment, id):
+            logger.info(f"Appointment with ID: {id} is archived")
+            return {"message": "Archived appointments cannot be changed"}, 409
+
+        logger.info(f"Appointment with ID: {id} not found")
+        return {"message": "Appointment not found"}, 404
+
+    logger.info(f"Found appointment with ID: {id}")
+
+    if precondition_failed(appointment, if_match):
+        logger.info(f"[{id}] If-Match does not match version {appointment.version}")
+        return {"message": "Appointment has been modified"}, 412
+
+    # Validate the appointment status
+    if "status" in data:
+        if not is_valid_appointment_status(data["status"]):
+            logger.info(f"Invalid appointment status: {data['status']}")
+            return {"message": "Invalid appointment status"}, 400
+
+        # Validate the state change
+        if not is_valid_state_change(appointment.status, data["status"]):
+            logger.info(
+                f"Invalid state change: {appointment.status} -> {data['status']}"
+            )
+            return {"message": "Invalid state change"}, 400
+
+    # If we got a postcode, make sure it's valid
+    if "postcode" in data:
+        data["postcode"] = format_postcode(data["postcode"])
+
+        # And if it's not, return an error
+        if not data["postcode"]:
+            logger.info(f"[{id}] Invalid postcode: {data['postcode']}")
+            return {"message": "Invalid postcode"}, 400
+        if not is_known_postcode(data["postcode"]):
+            logger.info(f"[{id}] Unknown postcode: {data['postcode']}")
+            return {"message": "Unknown postcode"}, 400
+
+    # TODO: Can we update the patient?
+    if "patient" in data:
+        # Validate the NHS number
+        if not validate_nhs_number(data["patient"]):
+            logger.info(f"Invalid NHS number: {data['patient']}")
+            return {"message": "Invalid NHS number"}, 400
+
+        # Appointments live in their patient's shard, and a changed row stays where it is
+        if len(shard_router) and data["patient"] != appointment.patient:
+            logger.info(f"[{id}] Can't move the appointment to another patient, as patients are sharded")
+            return {"message": "Appointments cannot be moved to another patient"}, 400
+
+    # Build the modified appointment object
+    # Default to the existing value if the new value is not provided.
+    fields = [
+        "patient",
+        "status",
+        "time",
+        "duration",
+        "clinician",
+        "department",
+        "postcode",
+    ]
+
+    for field in data.keys():
+        if field not in fields:
+            return {"message": "Invalid field"}, 400
+
+    for field in fields:
+        if field in data:
+            logger.info(
+                f"[{id}] Updating appointment field: {field} from {getattr(appointment, field)} to {data[field]}"
+            )
+            if field == "time":
+                logger.info(f"[{id}] This is a time field, so parsing the time")
+                setattr(appointment, field, datetime.fromisoformat(data[field]))
+            else:
+                setattr(appointment, field, data[field])
+
+    # If the appointment date has passed, and the status is still "active" we need to set it to "missed"
+    missed_appointment = is_missed(appointment.status, appointment_end_time(appointment))
+    if missed_appointment:
+        appointment.status = "missed"
         logger.info(
-            f"Database updated for patient record with NHS number: {nhs_number}"
+            f"[{id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
         )
-        return jsonify({"message": "Patient updated successfully"}), 200
-    except:
-        logger.info(
-            f"Failed to parse data for patient record with NHS number: {nhs_number}"
+
+    # If the appointment has moved, make sure we aren't double-booking the clinician
+    if appointment.status != "cancelled" and {"time", "duration", "clinician", "status"} & data.keys():
+        conflict = find_clinician_conflict(
+            id, appointment.clinician, appointment.time, appointment_end_time(appointment)
+        )
+        if conflict:
+            logger.info(
+                f"[{id}] {appointment.clinician} is already booked for appointment {conflict.id}"
+            )
+            return {"message": "Clinician is already booked", "conflict": conflict.id}, 409
+
+    return {"message": "Appointment updated successfully", "id": id}, 200
+
+
+# DELETE /appointments/<id>/ - Remove an appointment
+@app.route("/appointments/<id>/", methods=["DELETE"])
+def delete_appointment(id):
+    """
+    Handles the DELETE request to remove a specific appointment using the appointment ID.
+
+    Endpoint: `/appointments/<id>/`
+    Method: DELETE
+
+    Description:
+    This endpoint is responsible for deleting a specific appointment record from the database
+    using the appointment ID. If the appointment is found, the record is deleted, and a 200 OK
+    response along with a success message is returned. If the appointment is not found, a
+    404 Not Found response is returned.
+
+    Path Parameters:
+        - id (str): The ID of the appointment to delete.
+
+    Headers:
+        - If-Match (str, optional): The ETag of the version of the appointment the client last saw.
+
+    Responses:
+        - 200 OK: Successfully deleted the appointment record. A success message is returned in the response body.
+        - 404 Not Found: Returned if no appointment record is found with the provided ID.
+        - 409 Conflict: Returned if the appointment has been archived.
+        - 412 Precondition Failed: Returned if the appointment has been modified since the version
+                given in If-Match, or by a concurrent request.
+
+    Returns:
+        - JSON response with a message indicating the result of the operation.
+    """
+    result, code = delete_appointment_record(id)
+    if code != 200:
+        return jsonify(result), code
+
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({"message": "Appointment has been modified"}), 412
+    return jsonify({"message": result["message"]}), 200
+
+
+def delete_appointment_record(id: str, if_match=None):
+    """Delete an appointment in the session, without committing.
+
+    Returns the result, with a message, and its HTTP status code. Used by
+    DELETE /appointments/<id>/ and /batch.
+    """
+    appointment = db.session.get(Appointment, id)
+    if not appointment:
+        if db.session.get(ArchivedAppointment, id):
+            return {"message": "Archived appointments cannot be changed"}, 409
+
+        return {"message": "Appointment not found"}, 404
+
+    if precondition_failed(appointment, if_match):
+        return {"message": "Appointment has been modified"}, 412
+
+    db.session.delete(appointment)
+    return {"message": "Appointment deleted successfully", "id": id}, 200
+
+
+# POST /appointments/batch-get - Retrieve details of many appointments at once
+@app.route("/appointments/batch-get", methods=["POST"])
+def batch_get_appointments():
+    """
+    Handles the POST request to retrieve the details of many appointments in one go.
+
+    Endpoint: `/appointments/batch-get`
+    Method: POST
+
+    Description:
+    This endpoint returns the details of every appointment asked for, as `GET /appointments/<id>/`
+    would, in one round trip. The appointments are fetched together, with one query per 500 IDs,
+    and any that weren't found are looked for in the archive. The results are keyed by ID, and
+    every ID asked for has an entry, including those which were not found. Although it is a POST,
+    it only reads, so appointments that have passed are reported as missed without being marked
+    as missed.
+
+    Request Body:
+        - ids (list): The IDs of the appointments, at most 1000 of them.
+
+    Responses:
+        - 200 OK: The results are returned in the response body.
+        - 400 Bad Request: Returned if the request body is not a list of at most 1000 IDs.
+
+    Example Request Body:
+    ```json
+    {
+        "ids": ["string", "string"]
+    }
+    ```
+
+    Example Response Body:
+    ```json
+    {
+        "results": {
+            "string": {"code": 200, "appointment": {"id": "string", "...": "..."}},
+            "string": {"code": 404, "message": "Appointment not found"}
+        }
+    }
+    ```
+    """
+    ids = batch_get_ids()
+    if ids is None:
+        logger.info("Appointment batch-get did not contain a list of IDs")
+        return jsonify({"message": "Invalid batch"}), 400
+
+    logger.info(f"Retrieving {len(ids)} appointments")
+    now = utcnow()
+    appointments = {}
+    for id, appointment in fetch_by_ids(Appointment, Appointment.id, ids).items():
+        serialized = appointment.serialize()
+        # Report appointments that have passed as missed, as a GET would, without writing them back
+        if is_missed(appointment.status, appointment.end_time, now):
+            serialized["status"] = "missed"
+        appointments[id] = serialized
+
+    missing = [id for id in ids if id not in appointments]
+    if missing:
+        archived = get_archived_appointments(missing)
+        appointments.update({id: {**record, "archived": True} for id, record in archived.items()})
+
+    results = {}
+    for id in ids:
+        if id in appointments:
+            results[id] = {"code": 200, "appointment": appointments[id]}
+        else:
+            results[id] = {"code": 404, "message": "Appointment not found"}
+
+    logger.info(f"Found {len(appointments)} of {len(ids)} appointments")
+    audit_reads("appointment", appointments)
+    return jsonify({"results": results}), 200
+
+
+# The most updates a status batch can hold
+STATUS_BATCH_MAX_UPDATES = 1000
+
+
+# POST /appointments/status-batch - Update the status of many appointments at once
+@app.route("/appointments/status-batch", methods=["POST"])
+def update_appointment_statuses():
+    """
+    Handles the POST request to update the status of many appointments in one go.
+
+    Endpoint: `/appointments/status-batch`
+    Method: POST
+
+    Description:
+    This endpoint is for reception marking a clinic's worth of appointments as attended or
+    cancelled at once. All of the target appointments are loaded in a single query, and each
+    status change goes through the same validation as a PUT to `/appointments/<id>/`: the status
+    must be valid, the state change must be allowed, an appointment can't be brought back from
+    being cancelled if the clinician has been booked in the meantime, and an appointment that has
+    already passed while still active is marked as missed. All of the successful changes are written in one
+    transaction, and the outcome of each item is returned in the same order it was given.
+
+    Items that fail validation are reported and skipped; they do not prevent the rest of the batch
+    from being applied. Each item may carry the `version` of the appointment the client last saw,
+    which is checked like an If-Match header.
+
+    Request Body:
+        - updates (list): At most 1000 status changes to apply. Each is either an object with
+                `id`, `status` and (optionally) `version` keys, or an `[id, status]` pair.
+
+    Responses:
+        - 200 OK: The batch was processed. The outcome of each item is in the response body.
+        - 400 Bad Request: Returned if the request body is not a list of at most 1000 updates.
+        - 412 Precondition Failed: Returned if one of the appointments was modified by a concurrent
+                request while the batch was being written. No changes are applied.
+
+    Example Request Body:
+    ```json
+    {
+        "updates": [
+            {"id": "string", "status": "attended"},
+            ["string", "cancelled"]
+        ]
+    }
+    ```
+
+    Example Response Body:
+    ```json
+    {
+        "results": [
+            {"id": "string", "code": 200, "message": "Appointment updated successfully", "status": "attended"},
+            {"id": "string", "code": 400, "message": "Invalid state change"}
+        ]
+    }
+    ```
+    """
+    data = request.get_json()
+    updates = data.get("updates") if isinstance(data, dict) else None
+    if not isinstance(updates, list) or not 0 < len(updates) <= STATUS_BATCH_MAX_UPDATES:
+        logger.info("Status batch did not contain a list of updates")
+        return jsonify({"message": "Invalid batch"}), 400
+
+    # Normalise the [id, status] pairs into the same shape as the objects
+    items = []
+    for update in updates:
+        if isinstance(update, (list, tuple)) and len(update) == 2:
+            update = {"id": update[0], "status": update[1]}
+        if not (
+            isinstance(update, dict)
+            and isinstance(update.get("id"), str)
+            and isinstance(update.get("status"), str)
+        ):
+            update = None
+        items.append(update)
+
+    # Fetch every appointment we need in one go, rather than one query per item
+    ids = {item["id"] for item in items if item}
+    logger.info(f"Updating the status of {len(ids)} appointments")
+    appointments = {
+        appointment.id: appointment
+        for appointment in db.session.execute(
+            db.select(Appointment).where(Appointment.id.in_(ids))
+        ).scalars()
+    }
+
+    results = []
+    for item in items:
+        if item is None:
+            results.append({"id": None, "code": 400, "message": "Invalid update"})
+            continue
+
+        id = item["id"]
+        # bool is an int too, but not a version
+        version = item.get("version")
+        if "version" in item and (not isinstance(version, int) or isinstance(version, bool)):
+            logger.info(f"[{id}] Invalid version: {item['version']!r}")
+            results.append({"id": id, "code": 400, "message": "Invalid version"})
+            continue
+
+        appointment = appointments.get(id)
+        if not appointment:
+            logger.info(f"Appointment with ID: {id} not found")
+            results.append({"id": id, "code": 404, "message": "Appointment not found"})
+            continue
+
+        if "version" in item and item["version"] != appointment.version:
+            logger.info(f"[{id}] Version {item['version']} does not match {appointment.version}")
+            results.append({"id": id, "code": 412, "message": "Appointment has been modified"})
+            continue
+
+        # Validate the appointment status
+        if not is_valid_appointment_status(item["status"]):
+            logger.info(f"[{id}] Invalid appointment status: {item['status']}")
+            results.append({"id": id, "code": 400, "message": "Invalid appointment status"})
+            continue
+
+        # Validate the state change
+        if not is_valid_state_change(appointment.status, item["status"]):
+            logger.info(
+                f"[{id}] Invalid state change: {appointment.status} -> {item['status']}"
+            )
+            results.append({"id": id, "code": 400, "message": "Invalid state change"})
+            continue
+
+        # A cancelled appointment doesn't hold the clinician's time, so if it's being brought back
+        # we need to make sure the slot hasn't been given to someone else since
+        if appointment.status == "cancelled" and item["status"] != "cancelled":
+            conflict = find_clinician_conflict(
+                id, appointment.clinician, appointment.time, appointment_end_time(appointment)
+            )
+            if conflict:
+                logger.info(
+                    f"[{id}] {appointment.clinician} is already booked for appointment {conflict.id}"
+                )
+                results.append({"id": id, "code": 409, "message": "Clinician is already booked"})
+                continue
+
+        logger.info(f"[{id}] Updating status from {appointment.status} to {item['status']}")
+        appointment.status = item["status"]
+
+        # If the appointment date has passed, and the status is still "active" we need to set it to "missed"
+        if is_missed(appointment.status, appointment.end_time):
+            appointment.status = "missed"
+            logger.info(
+                f"[{id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
+            )
+
+        results.append(
+            {
+                "id": id,
+                "code": 200,
+                "message": "Appointment updated successfully",
+                "status": appointment.status,
+            }
         )
-        return jsonify({"message": "Failed to parse data"}), 404
 
+        # Write it to the database, so that the rest of the batch is checked against it, e.g. so
+        # that two reinstated appointments can't both take the same slot
+        try:
+            db.session.flush()
+        except StaleDataError:
+            db.session.rollback()
+            logger.info(f"[{id}] Appointment was modified by a concurrent request")
+            return jsonify({"message": "Appointment has been modified"}), 412
 
-# DELETE /patients/<id>/ - Remove a patient
-@app.route("/patients/<nhs_number>/", methods=["DELETE"])
-def delete_patient(nhs_number):
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        logger.info("An appointment in the batch was modified by a concurrent request")
+        return jsonify({"message": "Appointment has been modified"}), 412
+
+    logger.info(f"Status batch of {len(items)} updates processed")
+    return jsonify({"results": results}), 200
+
+
+# The most operations a batch can hold
+BATCH_MAX_OPERATIONS = 100
+
+
+def run_batch_operation(operation: dict):
+    """Run one operation of a batch, through the same checks as the endpoint for it would.
+
+    Returns the result, with a message, and its HTTP status code.
     """
-    Handles the DELETE request to remove a specific patient using the NHS number.
+    if_match = ETags([str(operation["if_match"])]) if "if_match" in operation else None
+    key = (operation["op"], operation["type"])
+
+    if key == ("create", "patient"):
+        return add_patient_record(dict(operation["data"]))
+    if key == ("update", "patient"):
+        return update_patient_record(operation["id"], dict(operation["data"]), if_match)
+    if key == ("delete", "patient"):
+        return delete_patient_record(operation["id"], if_match)
+    if key == ("create", "appointment"):
+        return add_appointment_record(dict(operation["data"]))
+    if key == ("update", "appointment"):
+        return update_appointment_record(operation["id"], dict(operation["data"]), if_match)
+    if key == ("delete", "appointment"):
+        return delete_appointment_record(operation["id"], if_match)
+
+    return {"message": "Invalid operation"}, 400
+
+
+# POST /batch - Make many changes to patients and appointments in one transaction
+@app.route("/batch", methods=["POST"])
+def batch():
+    """
+    Handles the POST request to create, update and delete many patients and appointments at once.
 
-    Endpoint: `/patients/<nhs_number>/`
-    Method: DELETE
+    Endpoint: `/batch`
+    Method: POST
 
     Description:
-    This endpoint is responsible for deleting a specific patient record from the database
-    using the NHS number. If the patient is found, the record is deleted, and a 200 OK
-    response along with a success message is returned. If the patient is not found, a
-    404 Not Found response is returned.
+    This endpoint runs a list of operations in order, in one transaction, e.g. to register a
+    patient and book their first appointments in one round trip. Each operation is checked in the
+    same way as it would be by its own endpoint, and sees the changes made by the operations
+    before it, so an appointment can't double-book a clinician with another in the same batch.
+    Either every operation succeeds and they are all committed together, or the first to fail
+    stops the batch, nothing is changed, and the response has the failed operation's status code.
 
-    Path Parameters:
-        - nhs_number (str): The NHS number of the patient to delete. Must be a 10-character string.
+    Request Body:
+        - operations (list): At most 100 operations, each with:
+            - op (str): "create", "update" or "delete".
+            - type (str): "patient" or "appointment".
+            - id (str): For updates and deletes, the NHS number of the patient, or the ID of the
+                    appointment.
+            - data (dict): For creates and updates, the request body the endpoint would take.
+            - if_match (str, optional): For updates and deletes, the version the client last saw,
+                    as with If-Match.
 
     Responses:
-        - 200 OK: Successfully deleted the patient record. A success message is returned in the response body.
-        - 404 Not Found: Returned if no patient record is found with the provided NHS number.
+        - 200 OK: Every operation succeeded, and they have been committed. The results of each,
+                with their status codes and messages, are returned in order.
+        - 400 Bad Request: Returned if the batch is not a list of at most 100 operations, or an
+                operation is invalid.
+        - 404, 409, 412: Returned if an operation failed, as its endpoint would. The results are
+                returned up to and including the failed operation, whose index is in "failed".
 
-    Returns:
-        - JSON response with a message indicating the result of the operation.
-        - HTTP status code indicating the result of the operation.
+    Example Request Body:
+    ```json
+    {
+        "operations": [
+            {"op": "create", "type": "patient", "data": {"nhs_number": "string", "...": "..."}},
+            {"op": "create", "type": "appointment", "data": {"patient": "string", "...": "..."}},
+            {"op": "update", "type": "appointment", "id": "string", "data": {"status": "attended"}, "if_match": "1"},
+            {"op": "delete", "type": "appointment", "id": "string"}
+        ]
+    }
+    ```
 
+    Example Response Body:
+    ```json
+    {
+        "message": "Batch completed successfully",
+        "results": [
+            {"code": 201, "message": "Patient added successfully", "nhs_number": "string"},
+            {"code": 201, "message": "Appointment added successfully", "id": "string"},
+            {"code": 200, "message": "Appointment updated successfully", "id": "string"},
+            {"code": 200, "message": "Appointment deleted successfully", "id": "string"}
+        ]
+    }
+    ```
     """
-    logger.info(f"Deleting patient record with NHS number: {nhs_number}")
-    patient = db.session.get(Patient, nhs_number)
-    if not patient:
-        logger.info(f"Patient record with NHS number: {nhs_number} not found")
-        return jsonify({"message": "Patient not found"}), 404
+    body = request.get_json(silent=True)
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not 0 < len(operations) <= BATCH_MAX_OPERATIONS:
+        logger.info("Batch did not contain a list of operations")
+        return jsonify({"message": "Invalid batch"}), 400
+
+    logger.info(f"Running a batch of {len(operations)} operations")
+    results = []
+    for index, operation in enumerate(operations):
+        try:
+            result, code = run_batch_operation(operation)
+            if code < 400:
+                # Write it to the database, so that the rest of the batch is checked against it
+                db.session.flush()
+        except StaleDataError:
+            result, code = {"message": "Record has been modified"}, 412
+        except (KeyError, TypeError, ValueError, AttributeError):
+            result, code = {"message": "Invalid operation"}, 400
+
+        results.append({"code": code, **result})
+        if code >= 400:
+            db.session.rollback()
+            logger.info(f"Batch operation {index} failed with {code}: {result['message']}, rolling back")
+            return (
+                jsonify({"message": "Batch failed, no changes were made", "failed": index, "results": results}),
+                code,
+            )
 
-    logger.info(f"Found patient record with NHS number: {nhs_number}")
-    db.session.delete(patient)
-    db.session.commit()
-    logger.info(f"Patient record with NHS number: {nhs_number} deleted successfully")
-    return jsonify({"message": "Patient deleted successfully"}), 200
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        logger.info("Batch clashed with a concurrent request, rolling back")
+        return jsonify({"message": "Record has been modified", "results": []}), 412
 
+    logger.info(f"Batch of {len(operations)} operations committed successfully")
+    return jsonify({"message": "Batch completed successfully", "results": results}), 200
 
-# POST /appointments/ - Add a new appointment
-@app.route("/appointments/", methods=["POST"])
-def add_appointment():
+
+# GET /clinicians/<name>/availability - Find the free slots in a clinician's schedule
+@app.route("/clinicians/<name>/availability", methods=["GET"])
+def get_clinician_availability(name):
     """
-    Handles the POST request to add a new appointment to the database.
+    Handles the GET request to find when a clinician is free.
 
-    Endpoint: `/appointments/`
-    Method: POST
+    Endpoint: `/clinicians/<name>/availability`
+    Method: GET
 
     Description:
-    This endpoint is responsible for adding a new appointment record to the database.
-    It performs various validations such as checking whether the appointment ID, if provided,
-    is already taken, validating the NHS number, formatting and validating the postcode, and
-    validating the appointment status. If all validations pass, a new appointment record is
-    created, added to the database, and a 201 Created response is returned.
+    This endpoint returns the gaps in a clinician's schedule within a window of time, which are
+    at least as long as the requested length. Any appointment which isn't cancelled counts as the
+    clinician being busy. The first free slot is the next time the clinician can be booked.
 
-    Request Body:
-        - id (str, optional): The ID of the appointment. If not provided, a new one is generated.
-        - patient (str): The NHS number of the patient.
-        - status (str): The status of the appointment.
-        - time (str): The date and time of the appointment in YYYY-MM-DDTHH:MM:SS+TZ format.
-        - duration (str): The duration of the appointment.
-        - clinician (str): The clinician for the appointment.
-        - department (str): The department where the appointment is scheduled.
-        - postcode (str): The postcode for the appointment location.
+    Path Parameters:
+        - name (str): The name of the clinician.
 
-    Responses:
-        - 201 Created: The appointment record was successfully added to the database.
-        - 400 Bad Request: Returned if there is an invalid NHS number, postcode, or appointment status.
-        - 409 Conflict: Returned if an appointment with the provided ID already exists.
+    Query Parameters:
+        - from (str, optional): The start of the window, in YYYY-MM-DDTHH:MM:SS+TZ format. Defaults to now.
+        - to (str, optional): The end of the window, in YYYY-MM-DDTHH:MM:SS+TZ format. Defaults to a week after `from`.
+                The window can be at most 31 days long.
+        - length (str, optional): The shortest free slot to return, e.g. 1h30m, or 1h, or 30m. Defaults to 15m.
 
-    Returns:
-        - JSON response with a message indicating the result of the operation and the ID of the created appointment.
-        - HTTP status code indicating the result of the operation.
+    Responses:
+        - 200 OK: The free slots are returned in the response body, in the timezone of `from`.
+        - 400 Bad Request: Returned if the window or length are invalid.
 
-    Example Request Body:
+    Example Response Body:
     ```json
     {
-        "id": "string (optional)",
-        "patient": "string (NHS number)",
-        "status": "string",
-        "time": "YYYY-MM-DDTHH:MM:SS+TZ",
-        "duration": "string",
         "clinician": "string",
+        "from": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "to": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "free": [
+            {"start": "YYYY-MM-DDTHH:MM:SS+TZ", "end": "YYYY-MM-DDTHH:MM:SS+TZ"}
+        ]
+    }
+    ```
+    """
+    window = parse_availability_window()
+    if not window:
+        logger.info(f"Invalid availability window: {request.args}")
+        return jsonify({"message": "Invalid time window"}), 400
+
+    window_start, window_end, length = window
+    logger.info(f"Finding availability for {name} from {window_start} to {window_end}")
+    busy = clinician_busy_intervals([name], window_start, window_end)[name]
+    free = free_intervals(busy, window_start, window_end, length)
+
+    return (
+        jsonify(
+            {
+                "clinician": name,
+                "from": window_start.isoformat(),
+                "to": window_end.isoformat(),
+                "free": serialize_free_intervals(free, window_start.tzinfo),
+            }
+        ),
+        200,
+    )
+
+
+# GET /departments/<name>/availability - Find the free slots for each clinician in a department
+@app.route("/departments/<name>/availability", methods=["GET"])
+def get_department_availability(name):
+    """
+    Handles the GET request to find when the clinicians in a department are free.
+
+    Endpoint: `/departments/<name>/availability`
+    Method: GET
+
+    Description:
+    This works like `/clinicians/<name>/availability`, for every clinician who has had an
+    appointment in the department. All of the clinicians' bookings are fetched together.
+
+    Path Parameters:
+        - name (str): The name of the department.
+
+    Query Parameters:
+        - from, to, length: As for `/clinicians/<name>/availability`.
+
+    Responses:
+        - 200 OK: The free slots of each clinician are returned in the response body.
+        - 400 Bad Request: Returned if the window or length are invalid.
+        - 404 Not Found: Returned if no appointments have been made in the department.
+
+    Example Response Body:
+    ```json
+    {
         "department": "string",
-        "postcode": "string"
+        "from": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "to": "YYYY-MM-DDTHH:MM:SS+TZ",
+        "clinicians": {
+            "string": [
+                {"start": "YYYY-MM-DDTHH:MM:SS+TZ", "end": "YYYY-MM-DDTHH:MM:SS+TZ"}
+            ]
+        }
     }
     ```
     """
-    logger.info(f"Adding a new appointment...")
-    data = request.get_json()
+    window = parse_availability_window()
+    if not window:
+        logger.info(f"Invalid availability window: {request.args}")
+        return jsonify({"message": "Invalid time window"}), 400
+
+    window_start, window_end, length = window
+    department_id = department_names.id_for(db.session, name)
+    clinician_ids = set()
+    if department_id is not None:
+        # Each shard has its own distinct clinicians, who may also work with patients in other shards
+        clinician_ids.update(
+            db.session.execute(
+                db.select(Appointment.clinician_id).where(Appointment.department_id == department_id).distinct()
+            ).scalars()
+        )
+    clinicians = sorted(clinician_names.name_for(db.session, id) for id in clinician_ids)
+    if not clinicians:
+        logger.info(f"No clinicians found in department: {name}")
+        return jsonify({"message": "Department not found"}), 404
 
-    # First, check that that appointment ID is not taken
-    if "id" in data:
-        appointment = db.session.get(Appointment, data["id"])
-        if appointment:
-            logger.info(f"Appointment with ID: {data['id']} already exists")
-            return jsonify({"message": "Appointment already exists"}), 409
+    logger.info(
+        f"Finding availability for {len(clinicians)} clinicians in {name} from {window_start} to {window_end}"
+    )
+    busy = clinician_busy_intervals(clinicians, window_start, window_end)
 
-    # Validate the NHS number
-    if not validate_nhs_number(data["patient"]):
-        logger.info(f"Invalid NHS number: {data['patient']}")
-        return jsonify({"message": "Invalid NHS number"}), 400
+    return (
+        jsonify(
+            {
+                "department": name,
+                "from": window_start.isoformat(),
+                "to": window_end.isoformat(),
+                "clinicians": {
+                    clinician: serialize_free_intervals(
+                        free_intervals(intervals, window_start, window_end, length),
+                        window_start.tzinfo,
+                    )
+                    for clinician, intervals in busy.items()
+                },
+            }
+        ),
+        200,
+    )
 
-    # Format the postcode
-    data["postcode"] = format_postcode(data["postcode"])
-    if not data["postcode"]:
-        logger.info(f"[{data['id']}] Invalid postcode: {data['postcode']}")
-        return jsonify({"message": "Invalid postcode"}), 400
 
-    # Validate the appointment status
-    if not is_valid_appointment_status(data["status"]):
-        logger.info(f"Invalid appointment status: {data['status']}")
-        return jsonify({"message": "Invalid appointment status"}), 400
+# GET /events - Stream changes to appointments
+@app.route("/events", methods=["GET"])
+def stream_events():
+    """
+    Handles the GET request to subscribe to changes to appointments, as Server-Sent Events.
 
-    # Create the new appointment
-    new_appointment = Appointment(
-        # If the ID is provided, use it, otherwise generate a new one
-        id=data.get("id", str(uuid4())),
-        patient=data["patient"],
-        status=data["status"],
-        # This parses timezones, from 2026-05-24T11:30:00+01:00
-        time=datetime.fromisoformat(data["time"]),
-        duration=data["duration"],
-        clinician=data["clinician"],
-        department=data["department"],
-        postcode=data["postcode"],
+    Endpoint: `/events`
+    Method: GET
+
+    Description:
+    This endpoint holds the connection open and pushes an event whenever an appointment is
+    created, updated, or deleted, or passes without the patient attending (and so is marked as
+    missed). Only changes that have been committed are sent. Clients can use this rather than
+    polling appointments to spot changes. A comment is sent as a keep-alive when there have been no
+    changes for a while.
+
+    If a client falls too far behind, it is sent an `overflow` event and the stream is closed. It
+    should re-fetch the appointments it is interested in, then reconnect.
+
+    Each stream ties up one of the worker's threads, so each worker only serves EVENTS_MAX_STREAMS
+    of them at once. Any more are turned away, to try again later.
+
+    Query Parameters:
+        - department (str, optional): Only send changes to appointments in this department.
+        - clinician (str, optional): Only send changes to appointments with this clinician.
+
+    Responses:
+        - 200 OK: A `text/event-stream` of changes.
+        - 503 Service Unavailable: Returned if this worker is already serving as many streams as it can.
+
+    Example Event:
+    ```
+    event: updated
+    data: {"event": "updated", "id": "string", "patient": "string (NHS number)", "status": "string",
+           "time": "YYYY-MM-DDTHH:MM:SS+TZ", "clinician": "string", "department": "string", "version": 2}
+    ```
+    """
+    filters = {
+        field: request.args[field] for field in ["department", "clinician"] if field in request.args
+    }
+    if event_streams is not None and not event_streams.acquire(timeout=0):
+        logger.info(f"Already serving {event_streams.active} event streams, turning another away")
+        response = jsonify({"message": "Too many event streams, try again later"})
+        response.status_code = 503
+        response.headers["Retry-After"] = retry_after_header(app.config["EVENTS_HEARTBEAT"])
+        return response
+
+    logger.info(f"Subscribing to appointment changes, filtered by {filters}")
+
+    # Subscribe now rather than when the response starts, so that no changes are missed between
+    # the client connecting and the stream starting
+    subscription = change_feed.subscribe(**filters)
+    audit_bulk_read("appointment")
+    heartbeat = app.config["EVENTS_HEARTBEAT"]
+
+    def generate():
+        try:
+            yield f"retry: {int(heartbeat * 1000)}\n\n"
+            while not subscription.overflowed:
+                change = subscription.get(timeout=heartbeat)
+                if change is None:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield f"event: {change['event']}\ndata: {json.dumps(change)}\n\n"
+
+            logger.info("Event stream client fell behind, closing the stream")
+            yield "event: overflow\ndata: {}\n\n"
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    logger.info(f"Adding appointment with ID: {new_appointment.id}")
+    if event_streams is not None:
+        # Closed by the server, even if the client goes before the stream starts
+        response.call_on_close(event_streams.release)
+    return response
 
-    # If the appointment date has passed, and the status is still "active" we need to set it to "missed"
-    missed_appointment = check_if_missed_appointment(new_appointment)
-    if missed_appointment:
-        new_appointment.status = "missed"
-        logger.info(
-            f"[{new_appointment.id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
-        )
 
-    db.session.add(new_appointment)
-    db.session.commit()
-    logger.info(f"Appointment {new_appointment.id} added successfully")
+# GET /sync - Fetch the patients and appointments that have changed since the last sync
+@app.route("/sync", methods=["GET"])
+def sync():
+    """
+    Handles the GET request to fetch the changes to patients and appointments since a cursor.
+
+    Endpoint: `/sync`
+    Method: GET
+
+    Description:
+    This endpoint lets clients keep a local copy of the data up to date, while only fetching what
+    has changed. Without a cursor, it returns everything, a page at a time. Each response includes
+    a cursor, which is passed back as `since` to fetch the changes made after that response, and
+    whether there are more changes to fetch straight away. Each table is read in the order of its
+    last-modified index, so a sync costs time proportional to the number of changes.
+
+    Deleted patients and appointments are listed by ID, so they can be removed. These are only
+    remembered for SYNC_TOMBSTONE_RETENTION_DAYS, so a client with an older cursor must start again
+    from scratch. Records changed in the last few seconds may be sent again on the next sync, so
+    clients should treat each record as replacing their copy.
+
+    Query Parameters:
+        - since (str, optional): The cursor returned by the last sync.
+        - limit (int, optional): The most records of each kind to return at once. Defaults to 500, at most 5000.
+
+    Responses:
+        - 200 OK: The changes are returned in the response body.
+        - 400 Bad Request: Returned if the cursor or limit are invalid.
+        - 410 Gone: Returned if the cursor is too old to know what has been deleted since.
+
+    Example Response Body:
+    ```json
+    {
+        "patients": [{"nhs_number": "string (10 characters)", "...": "..."}],
+        "appointments": [{"id": "string", "...": "..."}],
+        "deleted": {"patients": ["string"], "appointments": ["string"]},
+        "cursor": "string",
+        "more": false
+    }
+    ```
+    """
+    try:
+        limit = int(request.args.get("limit", 500))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= 5000:
+        logger.info(f"Invalid sync limit: {request.args.get('limit')}")
+        return jsonify({"message": "Invalid limit"}), 400
+
+    if "since" in request.args:
+        try:
+            positions = decode_sync_cursor(request.args["since"])
+        except ValueError as e:
+            logger.info(str(e))
+            return jsonify({"message": "Invalid cursor"}), 400
+
+        retention = timedelta(days=app.config["SYNC_TOMBSTONE_RETENTION_DAYS"])
+        if positions["deleted"][0] < utcnow() - retention:
+            logger.info(f"Sync cursor from {positions['deleted'][0]} is too old")
+            return jsonify({"message": "Cursor has expired, sync from scratch"}), 410
+    else:
+        # A client starting from scratch has nothing to delete
+        positions = {
+            "patients": None,
+            "appointments": None,
+            "deleted": settled_position(None, None, 0),
+        }
+
+    # A replica could be behind by more than the settle time, and the cursor would skip what it's missing
+    use_primary()
+
+    logger.info(f"Syncing changes since {positions}")
+    patients, more_patients = changed_since(
+        Patient, Patient.updated_at, Patient.nhs_number, positions["patients"], limit
+    )
+    appointments, more_appointments = changed_since(
+        Appointment, Appointment.updated_at, Appointment.id, positions["appointments"], limit
+    )
+    tombstones, more_tombstones = changed_since(
+        Tombstone, Tombstone.deleted_at, Tombstone.id, positions["deleted"], limit
+    )
+
+    new_positions = {}
+    for table, rows, more, timestamp, key, minimum_key in [
+        ("patients", patients, more_patients, "updated_at", "nhs_number", ""),
+        ("appointments", appointments, more_appointments, "updated_at", "id", ""),
+        ("deleted", tombstones, more_tombstones, "deleted_at", "id", 0),
+    ]:
+        last_seen = (getattr(rows[-1], timestamp), getattr(rows[-1], key)) if rows else None
+        if more:
+            new_positions[table] = last_seen
+        else:
+            new_positions[table] = settled_position(positions[table], last_seen, minimum_key)
+
+    now = utcnow()
+    serialized_appointments = []
+    for appointment in appointments:
+        serialized = appointment.serialize()
+        # Report appointments that have passed as missed, as a GET would, without writing them back
+        if is_missed(appointment.status, appointment.end_time, now):
+            serialized["status"] = "missed"
+        serialized_appointments.append(serialized)
+
+    # Polls that find nothing new haven't been sent anything
+    if patients:
+        audit_bulk_read("patient")
+    if appointments:
+        audit_bulk_read("appointment")
+
     return (
         jsonify(
-            {"message": "Appointment added successfully", "id": new_appointment.id}
+            {
+                "patients": [patient.serialize() for patient in patients],
+                "appointments": serialized_appointments,
+                "deleted": {
+                    "patients": [t.key for t in tombstones if t.kind == "patient"],
+                    "appointments": [t.key for t in tombstones if t.kind == "appointment"],
+                },
+                "cursor": encode_sync_cursor(new_positions),
+                "more": more_patients or more_appointments or more_tombstones,
+            }
         ),
-        201,
+        200,
+    )
+
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# How many rows are fetched from the database, and encoded, at a time
+EXPORT_BATCH_SIZE = 1000
+APPOINTMENT_EXPORT_FIELDS = [
+    "id",
+    "patient",
+    "status",
+    "time",
+    "duration",
+    "clinician",
+    "department",
+    "postcode",
+    "version",
+]
+PATIENT_EXPORT_FIELDS = ["nhs_number", "name", "date_of_birth", "postcode", "version"]
+
+
+def appointment_export_filters():
+    """Build the conditions on appointments given by the from, to and department query parameters.
+
+    Returns a list of conditions, or None if the parameters are invalid.
+    """
+    conditions = []
+    try:
+        if "from" in request.args:
+            conditions.append(Appointment.time >= parse_query_time(request.args["from"]))
+        if "to" in request.args:
+            conditions.append(Appointment.time < parse_query_time(request.args["to"]))
+    except ValueError:
+        return None
+
+    if "department" in request.args:
+        department_id = department_names.id_for(db.session, request.args["department"])
+        conditions.append(Appointment.department_id == department_id if department_id is not None else db.false())
+
+    return conditions
+
+
+def export_response(name: str, records, fields: list):
+    """Stream records to the client, in the format and compression asked for by the query parameters.
+
+    records is a generator, so nothing is fetched from the database until the response is sent, and
+    then only a batch at a time. Returns None if the format is invalid.
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return None
+
+    if export_format == "csv":
+        chunks = encode_csv(records, fields, EXPORT_BATCH_SIZE)
+    else:
+        chunks = encode_ndjson(records, EXPORT_BATCH_SIZE)
+
+    filename = f"{name}.{export_format}"
+    mimetype = EXPORT_FORMATS[export_format]
+    if request.args.get("gzip", "").lower() in ("1", "true", "yes"):
+        chunks = gzip_stream(chunks)
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# GET /stats/summary - Count the patients and appointments, for dashboards
+@app.route("/stats/summary", methods=["GET"])
+def stats_summary():
+    """
+    Handles the GET request for the numbers of patients and appointments.
+
+    Endpoint: `/stats/summary`
+    Method: GET
+
+    Description:
+    This endpoint returns the total number of patients, and the number of appointments by status,
+    by department, and by day (in UTC). The counts are kept up to date as patients and
+    appointments are written, so this doesn't count the records themselves, and takes the same
+    time however many there are. Appointments are counted by their stored status, so ones that
+    have passed without being marked as missed are still counted as active.
+
+    Query Parameters:
+        - from (str, optional): Only count appointments on or after this day, as YYYY-MM-DD.
+        - to (str, optional): Only count appointments on or before this day, as YYYY-MM-DD.
+        - department (str, optional): Only count appointments in this department.
+
+    Responses:
+        - 200 OK: The counts are returned in the response body.
+        - 400 Bad Request: Returned if from or to is not a valid date.
+
+    Example Response Body:
+    ```json
+    {
+        "patients": 1234,
+        "appointments": {
+            "total": 5678,
+            "by_status": {"active": 1000, "attended": 4000, "cancelled": 300, "missed": 378},
+            "by_department": {"cardiology": 2000, "oncology": 3678},
+            "by_day": {"2024-01-01": 20, "2024-01-02": 25}
+        }
+    }
+    ```
+    """
+    conditions = []
+    try:
+        if "from" in request.args:
+            conditions.append(AppointmentCounter.day >= date.fromisoformat(request.args["from"]))
+        if "to" in request.args:
+            conditions.append(AppointmentCounter.day <= date.fromisoformat(request.args["to"]))
+    except ValueError:
+        logger.info(f"Invalid stats filters: {dict(request.args)}")
+        return jsonify({"message": "Invalid date"}), 400
+    if "department" in request.args:
+        conditions.append(AppointmentCounter.department == request.args["department"])
+
+    rows = db.session.execute(
+        db.select(
+            AppointmentCounter.day,
+            AppointmentCounter.department,
+            AppointmentCounter.status,
+            db.func.sum(AppointmentCounter.count).label("count"),
+        )
+        .where(*conditions)
+        .group_by(AppointmentCounter.day, AppointmentCounter.department, AppointmentCounter.status)
     )
 
+    by_status, by_department, by_day = Counter(), Counter(), Counter()
+    for row in rows:
+        # Postgres sums big integers as decimals
+        count = int(row.count)
+        if not count:
+            continue
+        by_status[row.status] += count
+        by_department[row.department] += count
+        by_day[row.day.isoformat()] += count
+
+    patients = db.session.scalar(db.select(db.func.coalesce(db.func.sum(PatientCounter.count), 0)))
+
+    logger.info(f"Counted {patients} patients and {sum(by_status.values())} appointments")
+    return jsonify(
+        {
+            "patients": int(patients),
+            "appointments": {
+                "total": sum(by_status.values()),
+                "by_status": by_status,
+                "by_department": by_department,
+                "by_day": by_day,
+            },
+        }
+    ), 200
 
-# GET /appointments/<id>/ - Retrieve details of a specific appointment
-@app.route("/appointments/<id>/", methods=["GET"])
-def get_appointment(id):
+
+# GET /admin/profiles - List the most recent request profiles
+@app.route("/admin/profiles", methods=["GET"])
+def list_profiles():
     """
-    Handles the GET request to retrieve details of a specific appointment using the appointment ID.
+    Handles the GET request for the most recent request profiles.
 
-    Endpoint: `/appointments/<id>/`
+    Endpoint: `/admin/profiles`
     Method: GET
 
     Description:
-    This endpoint is responsible for retrieving and returning the details of a specific
-    appointment from the database using the appointment ID. If the appointment is found,
-    a JSON object containing the appointment's details is returned with a 200 OK response.
-    If the appointment is not found, a 404 Not Found response is returned. Additionally,
-    it checks whether an active appointment is missed and updates the status if necessary.
+    This endpoint lists the profiles taken of requests, newest first, by every worker sharing the
+    profile directory. Requests are profiled when they are sent with an X-Profile-Token header
+    matching PROFILE_TOKEN, or at random, at PROFILE_SAMPLE_RATE. This request must be sent with
+    the token too.
 
-    Path Parameters:
-        - id (str): The ID of the appointment to retrieve.
+    Query Parameters:
+        - limit (int, optional): How many profiles to list, at most. Defaults to 50.
 
     Responses:
-        - 200 OK: Successfully retrieved the appointment details. The appointment's details
-                are returned in the response body in JSON format.
-        - 404 Not Found: Returned if no appointment record is found with the provided ID.
-
-    Returns:
-        - JSON response containing the appointment's details if found.
-        - HTTP status code indicating the result of the operation.
+        - 200 OK: The profiles are listed in the response body.
+        - 400 Bad Request: Returned if limit is not a positive number.
+        - 403 Forbidden: Returned if the token is missing or wrong.
+        - 404 Not Found: Returned if profiling isn't turned on.
 
     Example Response Body:
     ```json
     {
-        "id": "string",
-        "patient": "string (NHS number)",
-        "status": "string",
-        "time": "YYYY-MM-DDTHH:MM:SS+TZ",
-        "duration": "string",
-        "clinician": "string",
-        "department": "string",
-        "postcode": "string"
+        "profiles": [
+            {
+                "id": "20240101T093000123456Z-1a2b3c4d",
+                "method": "GET",
+                "path": "/patients/1373645350/",
+                "endpoint": "get_patient",
+                "trigger": "header",
+                "duration_ms": 12.345,
+                "captured_at": "2024-01-01T09:30:00.123456+00:00"
+            }
+        ]
     }
     ```
     """
-    logger.info(f"Retrieving appointment with ID: {id}")
-    appointment = db.session.get(Appointment, id)
-    if appointment:
-        logger.info(f"Found appointment with ID: {id}")
+    profiles = app.extensions.get("profiles")
+    if profiles is None:
+        return jsonify({"message": "Profiling is not enabled"}), 404
+    if not has_profile_token():
+        logger.info("Refused to list profiles without the profile token")
+        return jsonify({"message": "Missing or wrong X-Profile-Token"}), 403
 
-        # check if appointment is missed
-        missed_appointment = check_if_missed_appointment(appointment)
-        if missed_appointment:
-            appointment.status = "missed"
-            logger.info(
-                f"[{appointment.id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
-            )
-            db.session.commit()
-            logger.info(f"Appointment {appointment.id} updated successfully")
+    limit = request.args.get("limit", 50, type=int)
+    if limit is None or limit < 1:
+        return jsonify({"message": "Invalid limit"}), 400
 
-        return jsonify(appointment.serialize()), 200
-    else:
-        logger.info(f"Appointment with ID: {id} not found")
-        return jsonify({"message": "Appointment not found"}), 404
+    return jsonify({"profiles": profiles.recent(limit)}), 200
 
 
-# PUT /appointments/<id>/ - Update details of a specific appointment
-@app.route("/appointments/<id>/", methods=["PUT"])
-def update_appointment(id):
+# GET /admin/profiles/<id> - Download a request profile
+@app.route("/admin/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
     """
-    Handles the PUT request to update details of a specific appointment using the appointment ID.
+    Handles the GET request for one request profile, as folded stacks.
 
-    Endpoint: `/appointments/<id>/`
-    Method: PUT
+    Endpoint: `/admin/profiles/<id>`
+    Method: GET
 
     Description:
-    This endpoint is responsible for updating the details of a specific appointment in the
-    database using the appointment ID. It performs various validations such as checking
-    whether the appointment ID exists, validating the NHS number, formatting and validating
-    the postcode, and validating the appointment status and state change. If all validations
-    pass, the appointment details are updated, and a 200 OK response is returned.
+    This endpoint returns a profile listed by /admin/profiles, in the folded stacks format. Each
+    line is a call stack, from the outermost call, separated by semicolons, then the microseconds
+    spent in the last call itself. Open it with speedscope, or draw it with flamegraph.pl. This
+    request must be sent with the profile token.
 
-    Path Parameters:
-        - id (str): The ID of the appointment to update.
+    Responses:
+        - 200 OK: The profile is returned as text.
+        - 403 Forbidden: Returned if the token is missing or wrong.
+        - 404 Not Found: Returned if profiling isn't turned on, or there is no such profile.
+    """
+    profiles = app.extensions.get("profiles")
+    if profiles is None:
+        return jsonify({"message": "Profiling is not enabled"}), 404
+    if not has_profile_token():
+        logger.info("Refused to send a profile without the profile token")
+        return jsonify({"message": "Missing or wrong X-Profile-Token"}), 403
 
-    Request Body:
-        - patient (str, optional): The NHS number of the patient.
-        - status (str, optional): The status of the appointment.
-        - time (str, optional): The date and time of the appointment in YYYY-MM-DDTHH:MM:SS+TZ format.
-        - duration (str, optional): The duration of the appointment, e.g. 1h30m, or 1h, or 30m.
-        - clinician (str, optional): The clinician for the appointment.
-        - department (str, optional): The department where the appointment is scheduled.
-        - postcode (str, optional): The postcode for the appointment location.
+    try:
+        with open(profiles.path(profile_id), "r") as f:
+            folded = f.read()
+    except (ValueError, FileNotFoundError):
+        return jsonify({"message": "Profile not found"}), 404
+
+    return Response(
+        folded,
+        mimetype="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'},
+    )
 
-    Responses:
-        - 200 OK: Successfully updated the appointment details. A success message is returned in the response body.
-        - 400 Bad Request: Returned if there is an invalid field, NHS number, postcode, appointment status, or state change.
-        - 404 Not Found: Returned if no appointment record is found with the provided ID.
 
-    Returns:
-        - JSON response with a message indicating the result of the operation.
+# GET /admin/audit - Report how the audit log is keeping up
+@app.route("/admin/audit", methods=["GET"])
+def get_audit_metrics():
+    """
+    Handles the GET request for the audit log's metrics.
 
-    Example Request Body:
+    Endpoint: `/admin/audit`
+    Method: GET
+
+    Description:
+    This endpoint reports how this worker's audit log is keeping up. Events are queued in memory
+    and written in batches in the background, so if they're being recorded faster than they can be
+    written, the queue fills up. Requests then wait for space (counted by `waited`, for
+    `wait_seconds` in all), and if it doesn't come in time, their events are dropped. Batches that
+    failed to write, and were retried, are counted by `failed_batches`. Events that couldn't be
+    written even on their own are written to the dead letter file, and counted by `dead_lettered`
+    (or by `dropped`, if that fails too). The counts are since the worker started.
+
+    Responses:
+        - 200 OK: The metrics are returned in the response body.
+        - 404 Not Found: Returned if the audit log is turned off.
+
+    Example Response Body:
     ```json
     {
-        "patient": "string (NHS number)",
-        "status": "string",
-        "time": "YYYY-MM-DDTHH:MM:SS+TZ",
-        "duration": "HHhMMm",
-        "clinician": "string",
-        "department": "string",
-        "postcode": "string"
+        "recorded": 12030,
+        "written": 12000,
+        "dropped": 0,
+        "waited": 2,
+        "wait_seconds": 0.013,
+        "batches": 310,
+        "failed_batches": 0,
+        "dead_lettered": 0,
+        "queued": 30,
+        "high_water": 1204,
+        "max_queue": 10000,
+        "last_batch": {"events": 120, "duration_ms": 4.2}
     }
     ```
     """
-    logger.info(f"Updating appointment with ID: {id}")
-    appointment = db.session.get(Appointment, id)
-    if not appointment:
-        logger.info(f"Appointment with ID: {id} not found")
-        return jsonify({"message": "Appointment not found"}), 404
+    audit_log = app.extensions.get("audit")
+    if audit_log is None:
+        return jsonify({"message": "The audit log is not enabled"}), 404
 
-    logger.info(f"Found appointment with ID: {id}")
-    data = request.get_json()
+    return jsonify(audit_log.metrics()), 200
 
-    # Validate the appointment status
-    if "status" in data:
-        if not is_valid_appointment_status(data["status"]):
-            logger.info(f"Invalid appointment status: {data['status']}")
-            return jsonify({"message": "Invalid appointment status"}), 400
 
-        # Validate the state change
-        if not is_valid_state_change(appointment.status, data["status"]):
-            logger.info(
-                f"Invalid state change: {appointment.status} -> {data['status']}"
+# GET /export/appointments - Stream every appointment, for analysis
+@app.route("/export/appointments", methods=["GET"])
+def export_appointments():
+    """
+    Handles the GET request to export appointments in bulk.
+
+    Endpoint: `/export/appointments`
+    Method: GET
+
+    Description:
+    This endpoint streams every appointment matching the filters, in no particular order, as
+    newline-delimited JSON or CSV. Rows are read from a server-side cursor and sent a batch at a
+    time, so exports of any size take the same memory. Appointments that have passed are reported
+    as missed, as by a GET, without being written back. Archived appointments are not included.
+
+    Query Parameters:
+        - from (str, optional): Only export appointments starting at or after this time.
+        - to (str, optional): Only export appointments starting before this time.
+        - department (str, optional): Only export appointments in this department.
+        - format (str, optional): "ndjson" (the default), or "csv".
+        - gzip (bool, optional): If true, the export is gzipped.
+
+    Responses:
+        - 200 OK: The appointments are streamed in the response body, with the same fields as a
+                GET of each appointment.
+        - 400 Bad Request: Returned if a time or the format is invalid.
+
+    Example Response Body:
+    ```
+    {"id": "string", "patient": "string (NHS number)", "status": "string", "time": "YYYY-MM-DDTHH:MM:SS+TZ", "duration": "string", "clinician": "string", "department": "string", "postcode": "string", "version": 1}
+    ```
+    """
+    conditions = appointment_export_filters()
+    if conditions is None:
+        logger.info(f"Invalid export filters: {dict(request.args)}")
+        return jsonify({"message": "Invalid time"}), 400
+
+    names = {"clinician": Clinician.name.label("clinician"), "department": Department.name.label("department")}
+    query = (
+        db.select(
+            *(names.get(field, getattr(Appointment, field)) for field in APPOINTMENT_EXPORT_FIELDS),
+            Appointment.end_time,
+        )
+        .join(Clinician, Appointment.clinician_id == Clinician.id)
+        .join(Department, Appointment.department_id == Department.id)
+        .where(*conditions)
+    )
+
+    def records():
+        now = utcnow()
+        rows = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for row in rows:
+            record = {field: getattr(row, field) for field in APPOINTMENT_EXPORT_FIELDS}
+            record["time"] = row.time.isoformat()
+            # Report appointments that have passed as missed, as a GET would
+            if is_missed(row.status, row.end_time, now):
+                record["status"] = "missed"
+            yield record
+
+    logger.info(f"Exporting appointments with filters: {dict(request.args)}")
+    response = export_response("appointments", records(), APPOINTMENT_EXPORT_FIELDS)
+    if response is None:
+        return jsonify({"message": "Invalid format"}), 400
+
+    audit_bulk_read("appointment")
+    return response
+
+
+# GET /export/patients - Stream every patient, for analysis
+@app.route("/export/patients", methods=["GET"])
+def export_patients():
+    """
+    Handles the GET request to export patients in bulk.
+
+    Endpoint: `/export/patients`
+    Method: GET
+
+    Description:
+    This endpoint streams every patient matching the filters, in no particular order, as
+    newline-delimited JSON or CSV, in the same way as `/export/appointments`. The filters select
+    patients with at least one appointment matching them.
+
+    Query Parameters:
+        - from (str, optional): Only export patients with an appointment starting at or after this time.
+        - to (str, optional): Only export patients with an appointment starting before this time.
+        - department (str, optional): Only export patients with an appointment in this department.
+        - format (str, optional): "ndjson" (the default), or "csv".
+        - gzip (bool, optional): If true, the export is gzipped.
+
+    Responses:
+        - 200 OK: The patients are streamed in the response body, with the same fields as a GET of
+                each patient.
+        - 400 Bad Request: Returned if a time or the format is invalid.
+
+    Example Response Body:
+    ```
+    {"nhs_number": "string", "name": "string", "date_of_birth": "YYYY-MM-DD", "postcode": "string", "version": 1}
+    ```
+    """
+    conditions = appointment_export_filters()
+    if conditions is None:
+        logger.info(f"Invalid export filters: {dict(request.args)}")
+        return jsonify({"message": "Invalid time"}), 400
+
+    query = db.select(*(getattr(Patient, field) for field in PATIENT_EXPORT_FIELDS))
+    if conditions:
+        query = query.where(
+            db.exists().where(Appointment.patient == Patient.nhs_number, *conditions)
+        )
+
+    def records():
+        rows = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for row in rows:
+            record = {field: getattr(row, field) for field in PATIENT_EXPORT_FIELDS}
+            record["date_of_birth"] = row.date_of_birth.isoformat()
+            yield record
+
+    logger.info(f"Exporting patients with filters: {dict(request.args)}")
+    response = export_response("patients", records(), PATIENT_EXPORT_FIELDS)
+    if response is None:
+        return jsonify({"message": "Invalid format"}), 400
+
+    audit_bulk_read("patient")
+    return response
+
+
+@app.cli.command("prune-tombstones")
+def prune_tombstones():
+    """Forget deletions older than SYNC_TOMBSTONE_RETENTION_DAYS."""
+    cutoff = utcnow() - timedelta(days=app.config["SYNC_TOMBSTONE_RETENTION_DAYS"])
+    result = db.session.execute(db.delete(Tombstone).where(Tombstone.deleted_at < cutoff))
+    db.session.commit()
+    logger.info(f"Pruned {result.rowcount} tombstones from before {cutoff}")
+
+
+@app.cli.command("build-postcode-directory")
+@click.argument("source")
+@click.argument("output")
+def build_postcode_directory_command(source, output):
+    """Compile a published postcode list at SOURCE into a postcode directory file at OUTPUT.
+
+    SOURCE is a CSV such as the ONS Postcode Directory, or a file of one postcode per line.
+    """
+    logger.info(f"Building postcode directory from {source}...")
+    count = build_postcode_directory(read_postcode_list(source), output)
+    logger.info(f"Postcode directory {output} holds {count} postcodes")
+
+
+@app.cli.command("archive-appointments")
+@click.option("--before", help="Archive appointments that ended before this date or time (ISO 8601).")
+@click.option("--chunk-size", default=1000, help="How many appointments to archive at a time.")
+def archive_appointments(before, chunk_size):
+    """Move appointments that ended long ago out of the database, into monthly archive files.
+
+    By default, appointments that ended more than ARCHIVE_AFTER_DAYS ago are archived, whatever
+    their status, and active ones are archived as missed. They are archived a chunk at a time:
+    each chunk is appended to the archives for the months the appointments were in, then the
+    appointments are deleted and their archive locations recorded, in one transaction. If this is
+    interrupted, the chunk in progress is archived again next time, and the orphaned copy is ignored.
+    """
+    if before:
+        cutoff = datetime.fromisoformat(before)
+        if cutoff.tzinfo is None:
+            cutoff = cutoff.replace(tzinfo=timezone.utc)
+    else:
+        cutoff = utcnow() - timedelta(days=app.config["ARCHIVE_AFTER_DAYS"])
+
+    directory = app.config["ARCHIVE_DIRECTORY"]
+    os.makedirs(directory, exist_ok=True)
+    logger.info(f"Archiving appointments that ended before {cutoff} to {directory}...")
+
+    archived = 0
+    while True:
+        # Lock the chunk, so that nobody changes it between us archiving and deleting it
+        appointments = db.session.scalars(
+            db.select(Appointment)
+            .where(Appointment.end_time < cutoff)
+            .order_by(Appointment.end_time, Appointment.id)
+            .limit(chunk_size)
+            .with_for_update()
+        ).all()
+        if not appointments:
+            db.session.rollback()
+            break
+
+        archives = {}
+        for appointment in appointments:
+            record = appointment.serialize()
+            if record["status"] == "active":
+                # It ended before the cutoff without the patient attending
+                record["status"] = "missed"
+
+            name = archive_file_name("appointments", appointment.time.astimezone(timezone.utc))
+            archives.setdefault(name, []).append(record)
+
+        for name, records in archives.items():
+            offset = append_archive_chunk(os.path.join(directory, name), records)
+            db.session.add_all(
+                ArchivedAppointment(id=record["id"], archive=name, chunk_offset=offset)
+                for record in records
             )
-            return jsonify({"message": "Invalid state change"}), 400
 
-    # If we got a postcode, make sure it's valid
-    if "postcode" in data:
-        data["postcode"] = format_postcode(data["postcode"])
+        # Deleted in bulk, as they are being archived rather than deleted as far as clients are
+        # concerned, so there should be no tombstones or change events. That also bypasses
+        # update_stats_counters, so take them off the counts here.
+        counts = Counter()
+        for appointment in appointments:
+            counts[appointment_counter_key(appointment.time, appointment.department, appointment.status)] -= 1
+        add_to_stats_counters(db.session.connection(), counts, 0)
+        db.session.execute(
+            db.delete(Appointment).where(Appointment.id.in_([a.id for a in appointments])),
+            execution_options={"synchronize_session": False},
+        )
+        db.session.commit()
+        db.session.expunge_all()
 
-        # And if it's not, return an error
-        if not data["postcode"]:
-            logger.info(f"[{id}] Invalid postcode: {data['postcode']}")
-            return jsonify({"message": "Invalid postcode"}), 400
+        archived += len(appointments)
+        logger.info(f"Archived {archived} appointments")
 
-    # TODO: Can we update the patient?
-    if "patient" in data:
-        # Validate the NHS number
-        if not validate_nhs_number(data["patient"]):
-            logger.info(f"Invalid NHS number: {data['patient']}")
-            return jsonify({"message": "Invalid NHS number"}), 400
+    logger.info(f"Finished archiving, {archived} appointments archived")
 
-    # Build the modified appointment object
-    # Default to the existing value if the new value is not provided.
-    fields = [
-        "patient",
-        "status",
-        "time",
-        "duration",
-        "clinician",
-        "department",
-        "postcode",
+
+def format_postcodes(records) -> int:
+    changed = 0
+    for record in records:
+        postcode = format_postcode(record.postcode)
+        if not postcode:
+            logger.warning(f"Cannot format postcode {record.postcode!r}, leaving it as it is")
+        elif postcode != record.postcode:
+            record.postcode = postcode
+            changed += 1
+    return changed
+
+
+def mark_missed_appointments(appointments) -> int:
+    for appointment in appointments:
+        appointment.status = "missed"
+    return len(appointments)
+
+
+# Changes to existing records, too big to make in one transaction in a schema migration. Run them
+# with `flask data-migrate NAME`.
+DATA_MIGRATIONS = {
+    migration.name: migration
+    for migration in [
+        DataMigration(
+            "format-patient-postcodes",
+            "Format patients' postcodes that were saved before they were formatted.",
+            Patient,
+            Patient.nhs_number,
+            format_postcodes,
+        ),
+        DataMigration(
+            "format-appointment-postcodes",
+            "Format appointments' postcodes that were saved before they were formatted.",
+            Appointment,
+            Appointment.id,
+            format_postcodes,
+        ),
+        DataMigration(
+            "mark-missed-appointments",
+            "Mark active appointments that have passed as missed, rather than waiting for a GET.",
+            Appointment,
+            Appointment.id,
+            mark_missed_appointments,
+            where=(Appointment.status == "active", Appointment.end_time < db.func.now()),
+        ),
     ]
+}
 
-    for field in data.keys():
-        if field not in fields:
-            return jsonify({"message": "Invalid field"}), 400
 
-    for field in fields:
-        if field in data:
-            logger.info(
-                f"[{id}] Updating appointment field: {field} from {getattr(appointment, field)} to {data[field]}"
-            )
-            if field == "time":
-                logger.info(f"[{id}] This is a time field, so parsing the time")
-                setattr(appointment, field, datetime.fromisoformat(data[field]))
+@app.cli.command("data-migrate")
+@click.argument("name", required=False)
+@click.option("--chunk-size", default=500, help="How many records to change in each transaction.")
+@click.option("--pause", default=0.1, help="How long to wait between chunks, in seconds.")
+@click.option("--restart", is_flag=True, help="Start again from the beginning, ignoring any checkpoint.")
+def data_migrate(name, chunk_size, pause, restart):
+    """Run the data migration NAME, or list the data migrations and their progress without NAME.
+
+    Data migrations change existing records a chunk at a time, in short transactions, so they can
+    run while the app is serving requests. They checkpoint their progress as they go, and running
+    one again after it is interrupted resumes from its last checkpoint.
+    """
+    if name is None:
+        for migration in DATA_MIGRATIONS.values():
+            checkpoint = db.session.get(DataMigrationCheckpoint, migration.name)
+            if checkpoint is None:
+                progress = "not started"
+            elif checkpoint.finished_at is None:
+                progress = f"{checkpoint.records} records done, up to {checkpoint.position}"
             else:
-                setattr(appointment, field, data[field])
+                progress = f"finished at {checkpoint.finished_at}, changed {checkpoint.changed} records"
+            click.echo(f"{migration.name}: {migration.description} ({progress})")
+        return
 
-    # If the appointment date has passed, and the status is still "active" we need to set it to "missed"
-    # If the appointment date has passed, and the status is still "active" we need to set it to "missed"
-    missed_appointment = check_if_missed_appointment(appointment)
-    if missed_appointment:
-        appointment.status = "missed"
-        logger.info(
-            f"[{id}] Patient did not get registered as attending their appointment before it passed, marking them as having missed it."
-        )
+    if name not in DATA_MIGRATIONS:
+        raise click.BadParameter(f"No data migration called {name}", param_hint="NAME")
 
+    if restart:
+        db.session.execute(db.delete(DataMigrationCheckpoint).where(DataMigrationCheckpoint.name == name))
+        db.session.commit()
+
+    logger.info(f"Running data migration {name}...")
+    run_data_migration(db.session, DATA_MIGRATIONS[name], DataMigrationCheckpoint, chunk_size, pause)
+
+
+@app.cli.command("reconcile-stats")
+def reconcile_stats():
+    """Recount the patients and appointments, and correct the counts served by /stats/summary.
+
+    The counts are kept up to date by every write through the app, but anything that changes the
+    tables directly, like a manual fix in psql, will make them drift. The counters are locked while
+    the records are counted, so writes wait for the recount rather than being lost by it.
+    """
+    logger.info("Recounting patients and appointments...")
+    miscounted = recount_stats()
+    logger.info(f"Finished recounting, corrected {miscounted} appointment counts")
+
+
+def recount_stats() -> int:
+    """Count the patients and appointments from scratch, and commit the counts.
+
+    Returns how many of the appointment counts were wrong.
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.execute(text("LOCK TABLE appointment_counter, patient_counter IN EXCLUSIVE MODE"))
+
+    if db.session.get_bind(Appointment).dialect.name == "sqlite":
+        # SQLite keeps times in UTC already
+        day = db.func.date(Appointment.time, type_=db.Date)
+    else:
+        day = db.cast(db.func.timezone("UTC", Appointment.time), db.Date)
+    actual = Counter()
+    # With shards, each shard has its own count of each key, so add them up
+    for row in db.session.execute(
+        db.select(day.label("day"), Appointment.department_id, Appointment.status, db.func.count().label("count"))
+        .group_by(day, Appointment.department_id, Appointment.status)
+    ):
+        department = department_names.name_for(db.session, row.department_id)
+        actual[(row.day, department, row.status)] += row.count
+    actual_patients = sum(db.session.scalars(db.select(db.func.count()).select_from(Patient)))
+
+    counted = Counter()
+    for row in db.session.execute(
+        db.select(
+            AppointmentCounter.day,
+            AppointmentCounter.department,
+            AppointmentCounter.status,
+            db.func.sum(AppointmentCounter.count).label("count"),
+        ).group_by(AppointmentCounter.day, AppointmentCounter.department, AppointmentCounter.status)
+    ):
+        counted[(row.day, row.department, row.status)] += int(row.count)
+    counted_patients = int(
+        db.session.scalar(db.select(db.func.coalesce(db.func.sum(PatientCounter.count), 0)))
+    )
+
+    drift = Counter(actual)
+    drift.subtract(counted)
+    for (day, department, status), difference in sorted(drift.items()):
+        if difference:
+            logger.info(
+                f"Appointments on {day} in {department} that are {status} were miscounted by {-difference}"
+            )
+    if actual_patients != counted_patients:
+        logger.info(f"Patients were miscounted by {counted_patients - actual_patients}")
+
+    # Start the counts again from scratch, which also tidies away all the slots that are at zero
+    db.session.execute(db.delete(AppointmentCounter))
+    db.session.execute(db.delete(PatientCounter))
+    db.session.flush()
+    add_to_stats_counters(db.session.connection(), actual, actual_patients)
     db.session.commit()
-    logger.info(f"Appointment {id} updated successfully")
-    return jsonify({"message": "Appointment updated successfully"}), 200
 
+    return sum(1 for difference in drift.values() if difference)
 
-# DELETE /appointments/<id>/ - Remove an appointment
-@app.route("/appointments/<id>/", methods=["DELETE"])
-def delete_appointment(id):
+
+# The tables of names that appointments refer to. With shards, every shard has a copy of them.
+NAME_TABLES = [Clinician.__table__, Department.__table__]
+
+# The tables that snapshots hold, in the order they are written and restored
+SNAPSHOT_TABLES = NAME_TABLES + [Patient.__table__, Appointment.__table__]
+
+
+def snapshot_engines() -> dict:
+    """The databases that patients and appointments are kept in, by shard ID."""
+    if len(shard_router):
+        return {shard_id: db.engines[shard_id] for shard_id in shard_router.shard_ids}
+    return {shard_router.default: db.engine}
+
+
+@app.cli.command("snapshot")
+@click.argument("output")
+@click.option("--chunk-size", default=10000, help="How many rows to read and write at a time.")
+def snapshot(output, chunk_size):
+    """Save every patient and appointment to a snapshot file at OUTPUT, for `flask restore`.
+
+    Everything is read in one REPEATABLE READ transaction (one read transaction on SQLite), so the
+    snapshot is consistent even while the app is serving requests (with shards, each shard is consistent on its own). Rows are
+    streamed from the database and written a chunk at a time, column by column and compressed.
     """
-    Handles the DELETE request to remove a specific appointment using the appointment ID.
+    logger.info(f"Snapshotting patients and appointments to {output}...")
+    # With shards, each shard's copy of the names is saved, but only once for each ID
+    saved_ids = {table.name: set() for table in NAME_TABLES}
+    with SnapshotWriter(output) as writer:
+        for shard_id, engine in snapshot_engines().items():
+            with engine.connect() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.execution_options(isolation_level="REPEATABLE READ")
+                with connection.begin():
+                    if connection.dialect.name == "postgresql":
+                        connection.execute(text("SET TRANSACTION READ ONLY"))
+                    elif connection.dialect.name == "sqlite":
+                        # pysqlite only starts a transaction before a write, so without this each
+                        # SELECT would see the database as it was when that SELECT ran
+                        connection.exec_driver_sql("BEGIN")
+                    for table in SNAPSHOT_TABLES:
+                        columns = [column.name for column in table.columns]
+                        for rows in dump_table(connection, table, chunk_size):
+                            if table.name in saved_ids:
+                                rows = [row for row in rows if row[0] not in saved_ids[table.name]]
+                                saved_ids[table.name].update(row[0] for row in rows)
+                            if rows:
+                                writer.write_chunk(table.name, columns, rows)
+
+            logger.info(f"Snapshotted {shard_id}, {writer.counts} rows so far")
+
+    logger.info(f"Finished the snapshot, {writer.counts} rows saved to {output}")
+
+
+@app.cli.command("restore")
+@click.argument("source")
+@click.option("--replace", is_flag=True, help="Delete the patients and appointments that are already there.")
+def restore(source, replace):
+    """Load the patients and appointments in a snapshot at SOURCE, made by `flask snapshot`.
+
+    Everything is loaded in one transaction (one per shard), with COPY on Postgres, so if anything
+    goes wrong, nothing is loaded. Unless --replace is given, the tables must be empty. The counts
+    served by /stats/summary are recounted afterwards.
+    """
+    tables = {table.name: table for table in SNAPSHOT_TABLES}
+    logger.info(f"Restoring patients and appointments from {source}...")
+
+    engines = snapshot_engines()
+    if len(shard_router):
+        # The primary gives out the IDs of new names, so needs them too
+        engines[shard_router.default] = db.engine
+
+    with ExitStack() as stack:
+        connections = {}
+        for shard_id, engine in engines.items():
+            connection = stack.enter_context(engine.connect())
+            stack.enter_context(connection.begin())
+            connections[shard_id] = connection
+
+            if replace and connection.dialect.name == "postgresql":
+                # Tables referred to by foreign keys can only be truncated along with what refers to them
+                connection.execute(text(f"TRUNCATE {', '.join(table.name for table in reversed(SNAPSHOT_TABLES))}"))
+                continue
+
+            for table in reversed(SNAPSHOT_TABLES):
+                if replace:
+                    connection.execute(table.delete())
+                elif connection.execute(db.select(table).limit(1)).first():
+                    raise click.ClickException(f"The {table.name} table in {shard_id} isn't empty, use --replace")
+
+        loaded = Counter()
+        for table_name, columns, rows in read_snapshot(source):
+            table = tables[table_name]
+            unknown = set(columns) - set(table.columns.keys())
+            if unknown:
+                raise click.ClickException(f"The snapshot has columns that {table_name} doesn't: {unknown}")
+
+            if table in NAME_TABLES:
+                parts = {shard_id: rows for shard_id in connections}
+            elif len(shard_router):
+                # The snapshot could be from a different number of shards
+                key = columns.index(shard_router.keys[table_name])
+                parts = {}
+                for row in rows:
+                    parts.setdefault(shard_router.shard_id_for(row[key]), []).append(row)
+            else:
+                parts = {shard_router.default: rows}
+
+            for shard_id, part in parts.items():
+                load_rows(connections[shard_id], table, columns, part)
+            loaded[table_name] += len(rows)
+            logger.info(f"Loaded {loaded[table_name]} {table_name} rows")
+
+        for connection in connections.values():
+            if connection.dialect.name == "postgresql":
+                # COPY doesn't move the sequences on, so new names would be given IDs already in use
+                for table in NAME_TABLES:
+                    connection.execute(
+                        text(
+                            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                            f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"
+                        )
+                    )
+
+    miscounted = recount_stats()
+    logger.info(f"Finished restoring {dict(loaded)} rows, and recounted the stats ({miscounted} counts changed)")
+
+
+@app.cli.command("init-db")
+def init_db():
+    """Create every table in a new, empty database, and mark it as up to date with the migrations.
+
+    This is how to set up a SQLite database, as the older migrations change columns in ways that
+    only Postgres can. Later migrations are applied with `flask db upgrade`, as usual.
+    """
+    from flask_migrate import stamp
 
-    Endpoint: `/appointments/<id>/`
-    Method: DELETE
+    if inspect(db.engine).get_table_names():
+        raise click.ClickException("The database already has tables, use `flask db upgrade` to update it")
 
-    Description:
-    This endpoint is responsible for deleting a specific appointment record from the database
-    using the appointment ID. If the appointment is found, the record is deleted, and a 200 OK
-    response along with a success message is returned. If the appointment is not found, a
-    404 Not Found response is returned.
+    db.metadata.create_all(db.engine)
+    stamp()
+    logger.info(f"Created the tables in {db.engine.url.render_as_string(hide_password=True)}")
 
-    Path Parameters:
-        - id (str): The ID of the appointment to delete.
 
-    Responses:
-        - 200 OK: Successfully deleted the appointment record. A success message is returned in the response body.
-        - 404 Not Found: Returned if no appointment record is found with the provided ID.
+@app.cli.command("init-shards")
+def init_shards():
+    """Create the patient and appointment tables in any shards that don't have them yet.
 
-    Returns:
-        - JSON response with a message indicating the result of the operation.
+    The clinicians and departments that have been given IDs so far are copied into each shard.
     """
-    appointment = db.session.get(Appointment, id)
-    if not appointment:
-        return jsonify({"message": "Appointment not found"}), 404
+    if not len(shard_router):
+        logger.info("No shards are configured, set SQLALCHEMY_SHARD_URIS to use them")
+        return
+
+    for shard_id in shard_router.shard_ids:
+        engine = db.engines[shard_id]
+        db.metadata.create_all(engine, tables=SNAPSHOT_TABLES)
+        with db.engine.connect() as primary, engine.begin() as shard:
+            for table in NAME_TABLES:
+                rows = primary.execute(db.select(table)).mappings().all()
+                if rows:
+                    shard.execute(INSERTS[shard.dialect.name](table).on_conflict_do_nothing(), [dict(row) for row in rows])
+        logger.info(f"Created the tables in {shard_id}")
+
+
+@app.cli.command("rebalance-shards")
+@click.option("--chunk-size", default=1000, help="How many rows to check at a time.")
+def rebalance_shards(chunk_size):
+    """Move patients and appointments to the shards they now belong in, after adding shards.
+
+    Add the new shards to the end of SQLALCHEMY_SHARD_URIS, run `flask init-shards`, then run this
+    with the app stopped. It can safely be run again if it is interrupted.
+    """
+    if not len(shard_router):
+        logger.info("No shards are configured, set SQLALCHEMY_SHARD_URIS to use them")
+        return
 
-    db.session.delete(appointment)
-    db.session.commit()
-    return jsonify({"message": "Appointment deleted successfully"}), 200
+    logger.info(f"Rebalancing patients and appointments across {len(shard_router)} shards...")
+    engines = {shard_id: db.engines[shard_id] for shard_id in shard_router.shard_ids}
+    moved = rebalance(engines, shard_router, [Patient.__table__, Appointment.__table__], chunk_size)
+    logger.info(f"Finished rebalancing, moved {moved['patient']} patients and {moved['appointment']} appointments")
+
+
+@app.cli.command("audit-double-bookings")
+def audit_double_bookings():
+    """Report every pair of appointments that double-book a clinician, as CSV on stdout.
+
+    Appointments are streamed from the database ordered by clinician and start time, and each
+    clinician's appointments are swept through once, so this scales to the whole table.
+    Exits with status 1 if any double bookings are found.
+    """
+    logger.info("Auditing appointments for double-booked clinicians...")
+    query = (
+        db.select(Appointment.clinician_id, Appointment.time, Appointment.end_time, Appointment.id)
+        .where(Appointment.status != "cancelled")
+        .order_by(Appointment.clinician_id, Appointment.time)
+        .execution_options(yield_per=1000)
+    )
+    if len(shard_router):
+        # A clinician sees patients in every shard, where they have the same ID
+        rows = merge_shards(
+            db.session, shard_router.shard_ids, query, key=lambda row: (row.clinician_id, row.time)
+        )
+    else:
+        rows = db.session.execute(query)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["clinician", "appointment", "conflicting_appointment"])
+
+    conflicts = 0
+    for clinician_id, appointments in groupby(rows, key=lambda row: row.clinician_id):
+        intervals = ((row.time, row.end_time, row.id) for row in appointments)
+        for first, second in find_overlaps(intervals):
+            writer.writerow([clinician_names.name_for(db.session, clinician_id), first, second])
+            conflicts += 1
+
+    logger.info(f"Found {conflicts} double bookings")
+    if conflicts:
+        sys.exit(1)
+
+
+@app.cli.command("find-duplicate-patients")
+@click.argument("output", type=click.File("w"), default="-")
+@click.option("--threshold", default=0.9, help="How alike names must be to report, from 0 to 1.")
+@click.option("--processes", type=int, help="How many processes to compare names in (default: one per CPU).")
+def find_duplicate_patients(output, threshold, processes):
+    """Report pairs of patients who could be the same person, as CSV to OUTPUT (default stdout).
+
+    Patients are only compared with others born on the same day at the same postcode, and are
+    read from the database a block of them at a time, so this scales to the whole table. Their
+    names are scored with the Jaro-Winkler similarity, ignoring case, accents, punctuation, titles
+    and word order. Pairs are listed most alike first.
+    """
+    if not 0 <= threshold <= 1:
+        raise click.BadParameter("The threshold must be between 0 and 1", param_hint="--threshold")
+
+    logger.info("Looking for duplicate patients...")
+    # Ordered by block, so each block is scored as soon as it has been read. Postcodes that format
+    # the same are the same without their spaces, and are ordered as Python would, to merge shards.
+    postcode = db.func.upper(db.func.replace(Patient.postcode, " ", ""))
+    if db.session.get_bind(Patient).dialect.name == "postgresql":
+        postcode = postcode.collate("C")
+    query = (
+        db.select(Patient.nhs_number, Patient.name, Patient.search_key, Patient.postcode, Patient.date_of_birth)
+        .order_by(postcode, Patient.date_of_birth)
+        .execution_options(yield_per=10000)
+    )
+    if len(shard_router):
+        # The patients in a block can be in any shard
+        rows = merge_shards(
+            db.session,
+            shard_router.shard_ids,
+            query,
+            key=lambda row: (row.postcode.replace(" ", "").upper(), row.date_of_birth),
+        )
+    else:
+        rows = db.session.execute(query)
+    candidates = find_duplicates(rows, threshold=threshold, processes=processes)
+
+    writer = csv.writer(output)
+    writer.writerow(
+        ["rank", "score", "nhs_number", "name", "duplicate_nhs_number", "duplicate_name", "postcode", "date_of_birth"]
+    )
+    for rank, (score, first, second, (postcode, date_of_birth)) in enumerate(candidates, 1):
+        writer.writerow([rank, f"{score:.3f}", first[0], first[1], second[0], second[1], postcode, date_of_birth])
+
+    logger.info(f"Found {len(candidates)} possible duplicate patients")
 
 
 if __name__ == "__main__":
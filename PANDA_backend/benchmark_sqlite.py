@@ -0,0 +1,162 @@
+"""Benchmark the app on a SQLite database, under a clinic's mix of reads and writes.
+
+Each thread plays a member of staff, looking up patients and appointments, booking
+appointments and marking them attended, as fast as it can. At the end, the requests served per
+second and the latency of each kind of request are printed, and the exit status is 1 if fewer than
+--target-rate requests a second were served, or any request failed.
+
+    python benchmark_sqlite.py --threads 8 --seconds 30 --target-rate 50
+
+A new database is made at --database (by default in a temporary directory) and filled with the
+example patients from the tests, so this never touches a real database.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def staff_member(app, patients: list, number: int, deadline: float, write_fraction: float, results: dict):
+    """Make requests until the deadline, recording how long each kind took."""
+    client = app.test_client()
+    rng = random.Random(number)
+    # Each member of staff books for their own clinician, one slot after another, so that they
+    # never double book and have their requests refused
+    clinician = f"Benchmark Clinician {number}"
+    slot = datetime(2030, 1, 1, 9, tzinfo=timezone.utc) + timedelta(days=365 * number)
+    booked = []
+    appointments = []
+
+    while time.perf_counter() < deadline:
+        if rng.random() < write_fraction:
+            if booked and rng.random() < 0.5:
+                kind = "attend appointment"
+                started = time.perf_counter()
+                response = client.put(f"/appointments/{booked.pop()}/", json={"status": "attended"})
+            else:
+                kind = "book appointment"
+                patient = rng.choice(patients)
+                started = time.perf_counter()
+                response = client.post(
+                    "/appointments/",
+                    json={
+                        "patient": patient["nhs_number"],
+                        "status": "active",
+                        "time": slot.isoformat(),
+                        "duration": "15m",
+                        "clinician": clinician,
+                        "department": "oncology",
+                        "postcode": patient["postcode"],
+                    },
+                )
+                slot += timedelta(minutes=15)
+                if response.status_code == 201:
+                    booked.append(response.get_json()["id"])
+                    appointments.append(booked[-1])
+        elif appointments and rng.random() < 0.4:
+            kind = "get appointment"
+            started = time.perf_counter()
+            response = client.get(f"/appointments/{rng.choice(appointments)}/")
+        elif rng.random() < 0.7:
+            kind = "get patient"
+            started = time.perf_counter()
+            response = client.get(f"/patients/{rng.choice(patients)['nhs_number']}/")
+        else:
+            kind = "search patients"
+            name = rng.choice(patients)["name"].split()[-1]
+            started = time.perf_counter()
+            response = client.get("/patients/search", query_string={"q": name})
+
+        latency = time.perf_counter() - started
+        result = results.setdefault(kind, {"latencies": [], "errors": 0})
+        result["latencies"].append(latency)
+        if response.status_code >= 400:
+            result["errors"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="Where to make the SQLite database.")
+    parser.add_argument("--threads", type=int, default=8, help="How many requests to make at once.")
+    parser.add_argument("--seconds", type=float, default=30, help="How long to run for.")
+    parser.add_argument("--write-fraction", type=float, default=0.3, help="The fraction of requests that write.")
+    parser.add_argument("--target-rate", type=float, default=50, help="The requests a second needed.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database = args.database or os.path.join(directory, "panda.db")
+    if os.path.exists(database):
+        sys.exit(f"{database} already exists, give a path for a new database")
+
+    # The app reads its configuration when it is imported
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.abspath(database)}"
+    sys.path.insert(0, HERE)
+    from logging import getLogger, WARNING
+
+    from app import app, db
+
+    getLogger().setLevel(WARNING)
+
+    with open(os.path.join(HERE, "tests", "example-patients.json"), "r") as f:
+        patients = json.load(f)
+
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    for patient in patients:
+        client.post("/patients/", json=patient)
+
+    results = [{} for _ in range(args.threads)]
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(
+            target=staff_member, args=(app, patients, number, deadline, args.write_fraction, results[number])
+        )
+        for number in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    combined = {}
+    for result in results:
+        for kind, measured in result.items():
+            total = combined.setdefault(kind, {"latencies": [], "errors": 0})
+            total["latencies"] += measured["latencies"]
+            total["errors"] += measured["errors"]
+
+    requests = sum(len(measured["latencies"]) for measured in combined.values())
+    errors = sum(measured["errors"] for measured in combined.values())
+    rate = requests / elapsed
+
+    print(f"{requests} requests in {elapsed:.1f}s from {args.threads} threads: {rate:.1f} requests a second")
+    for kind, measured in sorted(combined.items()):
+        latencies = measured["latencies"]
+        print(
+            f"  {kind:<28} {len(latencies):>7} requests, {measured['errors']} failed, "
+            f"p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms"
+        )
+
+    if errors or rate < args.target_rate:
+        print(f"Failed: needed {args.target_rate:.1f} requests a second, with none failing")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
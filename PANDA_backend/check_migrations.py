@@ -0,0 +1,32 @@
+"""Check whether the database has had every migration applied, without loading the app.
+
+Exits with status 0 if the database is at the latest revision, and 1 if it needs upgrading.
+This only needs SQLAlchemy and alembic, so it is much quicker than `flask db current`, which is
+what makes it worth checking before deciding whether to run `flask db upgrade`.
+"""
+import os
+import sys
+
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+
+def main():
+    heads = set(ScriptDirectory(os.path.join(os.path.dirname(__file__), "migrations")).get_heads())
+
+    engine = create_engine(os.environ["SQLALCHEMY_DATABASE_URI"], poolclass=NullPool)
+    with engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+
+    if current == heads:
+        print(f"Database is at the latest revision: {', '.join(sorted(heads))}")
+        return 0
+
+    print(f"Database is at {', '.join(sorted(current)) or 'no revision'}, latest is {', '.join(sorted(heads))}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
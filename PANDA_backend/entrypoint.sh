@@ -1,18 +1,27 @@
 #!/bin/sh
 
+# Remember when we started, so the app can report how long it took to serve its first request
+export PANDA_START_TIME=$(date +%s.%N)
+
 # Set the python path to include the /usr/src/app directory (otherwise imports break)
 export PYTHONPATH="${PYTHONPATH}:/usr/src/app"
 
-# Wait for the testing database
-while ! nc -z db-test 5432; do
-  echo "Waiting for the PostgreSQL database..."
-  sleep 1
-done
-echo "Test database is ready."
+# In production mode, we skip the tests and never generate migrations, only apply the committed
+# ones, so that restarts and new containers are serving requests within a couple of seconds
+APP_MODE=${APP_MODE:-development}
 
-# Run tests
-# to enable logging from within the app while tests are running, add --log-cli-level=DEBUG after pytest
-SQLALCHEMY_DATABASE_URI=${TEST_DATABASE_URL} python -m pytest -v tests 
+if [ "$APP_MODE" != "production" ]; then
+  # Wait for the testing database
+  while ! nc -z db-test 5432; do
+    echo "Waiting for the PostgreSQL database..."
+    sleep 1
+  done
+  echo "Test database is ready."
+
+  # Run tests
+  # to enable logging from within the app while tests are running, add --log-cli-level=DEBUG after pytest
+  SQLALCHEMY_DATABASE_URI=${TEST_DATABASE_URL} python -m pytest -v tests
+fi
 
 # Wait for the database
 while ! nc -z db 5432; do
@@ -24,6 +33,22 @@ echo "Prod database is ready."
 # And set the database URL
 export SQLALCHEMY_DATABASE_URI=${DATABASE_URL}
 
+if [ "$APP_MODE" = "production" ]; then
+  # Only load the app to run migrations if there are any to run
+  if ! python check_migrations.py; then
+    echo "Running migrations"
+    flask db upgrade
+  fi
+
+  # The app is imported once, before the workers are forked, so they start serving straight away
+  echo "Starting the Flask application"
+  exec gunicorn --preload \
+    --workers ${WEB_CONCURRENCY:-4} \
+    --threads ${WEB_THREADS:-8} \
+    --bind 0.0.0.0:5000 \
+    app:app
+fi
+
 # Check if the migrations directory exists
 if [ ! -d "migrations" ]; then
   # Initialize the database and migrations
@@ -39,4 +64,4 @@ flask db upgrade
 
 # Start the Flask application
 echo "Starting the Flask application"
-exec python app.py
\ No newline at end of file
+exec python app.py
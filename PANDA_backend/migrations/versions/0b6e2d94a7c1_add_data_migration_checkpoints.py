@@ -0,0 +1,33 @@
+"""Keep track of how far data migrations have got.
+
+Revision ID: 0b6e2d94a7c1
+Revises: f4c1a8e2b957
+Create Date: 2026-10-19 16:48:13.582904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e2d94a7c1'
+down_revision = 'f4c1a8e2b957'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_migration_checkpoint',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('position', sa.String(length=255), nullable=True),
+    sa.Column('records', sa.Integer(), nullable=False),
+    sa.Column('changed', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('data_migration_checkpoint')
@@ -0,0 +1,26 @@
+"""Add version columns for optimistic concurrency control.
+
+Revision ID: 3f8a2c1d9b47
+Revises: baaf36605ab6
+Create Date: 2026-10-19 09:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a2c1d9b47'
+down_revision = 'baaf36605ab6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('patient', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('appointment', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('appointment', 'version')
+    op.drop_column('patient', 'version')
@@ -0,0 +1,132 @@
+"""Move appointments' clinicians and departments into their own tables.
+
+Revision ID: 4e6a2b8d1f35
+Revises: 9d3a5f1c2e84
+Create Date: 2026-10-19 20:12:08.441930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e6a2b8d1f35'
+down_revision = '9d3a5f1c2e84'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# The name tables, and the appointment column that refers to each
+NAMES = [('clinician', 'clinician_id'), ('department', 'department_id')]
+
+
+def name_table(name):
+    return sa.table(name, sa.column('id', sa.Integer), sa.column('name', sa.String))
+
+
+def upgrade():
+    for name, _ in NAMES:
+        op.create_table(name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+        )
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('clinician_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('department_id', sa.Integer(), nullable=True))
+
+    conn = op.get_bind()
+    appointment = sa.table(
+        'appointment',
+        sa.column('id', sa.String),
+        sa.column('clinician', sa.String),
+        sa.column('department', sa.String),
+        sa.column('clinician_id', sa.Integer),
+        sa.column('department_id', sa.Integer),
+    )
+
+    # Give each distinct name an ID, a batch of names at a time. The existing indexes on
+    # (clinician, ...) and (department, ...) let each batch pick up where the last left off.
+    for name, _ in NAMES:
+        table = name_table(name)
+        column = appointment.c[name]
+        last_name = ''
+        while True:
+            names = conn.execute(
+                sa.select(column).where(column > last_name).distinct().order_by(column).limit(BATCH_SIZE)
+            ).scalars().all()
+            if not names:
+                break
+
+            conn.execute(table.insert(), [{'name': value} for value in names])
+            last_name = names[-1]
+
+    # Then point the appointments at them, a batch of appointments at a time
+    ids = {}
+    for name, id_column in NAMES:
+        table = name_table(name)
+        ids[id_column] = sa.select(table.c.id).where(table.c.name == appointment.c[name]).scalar_subquery()
+    last_id = ''
+    while True:
+        batch = conn.execute(
+            sa.select(appointment.c.id).where(appointment.c.id > last_id).order_by(appointment.c.id).limit(BATCH_SIZE)
+        ).scalars().all()
+        if not batch:
+            break
+
+        conn.execute(
+            appointment.update()
+            .where(appointment.c.id >= batch[0], appointment.c.id <= batch[-1])
+            .values(**ids)
+        )
+        last_id = batch[-1]
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_clinician_end_time')
+        batch_op.drop_index('ix_appointment_department_clinician')
+        batch_op.alter_column('clinician_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('department_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('appointment_clinician_id_fkey', 'clinician', ['clinician_id'], ['id'])
+        batch_op.create_foreign_key('appointment_department_id_fkey', 'department', ['department_id'], ['id'])
+        batch_op.create_index('ix_appointment_clinician_end_time', ['clinician_id', 'end_time', 'time'], unique=False)
+        batch_op.create_index('ix_appointment_department_clinician', ['department_id', 'clinician_id'], unique=False)
+        batch_op.drop_column('clinician')
+        batch_op.drop_column('department')
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('clinician', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('department', sa.String(length=255), nullable=True))
+
+    appointment = sa.table(
+        'appointment',
+        sa.column('clinician', sa.String),
+        sa.column('department', sa.String),
+        sa.column('clinician_id', sa.Integer),
+        sa.column('department_id', sa.Integer),
+    )
+    for name, id_column in NAMES:
+        table = name_table(name)
+        op.execute(
+            appointment.update().values(
+                {name: sa.select(table.c.name).where(table.c.id == appointment.c[id_column]).scalar_subquery()}
+            )
+        )
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_department_clinician')
+        batch_op.drop_index('ix_appointment_clinician_end_time')
+        batch_op.drop_constraint('appointment_department_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('appointment_clinician_id_fkey', type_='foreignkey')
+        batch_op.alter_column('clinician', existing_type=sa.String(length=255), nullable=False)
+        batch_op.alter_column('department', existing_type=sa.String(length=255), nullable=False)
+        batch_op.create_index('ix_appointment_department_clinician', ['department', 'clinician'], unique=False)
+        batch_op.create_index('ix_appointment_clinician_end_time', ['clinician', 'end_time', 'time'], unique=False)
+        batch_op.drop_column('department_id')
+        batch_op.drop_column('clinician_id')
+
+    op.drop_table('department')
+    op.drop_table('clinician')
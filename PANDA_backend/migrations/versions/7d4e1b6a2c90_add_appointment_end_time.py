@@ -0,0 +1,60 @@
+"""Add appointment end times, indexed for double-booking checks.
+
+Revision ID: 7d4e1b6a2c90
+Revises: 3f8a2c1d9b47
+Create Date: 2026-10-19 10:03:17.402915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from utils.validators import parse_duration
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4e1b6a2c90'
+down_revision = '3f8a2c1d9b47'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('appointment', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+
+    # Backfill the end times in batches, rather than holding the whole table in memory
+    appointment = sa.table(
+        'appointment',
+        sa.column('id', sa.String),
+        sa.column('time', sa.DateTime(timezone=True)),
+        sa.column('duration', sa.String),
+        sa.column('end_time', sa.DateTime(timezone=True)),
+    )
+    conn = op.get_bind()
+    last_id = ''
+    while True:
+        rows = conn.execute(
+            sa.select(appointment.c.id, appointment.c.time, appointment.c.duration)
+            .where(appointment.c.id > last_id)
+            .order_by(appointment.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        conn.execute(
+            appointment.update()
+            .where(appointment.c.id == sa.bindparam('_id'))
+            .values(end_time=sa.bindparam('_end_time')),
+            [{'_id': row.id, '_end_time': row.time + parse_duration(row.duration)} for row in rows],
+        )
+        last_id = rows[-1].id
+
+    op.alter_column('appointment', 'end_time', nullable=False)
+    op.create_index('ix_appointment_clinician_end_time', 'appointment', ['clinician', 'end_time', 'time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_appointment_clinician_end_time', table_name='appointment')
+    op.drop_column('appointment', 'end_time')
@@ -0,0 +1,44 @@
+"""Keep running counts of patients and appointments for dashboards.
+
+Revision ID: 9d3a5f1c2e84
+Revises: 0b6e2d94a7c1
+Create Date: 2026-10-19 18:02:41.117305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3a5f1c2e84'
+down_revision = '0b6e2d94a7c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('appointment_counter',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('department', sa.String(length=255), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('slot', sa.SmallInteger(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'department', 'status', 'slot')
+    )
+    op.create_table('patient_counter',
+    sa.Column('slot', sa.SmallInteger(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('slot')
+    )
+    # Count what is already there, so the counts start out right
+    op.execute(
+        "INSERT INTO appointment_counter (day, department, status, slot, count) "
+        "SELECT CAST(timezone('UTC', time) AS DATE), department, status, 0, COUNT(*) FROM appointment "
+        "GROUP BY 1, 2, 3"
+    )
+    op.execute("INSERT INTO patient_counter (slot, count) SELECT 0, COUNT(*) FROM patient")
+
+
+def downgrade():
+    op.drop_table('patient_counter')
+    op.drop_table('appointment_counter')
@@ -0,0 +1,24 @@
+"""Index appointments by department and clinician.
+
+Revision ID: a91c5e3f7d28
+Revises: 7d4e1b6a2c90
+Create Date: 2026-10-19 11:41:52.730066
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91c5e3f7d28'
+down_revision = '7d4e1b6a2c90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_appointment_department_clinician', 'appointment', ['department', 'clinician'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_appointment_department_clinician', table_name='appointment')
@@ -0,0 +1,63 @@
+"""Record who reads and changes patients and appointments.
+
+Revision ID: b83f1d6c4a02
+Revises: 4e6a2b8d1f35
+Create Date: 2026-10-19 21:37:52.106284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83f1d6c4a02'
+down_revision = '4e6a2b8d1f35'
+branch_labels = None
+depends_on = None
+
+# Audit events can't be changed or deleted, even by hand
+APPEND_ONLY_TRIGGERS = {
+    'postgresql': [
+        "CREATE OR REPLACE FUNCTION audit_event_append_only() RETURNS trigger AS $$ "
+        "BEGIN RAISE EXCEPTION 'Audit events can not be changed or deleted'; END; $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER audit_event_append_only BEFORE UPDATE OR DELETE ON audit_event "
+        "FOR EACH ROW EXECUTE FUNCTION audit_event_append_only()",
+    ],
+    'sqlite': [
+        "CREATE TRIGGER audit_event_no_update BEFORE UPDATE ON audit_event "
+        "BEGIN SELECT RAISE(ABORT, 'Audit events can not be changed or deleted'); END",
+        "CREATE TRIGGER audit_event_no_delete BEFORE DELETE ON audit_event "
+        "BEGIN SELECT RAISE(ABORT, 'Audit events can not be changed or deleted'); END",
+    ],
+}
+
+
+def upgrade():
+    op.create_table('audit_event',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('actor', sa.String(length=255), nullable=True),
+    sa.Column('address', sa.String(length=45), nullable=True),
+    sa.Column('action', sa.String(length=10), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('key', sa.String(length=36), nullable=False),
+    sa.Column('endpoint', sa.String(length=100), nullable=True),
+    sa.Column('filters', sa.String(length=500), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_event', schema=None) as batch_op:
+        batch_op.create_index('ix_audit_event_at', ['at'], unique=False)
+        batch_op.create_index('ix_audit_event_kind_key_at', ['kind', 'key', 'at'], unique=False)
+
+    for statement in APPEND_ONLY_TRIGGERS.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_event_kind_key_at')
+        batch_op.drop_index('ix_audit_event_at')
+
+    op.drop_table('audit_event')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP FUNCTION IF EXISTS audit_event_append_only()')
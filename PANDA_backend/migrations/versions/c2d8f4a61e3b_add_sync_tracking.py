@@ -0,0 +1,42 @@
+"""Track when records change, and what has been deleted, for syncing clients.
+
+Revision ID: c2d8f4a61e3b
+Revises: a91c5e3f7d28
+Create Date: 2026-10-19 13:20:08.551862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d8f4a61e3b'
+down_revision = 'a91c5e3f7d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('key', sa.String(length=36), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstone_deleted_at', 'tombstone', ['deleted_at', 'id'], unique=False)
+
+    # Existing records are treated as having changed now, so the first sync picks them all up
+    for table, key in [('patient', 'nhs_number'), ('appointment', 'id')]:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+        op.alter_column(table, 'updated_at', server_default=None)
+        op.create_index(f'ix_{table}_updated_at', table, ['updated_at', key], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_appointment_updated_at', table_name='appointment')
+    op.drop_column('appointment', 'updated_at')
+    op.drop_index('ix_patient_updated_at', table_name='patient')
+    op.drop_column('patient', 'updated_at')
+    op.drop_index('ix_tombstone_deleted_at', table_name='tombstone')
+    op.drop_table('tombstone')
@@ -0,0 +1,66 @@
+"""Add normalized patient names for searching.
+
+Revision ID: e5b7c9d13f62
+Revises: c2d8f4a61e3b
+Create Date: 2026-10-19 14:47:35.904113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from utils.search import normalize_name
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7c9d13f62'
+down_revision = 'c2d8f4a61e3b'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('patient', sa.Column('search_key', sa.String(length=255), nullable=True))
+
+    # Backfill the search keys in batches, rather than holding the whole table in memory
+    patient = sa.table(
+        'patient',
+        sa.column('nhs_number', sa.String),
+        sa.column('name', sa.String),
+        sa.column('search_key', sa.String),
+    )
+    conn = op.get_bind()
+    last_nhs_number = ''
+    while True:
+        rows = conn.execute(
+            sa.select(patient.c.nhs_number, patient.c.name)
+            .where(patient.c.nhs_number > last_nhs_number)
+            .order_by(patient.c.nhs_number)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        conn.execute(
+            patient.update()
+            .where(patient.c.nhs_number == sa.bindparam('_nhs_number'))
+            .values(search_key=sa.bindparam('_search_key')),
+            [{'_nhs_number': row.nhs_number, '_search_key': normalize_name(row.name)} for row in rows],
+        )
+        last_nhs_number = rows[-1].nhs_number
+
+    op.alter_column('patient', 'search_key', nullable=False)
+
+    # The trigram index needs Postgres' pg_trgm extension. Without it, searches still work, but
+    # have to scan the table.
+    if conn.dialect.name == 'postgresql' and conn.execute(
+        sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar():
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_patient_search_key_trgm ON patient USING gin (search_key gin_trgm_ops)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_patient_search_key_trgm')
+    op.drop_column('patient', 'search_key')
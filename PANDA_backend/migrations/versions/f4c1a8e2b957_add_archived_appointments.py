@@ -0,0 +1,30 @@
+"""Record where archived appointments can be found.
+
+Revision ID: f4c1a8e2b957
+Revises: e5b7c9d13f62
+Create Date: 2026-10-19 16:02:41.307215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c1a8e2b957'
+down_revision = 'e5b7c9d13f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_appointment',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('archive', sa.String(length=255), nullable=False),
+    sa.Column('chunk_offset', sa.BigInteger(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('archived_appointment')
@@ -0,0 +1,69 @@
+import time
+from threading import Thread
+from ..utils.admission import AdmissionController, ConcurrencyLimit, RateLimiter, retry_after_header
+
+
+def test_concurrency_limit():
+    limit = ConcurrencyLimit(1, max_queue=1)
+    assert limit.acquire(timeout=0)
+
+    # One request can queue, but gives up after the timeout
+    start = time.monotonic()
+    assert not limit.acquire(timeout=0.05)
+    assert time.monotonic() - start >= 0.05
+
+    # And is admitted if a place comes free in time
+    Thread(target=lambda: (time.sleep(0.05), limit.release())).start()
+    assert limit.acquire(timeout=5)
+
+    # Nobody can queue behind a full queue
+    waiter = Thread(target=limit.acquire, args=(0.5,))
+    waiter.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert not limit.acquire(timeout=5)
+    assert time.monotonic() - start < 0.5
+    waiter.join()
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=10, burst=2)
+    assert limiter.take("client") == 0
+    assert limiter.take("client") == 0
+    assert 0 < limiter.take("client") <= 0.1
+
+    # Other clients have their own buckets
+    assert limiter.take("other client") == 0
+
+    time.sleep(0.1)
+    assert limiter.take("client") == 0
+
+
+def test_admission_controller():
+    controller = AdmissionController({"write": 1}, queue_timeout=0)
+
+    write = controller.admit("write", "client")
+    assert write.admitted
+
+    # Writes are full, but reads aren't limited
+    admission = controller.admit("write", "other client")
+    assert admission.status == 503
+    assert controller.admit("read", "client").admitted
+
+    # Releasing twice doesn't free up two places
+    write.release()
+    write.release()
+    assert controller.admit("write", "other client").admitted
+    assert controller.admit("write", "another client").status == 503
+
+    # Each client's requests of each class are rate limited
+    controller = AdmissionController({}, queue_timeout=0, rate=0.01, burst=2)
+    assert controller.admit("write", "client").admitted
+    assert controller.admit("write", "client").admitted
+    admission = controller.admit("write", "client")
+    assert admission.status == 429
+    assert admission.retry_after > 90
+    assert controller.admit("read", "client").admitted
+
+    assert retry_after_header(0.01) == "1"
+    assert retry_after_header(1.5) == "2"
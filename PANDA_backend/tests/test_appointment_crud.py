@@ -1,10 +1,32 @@
 import pytest
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+import io
+import csv
+import gzip
 import json
 import ukpostcodeparser
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from ..app import app, db, Appointment
+from ..app import (
+    app,
+    db,
+    Patient,
+    Appointment,
+    ArchivedAppointment,
+    Clinician,
+    Department,
+    DataMigrationCheckpoint,
+    AppointmentCounter,
+    DATA_MIGRATIONS,
+    availability_cache,
+    clinician_names,
+    department_names,
+    event_streams,
+)
+from ..utils.datamigrations import run_data_migration
+from ..utils.snapshot import dump_table
+from ..utils.admission import AdmissionController
 
 
 def format_postcode(postcode):
@@ -36,9 +58,15 @@ def client():
 
     yield client
 
-    # Teardown the database after testing
+    # Teardown the database after testing, once the audit log has finished writing to it
+    audit_log = app.extensions.get("audit")
+    if audit_log is not None:
+        audit_log.flush(timeout=5)
     with app.app_context():
         db.drop_all()
+    # The clinicians' and departments' IDs went with their tables
+    clinician_names.clear()
+    department_names.clear()
 
 
 def test_add_appointment(client):
@@ -280,3 +308,841 @@ def test_delete_appointment(client):
             response = client.delete(f"/appointments/{appointment.id}/")
             assert response.status_code == 200
             assert response.get_json()["message"] == "Appointment deleted successfully"
+
+
+def test_update_appointment_if_match(client):
+    example_appointment = {
+        "patient": "1953262716",
+        "status": "active",
+        "time": "2025-06-04T16:30:00+01:00",
+        "duration": "1h",
+        "clinician": "Bethany Rice-Hammond",
+        "department": "oncology",
+        "postcode": "IM2N 4LG",
+        "id": "01542f70-929f-4c9a-b4fa-e672310d7e78",
+    }
+
+    with app.app_context():
+        appointment = Appointment(**example_appointment)
+        db.session.add(appointment)
+        db.session.commit()
+
+        response = client.get(f"/appointments/{appointment.id}/")
+        etag = response.headers["ETag"]
+
+        # Updating the version we saw succeeds, and bumps the version
+        response = client.put(
+            f"/appointments/{appointment.id}/",
+            json={"clinician": "Jason Holloway"},
+            headers={"If-Match": etag},
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+        # Updating from the stale version is refused, and nothing changes
+        response = client.put(
+            f"/appointments/{appointment.id}/",
+            json={"status": "cancelled"},
+            headers={"If-Match": etag},
+        )
+        assert response.status_code == 412
+
+        appointment = db.session.get(Appointment, appointment.id, populate_existing=True)
+        assert appointment.clinician == "Jason Holloway"
+        assert appointment.status != "cancelled"
+
+        response = client.delete(
+            f"/appointments/{appointment.id}/", headers={"If-Match": etag}
+        )
+        assert response.status_code == 412
+
+
+def test_update_appointment_statuses(client):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)
+
+    with app.app_context():
+        for example_appointment in example_appointments:
+            db.session.add(Appointment(**example_appointment))
+        db.session.commit()
+
+        active = [a for a in example_appointments if a["status"] == "active"]
+        cancelled = [a for a in example_appointments if a["status"] == "cancelled"]
+
+        response = client.post(
+            "/appointments/status-batch",
+            json={
+                "updates": [
+                    {"id": active[0]["id"], "status": "attended"},
+                    [active[1]["id"], "cancelled"],
+                    {"id": cancelled[0]["id"], "status": "active"},
+                    {"id": active[2]["id"], "status": "Bad Status"},
+                    {"id": "non_existent_id", "status": "attended"},
+                    {"id": active[3]["id"], "status": "attended", "version": 99},
+                    {"status": "attended"},
+                ]
+            },
+        )
+        assert response.status_code == 200
+
+        results = response.get_json()["results"]
+        assert [result["code"] for result in results] == [200, 200, 400, 400, 404, 412, 400]
+        assert results[0]["status"] == "attended"
+        assert results[1]["status"] == "cancelled"
+
+        # Only the valid changes were written
+        assert db.session.get(Appointment, active[0]["id"]).status == "attended"
+        assert db.session.get(Appointment, active[1]["id"]).status == "cancelled"
+        assert db.session.get(Appointment, cancelled[0]["id"]).status == "cancelled"
+        assert db.session.get(Appointment, active[3]["id"]).status != "attended"
+
+        response = client.post("/appointments/status-batch", json={"updates": []})
+        assert response.status_code == 400
+        response = client.post(
+            "/appointments/status-batch", json={"updates": [["missing", "attended"]] * 1001}
+        )
+        assert response.status_code == 400
+
+        # Versions are numbers, not anything that looks like one
+        version = db.session.get(Appointment, active[3]["id"]).version
+        response = client.post(
+            "/appointments/status-batch",
+            json={"updates": [{"id": active[3]["id"], "status": "attended", "version": str(version)}]},
+        )
+        assert [result["code"] for result in response.get_json()["results"]] == [400]
+        assert response.get_json()["results"][0]["message"] == "Invalid version"
+
+        # Two cancelled appointments brought back in one batch can't both take the same slot
+        for id in ["reinstated-1", "reinstated-2"]:
+            db.session.add(
+                Appointment(
+                    id=id,
+                    patient="1953262716",
+                    status="cancelled",
+                    time=datetime(2030, 6, 4, 9, tzinfo=timezone.utc),
+                    duration="1h",
+                    clinician="Dr Double",
+                    department="oncology",
+                    postcode="N6 2FA",
+                )
+            )
+        db.session.commit()
+        response = client.post(
+            "/appointments/status-batch",
+            json={"updates": [["reinstated-1", "attended"], ["reinstated-2", "attended"]]},
+        )
+        assert response.status_code == 200
+        assert [result["code"] for result in response.get_json()["results"]] == [200, 409]
+        db.session.expire_all()
+        assert db.session.get(Appointment, "reinstated-2").status == "cancelled"
+
+        # IDs and statuses that aren't strings are refused item by item
+        response = client.post(
+            "/appointments/status-batch",
+            json={"updates": [{"id": ["x"], "status": "attended"}, {"id": active[3]["id"], "status": 1}, [{}, "attended"]]},
+        )
+        assert response.status_code == 200
+        assert [result["code"] for result in response.get_json()["results"]] == [400, 400, 400]
+
+
+def test_double_booking(client):
+    example_appointment = {
+        "patient": "1953262716",
+        "status": "active",
+        "time": "2025-06-04T16:30:00+01:00",
+        "duration": "1h",
+        "clinician": "Bethany Rice-Hammond",
+        "department": "oncology",
+        "postcode": "IM2N 4LG",
+        "id": "01542f70-929f-4c9a-b4fa-e672310d7e78",
+    }
+
+    with app.app_context():
+        response = client.post("/appointments/", json=example_appointment)
+        assert response.status_code == 201
+
+        # Starting half way through the first appointment
+        overlapping = dict(example_appointment, id="overlapping", time="2025-06-04T17:00:00+01:00")
+        response = client.post("/appointments/", json=overlapping)
+        assert response.status_code == 409
+        assert response.get_json()["conflict"] == example_appointment["id"]
+        assert db.session.get(Appointment, "overlapping") is None
+
+        # Starting as the first appointment finishes is fine, as is a different clinician
+        back_to_back = dict(example_appointment, id="back-to-back", time="2025-06-04T17:30:00+01:00")
+        response = client.post("/appointments/", json=back_to_back)
+        assert response.status_code == 201
+        other_clinician = dict(overlapping, clinician="Jason Holloway")
+        response = client.post("/appointments/", json=other_clinician)
+        assert response.status_code == 201
+
+        # Moving or lengthening an appointment into another is refused
+        response = client.put("/appointments/back-to-back/", json={"duration": "1h", "time": "2025-06-04T17:00:00+01:00"})
+        assert response.status_code == 409
+        appointment = db.session.get(Appointment, "back-to-back")
+        assert appointment.time == datetime.fromisoformat(back_to_back["time"])
+
+        # Once the first appointment is cancelled, its slot is free again
+        response = client.put(f"/appointments/{example_appointment['id']}/", json={"status": "cancelled"})
+        assert response.status_code == 200
+        response = client.put("/appointments/back-to-back/", json={"time": "2025-06-04T17:00:00+01:00"})
+        assert response.status_code == 200
+
+
+def test_clinician_availability(client):
+    example_appointment = {
+        "patient": "1953262716",
+        "status": "active",
+        "time": "2030-06-04T09:00:00+00:00",
+        "duration": "1h",
+        "clinician": "Bethany Rice-Hammond",
+        "department": "oncology",
+        "postcode": "IM2N 4LG",
+        "id": "01542f70-929f-4c9a-b4fa-e672310d7e78",
+    }
+    window = {"from": "2030-06-04T08:00:00+00:00", "to": "2030-06-04T12:00:00+00:00", "length": "30m"}
+
+    with app.app_context():
+        availability_cache.clear()
+
+        response = client.post("/appointments/", json=example_appointment)
+        assert response.status_code == 201
+
+        response = client.get("/clinicians/Bethany Rice-Hammond/availability", query_string=window)
+        assert response.status_code == 200
+        assert response.get_json()["free"] == [
+            {"start": "2030-06-04T08:00:00+00:00", "end": "2030-06-04T09:00:00+00:00"},
+            {"start": "2030-06-04T10:00:00+00:00", "end": "2030-06-04T12:00:00+00:00"},
+        ]
+
+        # Booking the clinician again invalidates the cached day
+        response = client.post(
+            "/appointments/",
+            json=dict(example_appointment, id="second", time="2030-06-04T10:15:00+00:00", duration="1h30m"),
+        )
+        assert response.status_code == 201
+
+        response = client.get("/departments/oncology/availability", query_string=window)
+        assert response.status_code == 200
+        assert response.get_json()["clinicians"]["Bethany Rice-Hammond"] == [
+            {"start": "2030-06-04T08:00:00+00:00", "end": "2030-06-04T09:00:00+00:00"},
+        ]
+
+        response = client.get("/departments/cardiology/availability", query_string=window)
+        assert response.status_code == 404
+
+        response = client.get(
+            "/clinicians/Bethany Rice-Hammond/availability",
+            query_string=dict(window, to="2030-06-01T00:00:00+00:00"),
+        )
+        assert response.status_code == 400
+
+
+def test_clinicians_and_departments(client):
+    example_appointment = {
+        "patient": "1953262716",
+        "status": "active",
+        "time": "2030-06-04T09:00:00+00:00",
+        "duration": "1h",
+        "clinician": "Bethany Rice-Hammond",
+        "department": "oncology",
+        "postcode": "IM2N 4LG",
+        "id": "01542f70-929f-4c9a-b4fa-e672310d7e78",
+    }
+
+    with app.app_context():
+        response = client.post("/appointments/", json=example_appointment)
+        assert response.status_code == 201
+        response = client.post(
+            "/appointments/", json=dict(example_appointment, id="second", time="2030-06-04T10:00:00+00:00")
+        )
+        assert response.status_code == 201
+        response = client.post("/appointments/", json=dict(example_appointment, id="third", clinician="Jason Holloway"))
+        assert response.status_code == 201
+
+        # Each name is only stored once, and appointments still give them back as names
+        assert db.session.scalar(db.select(db.func.count()).select_from(Clinician)) == 2
+        assert db.session.scalar(db.select(db.func.count()).select_from(Department)) == 1
+        response = client.get("/appointments/third/")
+        assert response.get_json()["clinician"] == "Jason Holloway"
+        assert response.get_json()["department"] == "oncology"
+
+        response = client.put("/appointments/third/", json={"clinician": "Aisha Khan", "department": "cardiology"})
+        assert response.status_code == 200
+        response = client.get("/appointments/third/")
+        assert response.get_json()["clinician"] == "Aisha Khan"
+        assert response.get_json()["department"] == "cardiology"
+        assert clinician_names.cached_id("Aisha Khan") is not None
+
+        response = client.get("/export/appointments", query_string={"department": "oncology"})
+        assert sorted(json.loads(line)["id"] for line in response.data.decode().splitlines()) == [
+            example_appointment["id"],
+            "second",
+        ]
+        response = client.get("/export/appointments", query_string={"department": "dermatology"})
+        assert response.data == b""
+
+        # A name added by a transaction that rolls back isn't kept, or cached
+        appointment = db.session.get(Appointment, "second")
+        appointment.clinician = "Locum"
+        db.session.flush()
+        assert appointment.clinician_id is not None
+        assert clinician_names.cached_id("Locum") is None
+        db.session.rollback()
+        assert clinician_names.cached_id("Locum") is None
+        assert client.get("/appointments/second/").get_json()["clinician"] == "Bethany Rice-Hammond"
+        assert db.session.scalar(db.select(db.func.count()).select_from(Clinician)) == 3
+
+
+def test_stream_events(client, monkeypatch):
+    example_appointment = {
+        "patient": "1953262716",
+        "status": "active",
+        "time": "2030-06-04T09:00:00+00:00",
+        "duration": "1h",
+        "clinician": "Bethany Rice-Hammond",
+        "department": "oncology",
+        "postcode": "IM2N 4LG",
+        "id": "01542f70-929f-4c9a-b4fa-e672310d7e78",
+    }
+
+    def next_event(stream):
+        chunk = next(stream).decode()
+        while chunk.startswith(("retry:", ":")):
+            chunk = next(stream).decode()
+        event_type, data = chunk.strip().split("\n")
+        return event_type.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    with app.app_context():
+        response = client.get("/events", query_string={"department": "oncology"})
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        stream = iter(response.response)
+
+        client.post("/appointments/", json=example_appointment)
+        # Changes in other departments are filtered out
+        client.post(
+            "/appointments/",
+            json=dict(example_appointment, id="other", department="cardiology"),
+        )
+        client.put(f"/appointments/{example_appointment['id']}/", json={"status": "attended"})
+        client.delete(f"/appointments/{example_appointment['id']}/")
+
+        event_type, data = next_event(stream)
+        assert event_type == "created"
+        assert data["id"] == example_appointment["id"]
+        assert data["status"] == "active"
+
+        event_type, data = next_event(stream)
+        assert event_type == "updated"
+        assert data["status"] == "attended"
+
+        event_type, data = next_event(stream)
+        assert event_type == "deleted"
+        assert data["id"] == example_appointment["id"]
+
+        # Each worker only serves so many streams, and a closed stream makes room for another
+        monkeypatch.setattr(event_streams, "limit", 1)
+        refused = client.get("/events")
+        assert refused.status_code == 503
+        assert refused.headers["Retry-After"]
+        response.close()
+        response = client.get("/events")
+        assert response.status_code == 200
+        response.close()
+        assert event_streams.active == 0
+
+
+def test_sync(client):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)[:10]
+
+    with app.app_context():
+        # Don't hold back recent changes, as everything in this test is recent
+        app.config["SYNC_SETTLE_TIME"] = 0
+
+        for example_appointment in example_appointments:
+            client.post("/appointments/", json=example_appointment)
+
+        # From scratch, in pages
+        synced = {}
+        cursor = None
+        while True:
+            query = {"limit": 3, **({"since": cursor} if cursor else {})}
+            response = client.get("/sync", query_string=query)
+            assert response.status_code == 200
+            body = response.get_json()
+            assert len(body["appointments"]) <= 3
+            synced.update({appointment["id"]: appointment for appointment in body["appointments"]})
+            cursor = body["cursor"]
+            if not body["more"]:
+                break
+        assert set(synced) == {a["id"] for a in example_appointments}
+
+        # Nothing has changed since
+        response = client.get("/sync", query_string={"since": cursor})
+        body = response.get_json()
+        assert body["appointments"] == []
+        assert body["more"] is False
+
+        # Only the changes are sent
+        updated, deleted = example_appointments[0]["id"], example_appointments[1]["id"]
+        client.put(f"/appointments/{updated}/", json={"clinician": "Somebody Else"})
+        client.delete(f"/appointments/{deleted}/")
+        response = client.get("/sync", query_string={"since": cursor})
+        body = response.get_json()
+        assert [appointment["id"] for appointment in body["appointments"]] == [updated]
+        assert body["appointments"][0]["clinician"] == "Somebody Else"
+        assert body["deleted"]["appointments"] == [deleted]
+
+        response = client.get("/sync", query_string={"since": "not a cursor"})
+        assert response.status_code == 400
+
+        app.config["SYNC_SETTLE_TIME"] = 5
+
+
+def test_archive_appointments(client, tmp_path):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)
+
+    app.config["ARCHIVE_DIRECTORY"] = str(tmp_path)
+    try:
+        with app.app_context():
+            for example_appointment in example_appointments:
+                client.post("/appointments/", json=example_appointment)
+
+            old = [a for a in example_appointments if a["time"] < "2019-01-01"]
+            kept = db.session.scalar(db.select(db.func.count()).select_from(Appointment)) - len(old)
+
+            result = app.test_cli_runner().invoke(
+                args=["archive-appointments", "--before", "2019-01-01", "--chunk-size", "3"]
+            )
+            assert result.exit_code == 0, result.output
+
+            assert db.session.scalar(db.select(db.func.count()).select_from(Appointment)) == kept
+            assert db.session.scalar(db.select(db.func.count()).select_from(ArchivedAppointment)) == len(old)
+            assert client.get("/stats/summary").get_json()["appointments"]["total"] == kept
+            assert sorted(p.name for p in tmp_path.iterdir())[0] == "appointments-2018-01.ndjson.gz"
+
+            # Archived appointments can still be read, but not changed
+            for example_appointment in old:
+                response = client.get(f"/appointments/{example_appointment['id']}/")
+                assert response.status_code == 200
+                body = response.get_json()
+                assert body["archived"]
+                assert body["clinician"] == example_appointment["clinician"]
+                assert body["status"] != "active"
+
+            response = client.put(f"/appointments/{old[0]['id']}/", json={"status": "cancelled"})
+            assert response.status_code == 409
+            response = client.delete(f"/appointments/{old[0]['id']}/")
+            assert response.status_code == 409
+            response = client.post("/appointments/", json=old[0])
+            assert response.status_code == 409
+    finally:
+        app.config["ARCHIVE_DIRECTORY"] = "archive"
+
+
+def test_export(client):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)[:20]
+
+    with app.app_context():
+        for example_appointment in example_appointments:
+            client.post("/appointments/", json=example_appointment)
+
+        response = client.get("/export/appointments")
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        exported = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert {a["id"] for a in exported} == {a["id"] for a in example_appointments}
+        # Everything in the example data has passed
+        assert "active" not in {a["status"] for a in exported}
+
+        department = example_appointments[0]["department"]
+        query = {"department": department, "from": "2018-01-01", "to": "2020-01-01", "format": "csv", "gzip": "true"}
+        response = client.get("/export/appointments", query_string=query)
+        assert response.status_code == 200
+        assert response.mimetype == "application/gzip"
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.get_data()).decode())))
+        expected = {
+            a["id"]
+            for a in example_appointments
+            if a["department"] == department and datetime(2018, 1, 1, tzinfo=timezone.utc) <= datetime.fromisoformat(a["time"]) < datetime(2020, 1, 1, tzinfo=timezone.utc)
+        }
+        assert expected
+        assert {row["id"] for row in rows} == expected
+
+        with open("tests/example-patients.json", "r") as f:
+            example_patients = json.load(f)
+        for example_patient in example_patients:
+            client.post("/patients/", json=example_patient)
+
+        response = client.get("/export/patients", query_string={"department": department})
+        assert response.status_code == 200
+        exported = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        expected = {a["patient"] for a in example_appointments if a["department"] == department}
+        assert expected
+        assert {p["nhs_number"] for p in exported} == expected & {p["nhs_number"] for p in example_patients}
+
+        response = client.get("/export/appointments", query_string={"format": "xml"})
+        assert response.status_code == 400
+        response = client.get("/export/appointments", query_string={"from": "yesterday"})
+        assert response.status_code == 400
+
+
+def test_data_migration(client):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)[:20]
+
+    with app.app_context():
+        for example_appointment in example_appointments:
+            client.post("/appointments/", json=example_appointment)
+
+        # Unformat some postcodes behind the app's back
+        unformatted = [a["id"] for a in example_appointments[::3]]
+        db.session.execute(
+            db.update(Appointment)
+            .where(Appointment.id.in_(unformatted))
+            .values(postcode=db.func.replace(Appointment.postcode, " ", ""))
+        )
+        db.session.commit()
+
+        # Interrupted after a couple of chunks
+        migration = DATA_MIGRATIONS["format-appointment-postcodes"]
+        checkpoint = run_data_migration(
+            db.session, migration, DataMigrationCheckpoint, chunk_size=3, pause=0, max_chunks=2
+        )
+        assert checkpoint.records == 6
+        assert checkpoint.finished_at is None
+
+        # And resumed from the checkpoint
+        result = app.test_cli_runner().invoke(
+            args=["data-migrate", "format-appointment-postcodes", "--chunk-size", "3", "--pause", "0"]
+        )
+        assert result.exit_code == 0, result.output
+
+        checkpoint = db.session.get(DataMigrationCheckpoint, migration.name, populate_existing=True)
+        assert checkpoint.finished_at is not None
+        assert checkpoint.records == len(example_appointments)
+        assert checkpoint.changed == len(unformatted)
+        for example_appointment in example_appointments:
+            appointment = db.session.get(Appointment, example_appointment["id"], populate_existing=True)
+            assert appointment.postcode == format_postcode(example_appointment["postcode"])
+        assert db.session.get(Appointment, unformatted[0]).version == 2
+
+        result = app.test_cli_runner().invoke(args=["data-migrate"])
+        assert result.exit_code == 0, result.output
+        assert "format-appointment-postcodes" in result.output
+        assert "mark-missed-appointments: Mark active appointments that have passed as missed, rather than waiting for a GET. (not started)" in result.output
+
+
+def test_admission_control(client):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointment = json.load(f)[0]
+
+    # No room for writes at all, but plenty for reads
+    app.extensions["admission"] = AdmissionController({"read": 10, "write": 0}, queue_timeout=0)
+    try:
+        with app.app_context():
+            response = client.post("/appointments/", json=example_appointment)
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+
+            response = client.get(f"/appointments/{example_appointment['id']}/", buffered=True)
+            assert response.status_code == 404
+            assert app.extensions["admission"].limits["read"].active == 0
+    finally:
+        del app.extensions["admission"]
+
+
+def test_admission_behind_proxy(client, monkeypatch):
+    # Every request comes from the proxy, which says who it is for
+    monkeypatch.setattr(app, "wsgi_app", ProxyFix(app.wsgi_app, x_for=1))
+    app.extensions["admission"] = AdmissionController({}, queue_timeout=0, rate=0.01, burst=2)
+    proxy = {"REMOTE_ADDR": "10.0.0.1"}
+    try:
+        with app.app_context():
+            for _ in range(2):
+                response = client.get("/", environ_base=proxy, headers={"X-Forwarded-For": "192.0.2.1"})
+                assert response.status_code == 200
+            response = client.get("/", environ_base=proxy, headers={"X-Forwarded-For": "192.0.2.1"})
+            assert response.status_code == 429
+
+            # A noisy client doesn't use up everyone else's requests
+            response = client.get("/", environ_base=proxy, headers={"X-Forwarded-For": "192.0.2.2"})
+            assert response.status_code == 200
+    finally:
+        del app.extensions["admission"]
+
+
+def test_batch_get_appointments(client, monkeypatch):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)[:10]
+
+    with app.app_context():
+        for example_appointment in example_appointments:
+            client.post("/appointments/", json=example_appointment)
+
+        # Fetched in more than one chunk
+        monkeypatch.setattr(f"{app.import_name}.BATCH_GET_CHUNK_SIZE", 3)
+        ids = [a["id"] for a in example_appointments] + ["not-an-appointment"]
+        response = client.post("/appointments/batch-get", json={"ids": ids})
+        assert response.status_code == 200
+        results = response.get_json()["results"]
+        assert set(results) == set(ids)
+        for example_appointment in example_appointments:
+            result = results[example_appointment["id"]]
+            assert result["code"] == 200
+            assert result["appointment"]["clinician"] == example_appointment["clinician"]
+            # Everything in the example data has passed
+            assert result["appointment"]["status"] != "active"
+        assert results["not-an-appointment"] == {"code": 404, "message": "Appointment not found"}
+
+        response = client.post("/appointments/batch-get", json=["not", "an", "object"])
+        assert response.status_code == 400
+
+
+def test_batch(client):
+    patient = {
+        "nhs_number": "1373645350",
+        "name": "Dr Glenn Clark",
+        "date_of_birth": "1996-02-01",
+        "postcode": "N6 2FA",
+    }
+    appointment = {
+        "patient": "1373645350",
+        "status": "active",
+        "time": "2030-01-01T09:00:00+00:00",
+        "duration": "1h",
+        "clinician": "Bethany Rice",
+        "department": "oncology",
+        "postcode": "N6 2FA",
+    }
+
+    with app.app_context():
+        # Register a patient and book them in, all at once
+        response = client.post(
+            "/batch",
+            json={
+                "operations": [
+                    {"op": "create", "type": "patient", "data": patient},
+                    {"op": "create", "type": "appointment", "data": {**appointment, "id": "first"}},
+                    {
+                        "op": "create",
+                        "type": "appointment",
+                        "data": {**appointment, "id": "second", "time": "2030-01-02T09:00:00+00:00"},
+                    },
+                    {
+                        "op": "update",
+                        "type": "appointment",
+                        "id": "second",
+                        "data": {"status": "cancelled"},
+                        "if_match": "1",
+                    },
+                    {"op": "update", "type": "patient", "id": "1373645350", "data": {"postcode": "n62fa"}},
+                ]
+            },
+        )
+        assert response.status_code == 200, response.get_json()
+        assert [result["code"] for result in response.get_json()["results"]] == [201, 201, 201, 200, 200]
+        assert db.session.get(Patient, "1373645350") is not None
+        assert db.session.get(Appointment, "first").status == "active"
+        assert db.session.get(Appointment, "second").status == "cancelled"
+
+        # If any operation fails, none of them are made. This one double-books the clinician
+        # with an appointment earlier in the batch.
+        response = client.post(
+            "/batch",
+            json={
+                "operations": [
+                    {"op": "create", "type": "patient", "data": {**patient, "nhs_number": "1953262716"}},
+                    {
+                        "op": "create",
+                        "type": "appointment",
+                        "data": {**appointment, "id": "third", "time": "2030-02-01T09:00:00+00:00"},
+                    },
+                    {
+                        "op": "create",
+                        "type": "appointment",
+                        "data": {**appointment, "id": "fourth", "time": "2030-02-01T09:30:00+00:00"},
+                    },
+                    {"op": "delete", "type": "appointment", "id": "first"},
+                ]
+            },
+        )
+        assert response.status_code == 409
+        assert response.get_json()["failed"] == 2
+        assert response.get_json()["results"][-1]["conflict"] == "third"
+        assert db.session.get(Patient, "1953262716") is None
+        assert db.session.get(Appointment, "third") is None
+        assert db.session.get(Appointment, "first") is not None
+
+        # Stale versions, missing records and invalid operations fail the batch too
+        response = client.post(
+            "/batch",
+            json={"operations": [{"op": "delete", "type": "appointment", "id": "first", "if_match": "7"}]},
+        )
+        assert response.status_code == 412
+        response = client.post(
+            "/batch", json={"operations": [{"op": "delete", "type": "patient", "id": "1953262716"}]}
+        )
+        assert response.status_code == 404
+        response = client.post(
+            "/batch", json={"operations": [{"op": "upsert", "type": "patient", "data": patient}]}
+        )
+        assert response.status_code == 400
+        response = client.post("/batch", json={"operations": [{"op": "create", "type": "appointment"}]})
+        assert response.status_code == 400
+        response = client.post("/batch", json={"operations": []})
+        assert response.status_code == 400
+
+        # And they can delete as well
+        response = client.post(
+            "/batch",
+            json={
+                "operations": [
+                    {"op": "delete", "type": "appointment", "id": "first"},
+                    {"op": "delete", "type": "appointment", "id": "second"},
+                    {"op": "delete", "type": "patient", "id": "1373645350"},
+                ]
+            },
+        )
+        assert response.status_code == 200
+        assert db.session.get(Patient, "1373645350") is None
+        assert db.session.get(Appointment, "first") is None
+
+
+def expected_stats():
+    """Count the appointments in the database, as /stats/summary should."""
+    appointments = db.session.scalars(db.select(Appointment)).all()
+    by_status, by_department, by_day = {}, {}, {}
+    for appointment in appointments:
+        day = appointment.time.astimezone(timezone.utc).date().isoformat()
+        by_status[appointment.status] = by_status.get(appointment.status, 0) + 1
+        by_department[appointment.department] = by_department.get(appointment.department, 0) + 1
+        by_day[day] = by_day.get(day, 0) + 1
+
+    return {"total": len(appointments), "by_status": by_status, "by_department": by_department, "by_day": by_day}
+
+
+def test_stats_summary(client):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)
+    with open("tests/example-patients.json", "r") as f:
+        example_patients = json.load(f)
+
+    with app.app_context():
+        response = client.get("/stats/summary")
+        assert response.status_code == 200
+        assert response.get_json() == {
+            "patients": 0,
+            "appointments": {"total": 0, "by_status": {}, "by_department": {}, "by_day": {}},
+        }
+
+        for example_patient in example_patients:
+            client.post("/patients/", json=example_patient)
+        for example_appointment in example_appointments:
+            client.post("/appointments/", json=example_appointment)
+
+        # The counts keep up with new appointments, status changes, moves, and deletions
+        client.put(f"/appointments/{example_appointments[0]['id']}/", json={"status": "cancelled"})
+        client.put(f"/appointments/{example_appointments[1]['id']}/", json={"time": "2031-01-01T10:00:00+00:00"})
+        client.delete(f"/appointments/{example_appointments[2]['id']}/")
+        client.delete(f"/patients/{example_patients[0]['nhs_number']}/")
+
+        body = client.get("/stats/summary").get_json()
+        assert body["appointments"] == expected_stats()
+        assert body["patients"] == len(example_patients) - 1
+        assert body["appointments"]["by_day"]["2031-01-01"] == 1
+
+        # They can be narrowed down
+        department = example_appointments[0]["department"]
+        body = client.get(f"/stats/summary?department={department}&from=2018-01-01&to=2018-12-31").get_json()
+        assert set(body["appointments"]["by_department"]) == {department}
+        assert all(day.startswith("2018-") for day in body["appointments"]["by_day"])
+        assert client.get("/stats/summary?from=yesterday").status_code == 400
+
+        # If the counts drift, reconciling puts them right
+        db.session.execute(db.update(AppointmentCounter).values(count=AppointmentCounter.count + 5))
+        db.session.execute(db.delete(Appointment).where(Appointment.id == example_appointments[3]["id"]))
+        db.session.commit()
+        assert client.get("/stats/summary").get_json()["appointments"] != expected_stats()
+
+        result = app.test_cli_runner().invoke(args=["reconcile-stats"])
+        assert result.exit_code == 0, result.output
+        body = client.get("/stats/summary").get_json()
+        assert body["appointments"] == expected_stats()
+        assert body["patients"] == len(example_patients) - 1
+
+
+def test_snapshot_restore(client, tmp_path, monkeypatch):
+    with open("tests/example-appointments.json", "r") as f:
+        example_appointments = json.load(f)
+    with open("tests/example-patients.json", "r") as f:
+        example_patients = json.load(f)
+
+    path = str(tmp_path / "panda.snapshot")
+    with app.app_context():
+        for example_patient in example_patients:
+            client.post("/patients/", json=example_patient)
+        for example_appointment in example_appointments:
+            client.post("/appointments/", json=example_appointment)
+
+        before = {
+            appointment["id"]: client.get(f"/appointments/{appointment['id']}/").get_json()
+            for appointment in example_appointments
+        }
+        stats = client.get("/stats/summary").get_json()
+
+        # A patient added while the snapshot is being taken isn't in it, as it was read at one moment
+        added = []
+
+        def dump_table_while_adding(connection, table, chunk_size):
+            if table is Patient.__table__ and not added:
+                added.append(table)
+                with connection.engine.begin() as other:
+                    other.execute(
+                        Patient.__table__.insert().values(
+                            nhs_number="0000000000",
+                            name="Late",
+                            search_key="late",
+                            date_of_birth=datetime(1980, 1, 1).date(),
+                            postcode="N6 2FA",
+                        )
+                    )
+            return dump_table(connection, table, chunk_size)
+
+        monkeypatch.setattr(f"{app.import_name}.dump_table", dump_table_while_adding)
+        result = app.test_cli_runner().invoke(args=["snapshot", path, "--chunk-size", "7"])
+        assert result.exit_code == 0, result.output
+        monkeypatch.undo()
+
+        # Restoring over the existing records has to be asked for
+        result = app.test_cli_runner().invoke(args=["restore", path])
+        assert result.exit_code != 0
+        assert "isn't empty" in result.output
+
+        client.delete(f"/appointments/{example_appointments[0]['id']}/")
+        client.put(f"/appointments/{example_appointments[1]['id']}/", json={"status": "cancelled"})
+        db.session.remove()
+
+        result = app.test_cli_runner().invoke(args=["restore", path, "--replace"])
+        assert result.exit_code == 0, result.output
+
+        for appointment_id, body in before.items():
+            assert client.get(f"/appointments/{appointment_id}/").get_json() == body
+        assert client.get("/stats/summary").get_json() == stats
+        assert client.get("/patients/0000000000/").status_code == 404
+
+        # A snapshot that has been cut short is refused, and nothing is changed
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[: len(data) // 2])
+        client.delete(f"/appointments/{example_appointments[0]['id']}/")
+        db.session.remove()
+
+        result = app.test_cli_runner().invoke(args=["restore", path, "--replace"])
+        assert result.exit_code != 0
+        assert client.get(f"/appointments/{example_appointments[0]['id']}/").status_code == 404
@@ -0,0 +1,17 @@
+from ..utils import archive
+
+
+def test_archive_chunks(tmp_path):
+    path = tmp_path / "appointments-2018-01.ndjson.gz"
+    first = [{"id": str(i), "status": "attended"} for i in range(3)]
+    second = [{"id": str(i), "status": "missed"} for i in range(3, 5)]
+
+    first_offset = archive.append_archive_chunk(path, first)
+    second_offset = archive.append_archive_chunk(path, second)
+    assert first_offset == 0
+    assert second_offset > 0
+
+    assert archive.read_archive_chunk(path, first_offset) == first
+    assert archive.read_archive_chunk(path, second_offset) == second
+    assert archive.read_archived_record(path, second_offset, "4") == second[1]
+    assert archive.read_archived_record(path, second_offset, "0") is None
@@ -0,0 +1,140 @@
+import json
+import threading
+from datetime import datetime, timezone
+
+from ..utils.audit import AuditLog, RotatingFileWriter
+
+
+def test_audit_log_batches():
+    batches = []
+    audit_log = AuditLog(batches.append, batch_size=3, flush_interval=0.2)
+
+    for i in range(7):
+        assert audit_log.record({"key": i})
+    assert audit_log.flush(timeout=5)
+
+    # Events that arrive together are written together, a batch at a time
+    assert [event["key"] for batch in batches for event in batch] == list(range(7))
+    assert all(len(batch) <= 3 for batch in batches)
+    assert len(batches) < 7
+
+    metrics = audit_log.metrics()
+    assert metrics["recorded"] == metrics["written"] == 7
+    assert metrics["dropped"] == 0
+    assert metrics["queued"] == 0
+    assert metrics["last_batch"]["events"] == len(batches[-1])
+
+
+def test_audit_log_backpressure():
+    blocked = threading.Event()
+    written = []
+
+    def write(events):
+        blocked.wait(5)
+        written.extend(events)
+
+    audit_log = AuditLog(write, max_queue=2, batch_size=1, flush_interval=0, put_timeout=0.01)
+
+    # The writer takes the first event and blocks, then the queue fills, and the rest are dropped
+    results = [audit_log.record({"key": i}) for i in range(6)]
+    assert results.count(False) >= 3
+    metrics = audit_log.metrics()
+    assert metrics["dropped"] == results.count(False)
+    assert metrics["waited"] >= metrics["dropped"]
+    assert metrics["high_water"] == 2
+
+    blocked.set()
+    assert audit_log.flush(timeout=5)
+    assert len(written) == results.count(True)
+
+
+def test_audit_log_retries():
+    written = []
+    failures = [Exception("The audit store is down")] * 2
+
+    def write(events):
+        if failures:
+            raise failures.pop()
+        written.extend(events)
+
+    audit_log = AuditLog(write, flush_interval=0, retry_delay=0.01)
+    audit_log.record({"key": 1})
+    assert audit_log.flush(timeout=5)
+
+    assert written == [{"key": 1}]
+    assert audit_log.metrics()["failed_batches"] == 2
+    assert audit_log.metrics()["batches"] == 1
+
+
+def test_audit_log_dead_letter():
+    written = []
+    dead_letters = []
+
+    # Like a column that is too short for one of the events
+    def write(events):
+        if any(len(event["actor"]) > 10 for event in events):
+            raise Exception("value too long")
+        written.extend(events)
+
+    audit_log = AuditLog(
+        write, batch_size=8, flush_interval=0.2, retry_delay=0.01, dead_letter=dead_letters.extend
+    )
+    for i in range(8):
+        audit_log.record({"key": i, "actor": "x" * 20 if i == 5 else "dr.jones"})
+    assert audit_log.flush(timeout=5)
+
+    # The bad event is set aside, and the rest, and anything after it, are still written
+    assert [event["key"] for event in dead_letters] == [5]
+    audit_log.record({"key": 8, "actor": "dr.jones"})
+    assert audit_log.flush(timeout=5)
+    assert sorted(event["key"] for event in written) == [0, 1, 2, 3, 4, 6, 7, 8]
+
+    metrics = audit_log.metrics()
+    assert metrics["written"] == 8
+    assert metrics["dead_lettered"] == 1
+    assert metrics["dropped"] == 0
+
+    # Without anywhere else to put it, it is dropped
+    audit_log = AuditLog(write, flush_interval=0, retry_delay=0.01)
+    audit_log.record({"key": 9, "actor": "x" * 20})
+    assert audit_log.flush(timeout=5)
+    assert audit_log.metrics()["dropped"] == 1
+
+
+def test_audit_log_staging():
+    class Session:
+        info = {}
+
+    written = []
+    audit_log = AuditLog(written.extend, flush_interval=0)
+    session = Session()
+
+    # Changes that are rolled back never happened
+    audit_log.stage(session, {"key": 1})
+    audit_log.rollback(session)
+    audit_log.stage(session, {"key": 2})
+    audit_log.commit(session)
+    assert audit_log.flush(timeout=5)
+    assert written == [{"key": 2}]
+    assert "audit_events" not in session.info
+
+
+def test_rotating_file_writer(tmp_path):
+    path = tmp_path / "audit-{pid}.ndjson"
+    writer = RotatingFileWriter(str(path), max_bytes=200, backups=2)
+    at = datetime(2024, 1, 1, 9, 30, tzinfo=timezone.utc)
+
+    for i in range(10):
+        writer([{"at": at, "key": str(i)}, {"at": at, "key": str(i)}])
+
+    files = sorted(file.name for file in tmp_path.iterdir())
+    assert len(files) == 3
+    assert files[0].startswith("audit-") and files[0].endswith(".ndjson")
+    assert files[1].endswith(".ndjson.1") and files[2].endswith(".ndjson.2")
+
+    # The newest events are in the current file, and older ones past the backups are gone
+    current = tmp_path / files[0]
+    events = [json.loads(line) for line in current.read_text().splitlines()]
+    assert events[-1] == {"at": "2024-01-01T09:30:00+00:00", "key": "9"}
+    assert current.stat().st_size <= 200
+    assert not any(file.name.endswith(".3") for file in tmp_path.iterdir())
@@ -0,0 +1,91 @@
+import pytest
+from datetime import date
+
+from ..utils.duplicates import jaro_winkler, block_key, find_duplicates, read_blocks
+from ..utils.search import normalize_name
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        ("martha", "marhta", 0.961),
+        ("dwayne", "duane", 0.84),
+        ("dixon", "dicksonx", 0.813),
+        ("smith", "smith", 1.0),
+        ("smith", "", 0.0),
+        ("abc", "xyz", 0.0),
+    ],
+)
+def test_jaro_winkler(a, b, expected):
+    assert jaro_winkler(a, b) == pytest.approx(expected, abs=0.001)
+    assert jaro_winkler(b, a) == pytest.approx(expected, abs=0.001)
+
+
+def test_block_key():
+    assert block_key("n62fa", date(1980, 1, 1)) == block_key("N6 2FA", "1980-01-01")
+    assert block_key("N6 2FA", date(1980, 1, 1)) != block_key("N6 2FB", date(1980, 1, 1))
+    assert block_key("not a postcode", date(1980, 1, 1)) == ("NOTAPOSTCODE", "1980-01-01")
+
+
+def patient(nhs_number, name, postcode="N6 2FA", date_of_birth=date(1980, 1, 1)):
+    return (nhs_number, name, normalize_name(name), postcode, date_of_birth)
+
+
+def test_find_duplicates():
+    patients = [
+        patient("1", "Dr Jane Smith"),
+        patient("2", "SMITH, Jane", postcode="n62fa"),
+        patient("3", "Jayne Smyth"),
+        patient("4", "Robert Jones"),
+        # Alike, but not born on the same day or living at the same postcode
+        patient("5", "Jane Smith", date_of_birth=date(1980, 1, 2)),
+        patient("6", "Jane Smith", postcode="N6 2FB"),
+    ]
+    # Lots more people, who are each in their own block, or alike in pairs
+    for i in range(100, 400):
+        patient_date_of_birth = date(1900 + i % 100, 1 + i % 12, 1 + i % 28)
+        patients.append(patient(str(i), f"Patient Number {i}", date_of_birth=patient_date_of_birth))
+        if i % 10 == 0:
+            patients.append(patient(f"{i}b", f"Patient Numbr {i}", date_of_birth=patient_date_of_birth))
+
+    # Ordered by block, as they are read from the database
+    patients.sort(key=lambda patient: (patient[3].replace(" ", "").upper(), patient[4]))
+
+    candidates = find_duplicates(patients, threshold=0.85, processes=1)
+    pairs = [(first[0], second[0]) for _, first, second, _ in candidates]
+    assert pairs[0] == ("1", "2")
+    assert candidates[0][0] == 1.0
+    assert candidates[0][3] == ("N6 2FA", "1980-01-01")
+    assert [pair for pair in pairs if pair[0] in "123"] == [("1", "2"), ("1", "3"), ("2", "3")]
+    assert set(pairs) - {("1", "2"), ("1", "3"), ("2", "3")} == {(str(i), f"{i}b") for i in range(100, 400, 10)}
+    assert [score for score, *_ in candidates] == sorted((score for score, *_ in candidates), reverse=True)
+
+    # Blocks compared in parallel find the same candidates
+    assert find_duplicates(patients, threshold=0.85, processes=2, chunk_size=3) == candidates
+
+
+def test_read_blocks():
+    patients = [
+        patient("1", "Jane Smith", postcode="N6 2FA"),
+        patient("2", "Jane Smyth", postcode="n62fa"),
+        patient("3", "Robert Jones", postcode="N6 2FB"),
+        patient("4", "Robert Jones", postcode="N6 2FC"),
+        patient("5", "Bob Jones", postcode="N6 2FC"),
+        patient("6", "Alice Brown", postcode="N6 2FD"),
+    ]
+    read = []
+
+    def rows():
+        for row in patients:
+            read.append(row[0])
+            yield row
+
+    # Each block is yielded once the next one starts, before the rest of the patients are read
+    blocks = read_blocks(rows())
+    key, block = next(blocks)
+    assert key == ("N6 2FA", "1980-01-01")
+    assert [nhs_number for nhs_number, _, _ in block] == ["1", "2"]
+    assert read == ["1", "2", "3"]
+
+    # Anyone alone in their block is left out
+    assert [key for key, _ in blocks] == [("N6 2FC", "1980-01-01")]
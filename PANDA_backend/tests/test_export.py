@@ -0,0 +1,28 @@
+import gzip
+from ..utils import export
+
+RECORDS = [{"id": str(i), "name": f"Patient, {i}"} for i in range(5)]
+
+
+def test_encode_ndjson():
+    chunks = list(export.encode_ndjson(RECORDS, batch_size=2))
+    assert len(chunks) == 3
+    assert "".join(chunks).splitlines()[1] == '{"id": "1", "name": "Patient, 1"}'
+
+
+def test_encode_csv():
+    chunks = list(export.encode_csv(RECORDS, ["id", "name"], batch_size=2))
+    assert len(chunks) == 3
+    lines = "".join(chunks).splitlines()
+    assert lines[0] == "id,name"
+    assert lines[1] == '0,"Patient, 0"'
+    assert len(lines) == 6
+
+    # An empty export is just the header
+    assert "".join(export.encode_csv([], ["id", "name"])) == "id,name\r\n"
+
+
+def test_gzip_stream():
+    chunks = export.encode_ndjson(RECORDS, batch_size=2)
+    compressed = b"".join(export.gzip_stream(chunks))
+    assert gzip.decompress(compressed).decode() == "".join(export.encode_ndjson(RECORDS))
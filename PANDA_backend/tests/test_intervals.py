@@ -0,0 +1,35 @@
+import pytest
+from ..utils import intervals
+
+
+@pytest.mark.parametrize(
+    "booked, expected",
+    [
+        ([], []),
+        ([(0, 10, "a")], []),
+        ([(0, 10, "a"), (10, 20, "b")], []),  # Back-to-back appointments don't overlap
+        ([(0, 10, "a"), (5, 15, "b")], [("a", "b")]),
+        ([(0, 30, "a"), (5, 10, "b"), (20, 25, "c")], [("a", "b"), ("a", "c")]),
+        ([(0, 10, "a"), (0, 10, "b"), (0, 10, "c")], [("a", "b"), ("a", "c"), ("b", "c")]),
+        ([(0, 10, "a"), (20, 30, "b"), (25, 26, "c"), (40, 50, "d")], [("b", "c")]),
+    ],
+)
+def test_find_overlaps(booked, expected):
+    result = sorted(tuple(sorted(pair)) for pair in intervals.find_overlaps(booked))
+    assert result == expected, f"For intervals: {booked}, expected: {expected} but got: {result}"
+
+
+@pytest.mark.parametrize(
+    "busy, expected",
+    [
+        ([], [(0, 100)]),
+        ([(10, 20)], [(0, 10), (20, 100)]),
+        ([(20, 30), (10, 25)], [(0, 10), (30, 100)]),  # Overlapping, and out of order
+        ([(-10, 5), (95, 110)], [(5, 95)]),  # Hanging off the ends of the window
+        ([(10, 20), (24, 50)], [(0, 10), (50, 100)]),  # The gap between these is too short
+        ([(0, 100)], []),
+    ],
+)
+def test_free_intervals(busy, expected):
+    result = intervals.free_intervals(busy, 0, 100, 5)
+    assert result == expected, f"For busy: {busy}, expected: {expected} but got: {result}"
@@ -3,10 +3,16 @@ from datetime import date
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import os
+import csv
 import json
 
-from ..app import app, db, Patient
+from sqlalchemy import create_engine, event, select, update
+from sqlalchemy.exc import DatabaseError
+
+from ..app import app, db, Patient, AuditEvent, replica_router, clinician_names, department_names
 from ..utils.validators import format_postcode
+from ..utils.postcodes import build_postcode_directory
+from ..utils.profiling import ProfileStore
 
 # Setup Flask's test client
 @pytest.fixture
@@ -21,9 +27,15 @@ def client():
 
     yield client
 
-    # Teardown the database after testing
+    # Teardown the database after testing, once the audit log has finished writing to it
+    audit_log = app.extensions.get("audit")
+    if audit_log is not None:
+        audit_log.flush(timeout=5)
     with app.app_context():
         db.drop_all()
+    # The clinicians' and departments' IDs went with their tables
+    clinician_names.clear()
+    department_names.clear()
 
 
 def test_add_patient(client):
@@ -156,3 +168,311 @@ def test_delete_patient(client):
             response = client.delete(f"/patients/{patient.nhs_number}/")
             assert response.status_code == 200
             assert response.get_json()["message"] == "Patient deleted successfully"
+
+
+def test_update_patient_if_match(client):
+    with open("tests/example-patients.json", "r") as f:
+        example_patient = json.load(f)[0]
+
+    with app.app_context():
+        response = client.post("/patients/", json=example_patient)
+        assert response.status_code == 201
+
+        response = client.get(f'/patients/{example_patient["nhs_number"]}/')
+        etag = response.headers["ETag"]
+        assert response.get_json()["version"] == 1
+
+        response = client.put(
+            f'/patients/{example_patient["nhs_number"]}/',
+            json={"name": "Updated Name"},
+            headers={"If-Match": etag},
+        )
+        assert response.status_code == 200
+
+        # A second client still holding the old version can't overwrite the first update
+        response = client.put(
+            f'/patients/{example_patient["nhs_number"]}/',
+            json={"name": "Stale Name"},
+            headers={"If-Match": etag},
+        )
+        assert response.status_code == 412
+
+        patient = db.session.get(Patient, example_patient["nhs_number"])
+        assert patient.name == "Updated Name"
+        assert patient.version == 2
+
+
+def test_search_patients(client):
+    with open("tests/example-patients.json", "r") as f:
+        example_patients = json.load(f)
+
+    with app.app_context():
+        for example_patient in example_patients:
+            client.post("/patients/", json=example_patient)
+        client.post(
+            "/patients/",
+            json={"nhs_number": "0123456789", "name": "Zoë O'Brien", "date_of_birth": "1990-01-01", "postcode": "N6 2FA"},
+        )
+
+        def search(q):
+            response = client.get("/patients/search", query_string={"q": q})
+            assert response.status_code == 200
+            return [patient["name"] for patient in response.get_json()["patients"]]
+
+        assert search("जगन्नाथ महावीर") == ["महावीर, जगन्नाथ"]
+        assert search("GLENN clark") == ["Dr Glenn Clark"]
+        assert search("zoe o'brien") == ["Zoë O'Brien"]
+        assert search("桂荣") == ["刘桂荣"]
+        assert search("nobody by this name") == []
+
+        response = client.get("/patients/search", query_string={"q": " ,, "})
+        assert response.status_code == 400
+
+
+def test_unknown_postcode(client, tmp_path):
+    with open("tests/example-patients.json", "r") as f:
+        example_patient = json.load(f)[0]
+
+    directory = tmp_path / "postcodes.bin"
+    build_postcode_directory(["N6 2FA"], directory)
+    app.config["POSTCODE_DIRECTORY"] = str(directory)
+    try:
+        with app.app_context():
+            response = client.post("/patients/", json={**example_patient, "postcode": "SSS6 6HU"})
+            assert response.status_code == 400
+            assert response.get_json()["message"] == "Unknown postcode"
+
+            response = client.post("/patients/", json=example_patient)
+            assert response.status_code == 201
+
+            response = client.put(
+                f"/patients/{example_patient['nhs_number']}/", json={"postcode": "SSS6 6HU"}
+            )
+            assert response.status_code == 400
+            assert response.get_json()["message"] == "Unknown postcode"
+    finally:
+        app.config["POSTCODE_DIRECTORY"] = None
+
+
+def test_replica_reads(client):
+    with open("tests/example-patients.json", "r") as f:
+        example_patient = json.load(f)[0]
+
+    # A second engine on the same database stands in for a replica
+    replica = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    statements = []
+    event.listen(replica, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    other = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    replica_router.add("test", replica)
+    try:
+        response = client.post("/patients/", json=example_patient)
+        assert response.status_code == 201
+        assert statements == []
+
+        # Reads go to the replica
+        response = client.get(f"/patients/{example_patient['nhs_number']}/")
+        assert response.status_code == 200
+        assert statements
+
+        # Unless the request has already written something
+        statements.clear()
+        with app.app_context():
+            response = client.put(
+                f"/patients/{example_patient['nhs_number']}/", json={"name": "Dr Glenn Clarke"}
+            )
+            assert response.status_code == 200
+
+            response = client.get(f"/patients/{example_patient['nhs_number']}/")
+            assert response.get_json()["name"] == "Dr Glenn Clarke"
+        assert statements == []
+
+        # All of a request's reads go to one replica, even with several to choose from
+        other_statements = []
+        event.listen(other, "before_cursor_execute", lambda *args: other_statements.append(args[2]))
+        replica_router.add("other", other)
+        with app.app_context():
+            for _ in range(3):
+                statements.clear()
+                other_statements.clear()
+                # Looks for the appointment, then for it in the archive
+                response = client.get("/appointments/missing/")
+                assert response.status_code == 404
+                assert len(statements + other_statements) >= 2
+                assert not (statements and other_statements)
+    finally:
+        replica_router.remove("test")
+        replica_router.remove("other")
+        replica.dispose()
+        other.dispose()
+
+
+def test_batch_get_patients(client):
+    with open("tests/example-patients.json", "r") as f:
+        example_patients = json.load(f)
+
+    with app.app_context():
+        for example_patient in example_patients:
+            client.post("/patients/", json=example_patient)
+
+        ids = [p["nhs_number"] for p in example_patients[:5]] + ["0123456789"]
+        response = client.post("/patients/batch-get", json={"ids": ids + ids[:2]})
+        assert response.status_code == 200
+        results = response.get_json()["results"]
+        assert set(results) == set(ids)
+        for example_patient in example_patients[:5]:
+            result = results[example_patient["nhs_number"]]
+            assert result["code"] == 200
+            assert result["patient"]["name"] == example_patient["name"]
+        assert results["0123456789"] == {"code": 404, "message": "Patient not found"}
+
+        response = client.post("/patients/batch-get", json={"ids": "1373645350"})
+        assert response.status_code == 400
+        response = client.post("/patients/batch-get", json={"ids": ["0123456789"] * 1001})
+        assert response.status_code == 400
+
+
+def test_profiling(client, tmp_path):
+    with open("tests/example-patients.json", "r") as f:
+        example_patients = json.load(f)
+
+    app.extensions["profiles"] = ProfileStore(str(tmp_path), keep=2)
+    app.config["PROFILE_TOKEN"] = "secret"
+    try:
+        with app.app_context():
+            client.post("/patients/", json=example_patients[0])
+
+            # Only requests with the token are profiled
+            nhs_number = example_patients[0]["nhs_number"]
+            response = client.get(f"/patients/{nhs_number}/")
+            assert "X-Profile-Id" not in response.headers
+            response = client.get(f"/patients/{nhs_number}/", headers={"X-Profile-Token": "wrong"})
+            assert "X-Profile-Id" not in response.headers
+            response = client.get(f"/patients/{nhs_number}/", headers={"X-Profile-Token": "secret"})
+            assert response.status_code == 200
+            profile_id = response.headers["X-Profile-Id"]
+
+            response = client.get("/admin/profiles", headers={"X-Profile-Token": "wrong"})
+            assert response.status_code == 403
+            response = client.get("/admin/profiles", headers={"X-Profile-Token": "secret"})
+            assert response.status_code == 200
+            (profile,) = response.get_json()["profiles"]
+            assert profile["id"] == profile_id
+            assert profile["endpoint"] == "get_patient"
+            assert profile["trigger"] == "header"
+
+            # The profile covers the whole handler, down to the queries and the serialization
+            response = client.get(f"/admin/profiles/{profile_id}", headers={"X-Profile-Token": "secret"})
+            assert response.status_code == 200
+            folded = response.get_data(as_text=True)
+            stacks = [line.rsplit(" ", 1)[0] for line in folded.splitlines()]
+            assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in folded.splitlines())
+            assert any("get_patient (app.py" in stack and "serialize" in stack for stack in stacks)
+            assert any("get_patient (app.py" in stack and "execute" in stack for stack in stacks)
+
+            response = client.get("/admin/profiles/../secrets", headers={"X-Profile-Token": "secret"})
+            assert response.status_code == 404
+
+            # Only the most recent are kept
+            for _ in range(3):
+                client.get(f"/patients/{nhs_number}/", headers={"X-Profile-Token": "secret"})
+            response = client.get("/admin/profiles", headers={"X-Profile-Token": "secret"})
+            assert len(response.get_json()["profiles"]) == 2
+            assert profile_id not in {profile["id"] for profile in response.get_json()["profiles"]}
+            assert len(list(tmp_path.iterdir())) == 4
+    finally:
+        del app.extensions["profiles"]
+        app.config["PROFILE_TOKEN"] = None
+
+
+def test_find_duplicate_patients(client, tmp_path):
+    with open("tests/example-patients.json", "r") as f:
+        example_patients = json.load(f)
+
+    with app.app_context():
+        for example_patient in example_patients:
+            client.post("/patients/", json=example_patient)
+
+        # The same person again, registered with a typo and an unformatted postcode
+        original = example_patients[0]
+        db.session.add(
+            Patient(
+                nhs_number="0000000000",
+                name=original["name"].upper() + "E",
+                date_of_birth=date.fromisoformat(original["date_of_birth"]),
+                postcode=original["postcode"].replace(" ", "").lower(),
+            )
+        )
+        db.session.commit()
+
+        output = tmp_path / "duplicates.csv"
+        result = app.test_cli_runner().invoke(
+            args=["find-duplicate-patients", str(output), "--processes", "1"]
+        )
+        assert result.exit_code == 0, result.output
+
+        with open(output, "r") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 1
+        assert {rows[0]["nhs_number"], rows[0]["duplicate_nhs_number"]} == {original["nhs_number"], "0000000000"}
+        assert rows[0]["rank"] == "1"
+        assert float(rows[0]["score"]) > 0.9
+        assert rows[0]["postcode"] == original["postcode"]
+
+        result = app.test_cli_runner().invoke(args=["find-duplicate-patients", "--threshold", "2"])
+        assert result.exit_code != 0
+
+
+def test_audit_log(client):
+    with open("tests/example-patients.json", "r") as f:
+        example_patient = json.load(f)[0]
+    nhs_number = example_patient["nhs_number"]
+    headers = {"X-User": "dr.jones"}
+
+    with app.app_context():
+        client.post("/patients/", json=example_patient, headers=headers)
+        client.get(f"/patients/{nhs_number}/", headers=headers)
+        client.put(f"/patients/{nhs_number}/", json={"name": "Jane Doe"}, headers=headers)
+        client.post("/patients/batch-get", json={"ids": [nhs_number, "0123456789"]})
+        # A failed change isn't recorded
+        client.put(f"/patients/{nhs_number}/", json={"postcode": "not a postcode"}, headers=headers)
+        client.delete(f"/patients/{nhs_number}/", headers=headers)
+        client.get(f"/patients/{nhs_number}/", headers=headers)
+
+        assert app.extensions["audit"].flush(timeout=5)
+        events = db.session.execute(select(AuditEvent).order_by(AuditEvent.id)).scalars().all()
+        assert [(event.action, event.endpoint, event.actor) for event in events] == [
+            ("create", "add_patient", "dr.jones"),
+            ("read", "get_patient", "dr.jones"),
+            ("update", "update_patient", "dr.jones"),
+            ("read", "batch_get_patients", None),
+            ("delete", "delete_patient", "dr.jones"),
+        ]
+        assert all(event.kind == "patient" and event.key == nhs_number for event in events)
+
+        # However long a client's header, its events still fit
+        client.post("/patients/", json=example_patient, headers={"X-User": "x" * 1000})
+        client.get("/export/patients", query_string={"format": "csv"}, headers=headers)
+        client.get("/sync", headers=headers)
+        assert app.extensions["audit"].flush(timeout=5)
+        query = select(AuditEvent).where(AuditEvent.id > events[-1].id).order_by(AuditEvent.id)
+        events = db.session.execute(query).scalars().all()
+        assert [(event.action, event.kind, event.key, event.endpoint) for event in events] == [
+            ("create", "patient", nhs_number, "add_patient"),
+            ("read", "patient", "*", "export_patients"),
+            ("read", "patient", "*", "sync"),
+        ]
+        assert events[0].actor == "x" * 255
+        assert events[1].filters == "format=csv"
+
+        # Nobody can rewrite what happened
+        with pytest.raises(DatabaseError):
+            db.session.execute(update(AuditEvent).values(actor="someone.else"))
+        db.session.rollback()
+
+        response = client.get("/admin/audit")
+        assert response.status_code == 200
+        metrics = response.get_json()
+        assert metrics["written"] >= len(events)
+        assert metrics["dropped"] == 0
+        assert metrics["dead_lettered"] == 0
+        assert metrics["queued"] == 0
@@ -0,0 +1,54 @@
+import pytest
+from ..utils import postcodes
+
+
+@pytest.fixture
+def directory(tmp_path):
+    source = tmp_path / "postcodes.csv"
+    source.write_text(
+        "pcd,pcds,dointr\n"
+        "AB1 0AA,AB1 0AA,198001\n"
+        "N6  2FA,N6 2FA,198001\n"
+        "SW1A2AA,SW1A 2AA,198001\n"
+        "W1A 1AA,w1a1aa,198001\n"
+        "INVALID,not a postcode,198001\n"
+    )
+    path = tmp_path / "postcodes.bin"
+    count = postcodes.build_postcode_directory(postcodes.read_postcode_list(source), path)
+    assert count == 4
+
+    directory = postcodes.PostcodeDirectory(path)
+    yield directory
+    directory.close()
+
+
+@pytest.mark.parametrize(
+    "postcode, expected",
+    [
+        ("AB1 0AA", True),
+        ("N6 2FA", True),
+        ("SW1A 2AA", True),
+        ("W1A 1AA", True),
+        ("SSS6 6HU", False),  # Well-formed, but doesn't exist
+        ("N6 2FB", False),
+        ("AA0 0AA", False),  # Before the first postcode
+        ("ZE3 9ZZ", False),  # After the last postcode
+        ("", False),
+        ("SW1A 2AAX", False),
+    ],
+)
+def test_postcode_directory(directory, postcode, expected):
+    assert (postcode in directory) == expected, f"For postcode: {postcode}, expected: {expected}"
+
+
+def test_read_postcode_list_without_header(tmp_path):
+    source = tmp_path / "postcodes.txt"
+    source.write_text("AB1 0AA\nN6 2FA\n")
+    assert list(postcodes.read_postcode_list(source)) == ["AB1 0AA", "N6 2FA"]
+
+
+def test_postcode_directory_rejects_other_files(tmp_path):
+    path = tmp_path / "postcodes.bin"
+    path.write_bytes(b"pcd,pcds,dointr\n")
+    with pytest.raises(ValueError):
+        postcodes.PostcodeDirectory(path)
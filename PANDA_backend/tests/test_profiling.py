@@ -0,0 +1,30 @@
+from itertools import count
+
+from ..utils.profiling import CallProfiler
+
+
+def inner():
+    return 1
+
+
+def outer():
+    return inner() + inner()
+
+
+def test_call_profiler():
+    # Every profiling event ticks the clock by a second
+    ticks = count()
+    profiler = CallProfiler(clock=lambda: next(ticks))
+    profiler.start()
+    outer()
+    profiler.stop()
+
+    stacks = {}
+    for line in profiler.folded().splitlines():
+        stack, microseconds = line.rsplit(" ", 1)
+        # Just the function names, without where they are
+        stacks[";".join(label.split(" ")[0] for label in stack.split(";"))] = int(microseconds)
+
+    # outer spends a tick between each of its calls and returning, and each inner call a tick
+    assert stacks["outer;inner"] == 2_000_000
+    assert stacks["outer"] == 3_000_000
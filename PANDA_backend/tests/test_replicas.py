@@ -0,0 +1,40 @@
+from sqlalchemy import create_engine
+from ..utils.replicas import ReplicaRouter
+
+
+def test_replica_router(tmp_path):
+    first = create_engine(f"sqlite:///{tmp_path / 'first.db'}")
+    second = create_engine(f"sqlite:///{tmp_path / 'second.db'}")
+    missing = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+
+    router = ReplicaRouter(check_interval=0)
+    assert router.choose() is None
+
+    # Healthy replicas take turns
+    router.add("first", first)
+    router.add("second", second)
+    assert {router.choose(), router.choose()} == {first, second}
+
+    # Unhealthy replicas are skipped
+    router.remove("second")
+    router.add("missing", missing)
+    assert [router.choose() for _ in range(4)] == [first] * 4
+
+    # And with no healthy replicas, we fall back to the primary
+    router.remove("first")
+    assert router.choose() is None
+
+    # Until the replica recovers
+    (tmp_path / "missing").mkdir()
+    assert router.choose() is missing
+
+
+def test_replica_router_check_interval(tmp_path):
+    replica = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = ReplicaRouter(check_interval=60)
+    router.add("replica", replica)
+    assert router.choose() is None
+
+    # It isn't checked again until the interval is up
+    (tmp_path / "missing").mkdir()
+    assert router.choose() is None
@@ -0,0 +1,40 @@
+import pytest
+from ..utils import search
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Dr Glenn Clark", "dr glenn clark"),
+        ("Zoë  O'Brien-Smith", "zoe o brien smith"),
+        ("महावीर, जगन्नाथ", "महावीर जगन्नाथ"),
+        ("刘桂荣", "刘桂荣"),
+        ("ＪＯＳＥ", "jose"),  # Full-width letters
+        ("Straße", "strasse"),
+    ],
+)
+def test_normalize_name(name, expected):
+    result = search.normalize_name(name)
+    assert result == expected, f"For name: {name}, expected: {expected} but got: {result}"
+
+
+def test_trigram_index():
+    index = search.TrigramIndex()
+    index.add("1", search.normalize_name("Dr Glenn Clark"))
+    index.add("2", search.normalize_name("Dr Ian Hall"))
+    index.add("3", search.normalize_name("महावीर, जगन्नाथ"))
+
+    assert index.search("clark glenn", 10) == ["1"]
+    assert index.search("dr", 10) == ["1", "2"]
+    assert index.search("dr", 1) == ["1"]
+    assert index.search("जगन्नाथ", 10) == ["3"]
+    assert index.search("glen hall", 10) == []
+
+    # Renaming replaces the old name
+    index.add("1", search.normalize_name("Dr Glenn Hall"))
+    assert index.search("clark", 10) == []
+    assert index.search("hall", 10) == ["1", "2"]
+
+    index.remove("2")
+    assert index.search("hall", 10) == ["1"]
+    assert len(index) == 2
@@ -0,0 +1,223 @@
+import os
+import subprocess
+import sys
+from collections import Counter
+from datetime import date, datetime, timezone
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import sessionmaker
+
+from ..app import Patient, Appointment, Clinician, Department, clinician_names, department_names
+from ..utils.sharding import ShardRouter, shard_for, keys_in_criteria, merge_shards, rebalance
+
+NHS_NUMBERS = [f"{i:010d}" for i in range(200)]
+
+# The session class is chosen when the app is imported, so the app is run sharded in its own process
+SHARDED_APP = """
+import json
+from app import app, db
+
+with open("tests/example-patients.json") as f:
+    example_patients = json.load(f)
+
+client = app.test_client()
+with app.app_context():
+    db.create_all()
+    result = app.test_cli_runner().invoke(args=["init-shards"])
+    assert result.exit_code == 0, result.output
+
+    for example_patient in example_patients[:5]:
+        assert client.post("/patients/", json=example_patient).status_code == 201
+
+    response = client.get("/patients/search", query_string={"q": "nobody by this name"})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()["patients"] == []
+    response = client.get("/patients/search", query_string={"q": example_patients[0]["name"]})
+    assert response.status_code == 200
+    assert example_patients[0]["nhs_number"] in [p["nhs_number"] for p in response.get_json()["patients"]]
+
+    nhs_number = example_patients[1]["nhs_number"]
+    assert client.get(f"/patients/{nhs_number}/").status_code == 200
+    response = client.post("/patients/batch-get", json={"ids": [nhs_number, "0123456789"]})
+    assert response.get_json()["results"]["0123456789"]["code"] == 404
+
+    # Appointments stay with their patient
+    appointment = {
+        "patient": nhs_number,
+        "status": "active",
+        "time": "2030-01-01T09:00:00+00:00",
+        "duration": "1h",
+        "clinician": "Dr Who",
+        "department": "oncology",
+        "postcode": "N6 2FA",
+    }
+    response = client.post("/appointments/", json=appointment)
+    assert response.status_code == 201, response.get_data(as_text=True)
+    id = response.get_json()["id"]
+    other = example_patients[2]["nhs_number"]
+    response = client.put(f"/appointments/{id}/", json={"patient": other})
+    assert response.status_code == 400
+    response = client.put(f"/appointments/{id}/", json={"patient": nhs_number, "duration": "2h"})
+    assert response.status_code == 200
+    assert client.get(f"/appointments/{id}/").get_json()["duration"] == "2h"
+"""
+
+
+def make_shards(tmp_path, count):
+    engines = {
+        f"shard_{i}": create_engine(f"sqlite:///{tmp_path / f'shard_{i}.db'}") for i in range(count)
+    }
+    names = [Clinician.__table__, Department.__table__]
+    for engine in engines.values():
+        Patient.metadata.create_all(engine, tables=names + [Patient.__table__, Appointment.__table__])
+
+    engines["primary"] = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    Patient.metadata.create_all(engines["primary"], tables=names)
+    clinician_names.clear()
+    department_names.clear()
+    router = ShardRouter(
+        [f"shard_{i}" for i in range(count)], keys={"patient": "nhs_number", "appointment": "patient"}
+    )
+    return engines, router
+
+
+def make_session(engines, router):
+    return sessionmaker(class_=ShardedSession, shards=engines, **router.session_options())()
+
+
+def add_patients(session, nhs_numbers):
+    for nhs_number in nhs_numbers:
+        session.add(
+            Patient(nhs_number=nhs_number, name="John Smith", date_of_birth=date(1980, 1, 1), postcode="N6 2FA")
+        )
+        session.add(
+            Appointment(
+                id=f"appointment-{nhs_number}",
+                patient=nhs_number,
+                status="active",
+                time=datetime(2024, 1, 1, 9, tzinfo=timezone.utc),
+                duration="1h",
+                clinician="Dr Who",
+                department="oncology",
+                postcode="N6 2FA",
+            )
+        )
+    session.commit()
+
+
+def shard_contents(engines, router, column):
+    """The NHS numbers in each shard's column."""
+    contents = {}
+    for shard_id in router.shard_ids:
+        with engines[shard_id].connect() as connection:
+            contents[shard_id] = set(connection.execute(select(column)).scalars())
+    return contents
+
+
+def test_shard_for():
+    # The same key always goes to the same shard, and the keys are spread between the shards
+    assert [shard_for(key, 4) for key in NHS_NUMBERS] == [shard_for(key, 4) for key in NHS_NUMBERS]
+    counts = Counter(shard_for(key, 4) for key in NHS_NUMBERS)
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 20
+
+    # Adding a shard only moves keys onto the new shard
+    moved = [key for key in NHS_NUMBERS if shard_for(key, 5) != shard_for(key, 4)]
+    assert all(shard_for(key, 5) == 4 for key in moved)
+    assert 10 < len(moved) < 80
+
+
+def test_keys_in_criteria():
+    column = Patient.__table__.c.nhs_number
+    assert keys_in_criteria(None, column) is None
+    assert keys_in_criteria((Patient.nhs_number == "1").__clause_element__(), column) == ["1"]
+    assert keys_in_criteria(
+        select(Patient).where(Patient.nhs_number.in_(["1", "2"])).whereclause, column
+    ) == ["1", "2"]
+    assert keys_in_criteria(
+        select(Patient).where(Patient.nhs_number == "1", Patient.name == "John").whereclause, column
+    ) == ["1"]
+
+    # ORed conditions could match any patient
+    assert keys_in_criteria(
+        select(Patient).where((Patient.nhs_number == "1") | (Patient.name == "John")).whereclause, column
+    ) is None
+    assert keys_in_criteria(select(Patient).where(Patient.name == "John").whereclause, column) is None
+    assert keys_in_criteria(select(Patient).where(Patient.nhs_number.in_([])).whereclause, column) == []
+
+
+def test_sharded_session(tmp_path):
+    engines, router = make_shards(tmp_path, 3)
+    session = make_session(engines, router)
+    add_patients(session, NHS_NUMBERS[:30])
+
+    # Each patient is in their shard, along with their appointments
+    patients = shard_contents(engines, router, Patient.nhs_number)
+    assert shard_contents(engines, router, Appointment.patient) == patients
+    for shard_id, nhs_numbers in patients.items():
+        assert nhs_numbers
+        assert all(router.shard_id_for(nhs_number) == shard_id for nhs_number in nhs_numbers)
+
+    # They can be found by their primary keys, whichever shard they are in
+    session = make_session(engines, router)
+    assert session.get(Patient, NHS_NUMBERS[5]).nhs_number == NHS_NUMBERS[5]
+    assert session.get(Appointment, f"appointment-{NHS_NUMBERS[7]}").patient == NHS_NUMBERS[7]
+    assert session.get(Appointment, "missing") is None
+    assert session.scalars(select(Patient).where(Patient.nhs_number.in_([]))).all() == []
+
+    # Queries about some patients only go to their shards, and the rest are gathered from them all
+    appointments = session.scalars(select(Appointment).where(Appointment.patient == NHS_NUMBERS[3])).all()
+    assert [appointment.id for appointment in appointments] == [f"appointment-{NHS_NUMBERS[3]}"]
+    assert len(session.scalars(select(Appointment)).all()) == 30
+
+    # Changes are written back to the shard they came from
+    appointment = session.get(Appointment, f"appointment-{NHS_NUMBERS[9]}")
+    appointment.status = "attended"
+    session.commit()
+    assert make_session(engines, router).get(Appointment, appointment.id).status == "attended"
+
+    # Counts come from every shard at once
+    counts = router.scatter(engines, select(func.count()).select_from(Patient.__table__))
+    assert sum(rows[0][0] for rows in counts.values()) == 30
+
+    # Sorted queries can be merged
+    query = select(Patient.nhs_number).order_by(Patient.nhs_number)
+    rows = merge_shards(session, router.shard_ids, query, key=lambda row: row.nhs_number)
+    assert [row.nhs_number for row in rows] == NHS_NUMBERS[:30]
+
+
+def test_rebalance(tmp_path):
+    engines, router = make_shards(tmp_path, 2)
+    add_patients(make_session(engines, router), NHS_NUMBERS)
+
+    # Add a shard, and the patients which belong in it are still in the old ones
+    engines, router = make_shards(tmp_path, 3)
+    assert not shard_contents(engines, router, Patient.nhs_number)["shard_2"]
+
+    moved = rebalance(engines, router, [Patient.__table__, Appointment.__table__], chunk_size=30)
+    assert moved["patient"] == moved["appointment"] > 0
+
+    patients = shard_contents(engines, router, Patient.nhs_number)
+    assert shard_contents(engines, router, Appointment.patient) == patients
+    assert set().union(*patients.values()) == set(NHS_NUMBERS)
+    assert sum(len(nhs_numbers) for nhs_numbers in patients.values()) == len(NHS_NUMBERS)
+    for shard_id, nhs_numbers in patients.items():
+        assert all(router.shard_id_for(nhs_number) == shard_id for nhs_number in nhs_numbers)
+
+    # Running it again has nothing to do
+    moved = rebalance(engines, router, [Patient.__table__, Appointment.__table__])
+    assert moved == {"patient": 0, "appointment": 0}
+
+
+def test_sharded_app(tmp_path):
+    uri = "sqlite:///" + str(tmp_path / "{}.db")
+    env = {
+        **os.environ,
+        "SQLALCHEMY_DATABASE_URI": uri.format("primary"),
+        "SQLALCHEMY_SHARD_URIS": ",".join(uri.format(f"shard_{i}") for i in range(3)),
+        "AUDIT_LOG": "none",
+        "PYTHONPATH": os.getcwd(),
+    }
+    result = subprocess.run([sys.executable, "-c", SHARDED_APP], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
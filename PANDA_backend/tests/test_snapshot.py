@@ -0,0 +1,113 @@
+import os
+import pytest
+from datetime import date, datetime, timezone
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, select
+
+from ..app import Patient, Appointment
+from ..utils.snapshot import SnapshotWriter, read_snapshot, dump_table, load_rows, encode_copy_csv
+
+
+def test_snapshot_round_trip(tmp_path):
+    source = create_engine(f"sqlite:///{tmp_path / 'source.db'}")
+    target = create_engine(f"sqlite:///{tmp_path / 'target.db'}")
+    tables = [Patient.__table__, Appointment.__table__]
+    for engine in (source, target):
+        Patient.metadata.create_all(engine, tables=tables)
+
+    with source.begin() as connection:
+        connection.execute(
+            Patient.__table__.insert(),
+            [
+                {
+                    "nhs_number": f"{i:010d}",
+                    "name": "",
+                    "search_key": "",
+                    "date_of_birth": date(1980, 1, i + 1),
+                    "postcode": "N6 2FA",
+                }
+                for i in range(25)
+            ],
+        )
+        connection.execute(
+            Appointment.__table__.insert(),
+            {
+                "id": "1",
+                "patient": "0000000000",
+                "status": "active",
+                "time": datetime(2024, 1, 1, 9, tzinfo=timezone.utc),
+                "duration": "1h",
+                "clinician_id": 1,
+                "department_id": 1,
+                "postcode": "N6 2FA",
+                "end_time": datetime(2024, 1, 1, 10, tzinfo=timezone.utc),
+            },
+        )
+
+    path = tmp_path / "snapshot"
+    with SnapshotWriter(str(path)) as writer:
+        with source.connect() as connection:
+            for table in tables:
+                columns = [column.name for column in table.columns]
+                for rows in dump_table(connection, table, chunk_size=10):
+                    writer.write_chunk(table.name, columns, rows)
+    assert writer.counts == {"patient": 25, "appointment": 1}
+    assert not (tmp_path / "snapshot.tmp").exists()
+
+    chunks = list(read_snapshot(str(path)))
+    assert [(table, len(rows)) for table, _, rows in chunks] == [
+        ("patient", 10), ("patient", 10), ("patient", 5), ("appointment", 1)
+    ]
+
+    with target.begin() as connection:
+        for table, columns, rows in chunks:
+            load_rows(connection, Patient.metadata.tables[table], columns, rows)
+
+    for table in tables:
+        with source.connect() as before, target.connect() as after:
+            assert after.execute(select(table)).all() == before.execute(select(table)).all()
+
+    # Anything short of the whole file is refused
+    data = path.read_bytes()
+    for length in (4, len(data) // 2, len(data) - 1):
+        path.write_bytes(data[:length])
+        with pytest.raises(ValueError):
+            list(read_snapshot(str(path)))
+
+
+def test_encode_copy_csv():
+    # NULL is the only value that isn't quoted, so an empty string, or one that looks like NULL, is kept
+    assert encode_copy_csv([["a", None, 1, "", "\\N", 'say "hi"\nthere']]) == (
+        '"a",\\N,"1","","\\N","say ""hi""\nthere"\n'
+    )
+
+
+@pytest.mark.skipif(
+    not os.environ.get("SQLALCHEMY_DATABASE_URI", "").startswith("postgresql"), reason="COPY is only used on Postgres"
+)
+def test_load_rows_copy_nulls():
+    engine = create_engine(os.environ["SQLALCHEMY_DATABASE_URI"])
+    table = Table(
+        "snapshot_nulls",
+        MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("name", String),
+        Column("count", Integer),
+        Column("at", DateTime(timezone=True)),
+    )
+    rows = [
+        (1, None, None, None),
+        (2, "", 0, "2024-01-01T09:00:00+00:00"),
+        (3, "\\N", 5, None),
+    ]
+    with engine.connect() as connection:
+        table.create(connection)
+        try:
+            load_rows(connection, table, ["id", "name", "count", "at"], rows)
+            loaded = connection.execute(select(table).order_by(table.c.id)).all()
+        finally:
+            connection.rollback()
+
+    assert [row[:3] for row in loaded] == [(1, None, None), (2, "", 0), (3, "\\N", 5)]
+    assert loaded[0].at is None and loaded[2].at is None
+    assert loaded[1].at == datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
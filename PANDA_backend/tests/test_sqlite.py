@@ -0,0 +1,97 @@
+import pytest
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..app import Patient, Appointment, Clinician, Department, clinician_names, department_names
+from ..utils.sqlite import SingleWriter, sqlite_pragmas, apply_pragmas
+
+
+def make_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'panda.db'}")
+    apply_pragmas(engine, sqlite_pragmas(busy_timeout=1000))
+    Patient.metadata.create_all(
+        engine, tables=[Clinician.__table__, Department.__table__, Patient.__table__, Appointment.__table__]
+    )
+    # IDs cached from other databases would break the foreign keys
+    clinician_names.clear()
+    department_names.clear()
+    return engine
+
+
+def make_patient(nhs_number):
+    return Patient(nhs_number=nhs_number, name="John Smith", date_of_birth="1980-01-01", postcode="N6 2FA")
+
+
+def test_pragmas(tmp_path):
+    engine = make_database(tmp_path)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 1000
+
+
+def test_times_and_dates(tmp_path):
+    engine = make_database(tmp_path)
+    new_york = timezone(timedelta(hours=-5))
+    with Session(engine) as session:
+        session.add(make_patient("1373645350"))
+        session.add(
+            Appointment(
+                id="1",
+                patient="1373645350",
+                status="active",
+                time=datetime(2024, 1, 1, 9, tzinfo=new_york),
+                end_time="2024-01-01T15:00:00+00:00",
+                duration="1h",
+                clinician="Dr Who",
+                department="oncology",
+                postcode="N6 2FA",
+            )
+        )
+        session.commit()
+
+    # Times come back in UTC, and compare by the moment they are, whatever zone they were given in
+    with Session(engine) as session:
+        appointment = session.get(Appointment, "1")
+        assert appointment.time == datetime(2024, 1, 1, 14, tzinfo=timezone.utc)
+        assert appointment.time.tzinfo == timezone.utc
+        assert appointment.end_time == datetime(2024, 1, 1, 15, tzinfo=timezone.utc)
+        assert session.get(Patient, "1373645350").date_of_birth == date(1980, 1, 1)
+
+        booked = datetime(2024, 1, 1, 9, tzinfo=new_york)
+        assert session.query(Appointment).filter(Appointment.time < booked).count() == 0
+        assert session.query(Appointment).filter(Appointment.time <= booked).count() == 1
+        assert session.query(Appointment).filter(Appointment.time > booked - timedelta(hours=1)).count() == 1
+
+
+def test_single_writer(tmp_path):
+    engine = make_database(tmp_path)
+
+    class WriterSession(Session):
+        pass
+
+    writer = SingleWriter(timeout=0.1)
+    writer.attach(WriterSession)
+    make_session = sessionmaker(engine, class_=WriterSession)
+
+    first, second = make_session(), make_session()
+    first.add(make_patient("1373645350"))
+    first.flush()
+
+    # Reading doesn't need the writer's lock, but writing waits for the first session to finish
+    assert second.get(Patient, "1373645350") is None
+    second.add(make_patient("9434765919"))
+    with pytest.raises(TimeoutError):
+        second.flush()
+    second.rollback()
+
+    first.commit()
+    second.add(make_patient("9434765919"))
+    second.commit()
+    first.close()
+    second.close()
+
+    with Session(engine) as session:
+        assert session.query(Patient).count() == 2
@@ -1,4 +1,6 @@
 import pytest
+import numpy as np
+from datetime import datetime, timedelta, timezone
 from ..utils import validators
 
 
@@ -19,3 +21,35 @@ def test_validate_nhs_number(nhs_number, expected):
     assert (
         result == expected
     ), f"For NHS number: {nhs_number}, expected: {expected} but got: {result}"
+
+
+NOW = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "status, end_time, expected",
+    [
+        ("active", NOW - timedelta(minutes=1), True),
+        ("active", NOW + timedelta(minutes=1), False),
+        ("active", NOW, False),
+        ("attended", NOW - timedelta(minutes=1), False),
+        ("cancelled", NOW - timedelta(minutes=1), False),
+        # Another timezone, an hour ahead of UTC
+        ("active", datetime(2024, 1, 1, 12, 30, tzinfo=timezone(timedelta(hours=1))), True),
+    ],
+)
+def test_is_missed(status, end_time, expected):
+    assert validators.is_missed(status, end_time, NOW) == expected
+    assert list(validators.classify_missed([status], [end_time], NOW)) == [expected]
+
+
+def test_classify_missed():
+    statuses = ["active", "active", "attended", "missed"]
+    end_times = [NOW - timedelta(hours=1), NOW + timedelta(hours=1), NOW - timedelta(hours=1), NOW]
+    assert list(validators.classify_missed(statuses, end_times, NOW)) == [True, False, False, False]
+
+    # End times can also be given as an array of UTC datetime64s
+    end_times = np.array([NOW.replace(tzinfo=None) - timedelta(hours=1), NOW.replace(tzinfo=None)], dtype="datetime64[us]")
+    assert list(validators.classify_missed(["active", "active"], end_times, NOW)) == [True, False]
+
+    assert len(validators.classify_missed([], [], NOW)) == 0
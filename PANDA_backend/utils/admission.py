@@ -0,0 +1,143 @@
+import math
+import time
+from collections import OrderedDict
+from threading import Condition, Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class ConcurrencyLimit:
+    """Bounds how many requests of a class can be handled at once.
+
+    Requests over the limit wait in a queue of at most max_queue requests, for at most the timeout
+    given to acquire. Any more than that are turned away straight away, rather than making
+    everyone behind them wait even longer.
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._condition = Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+
+            if self.waiting >= self.max_queue:
+                return False
+
+            self.waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self.active < self.limit, timeout)
+            finally:
+                self.waiting -= 1
+
+            if admitted:
+                self.active += 1
+            return admitted
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class RateLimiter:
+    """Token buckets, one per client, refilling at rate tokens a second up to burst tokens.
+
+    Only the max_clients most recently seen clients are remembered. Anyone older has had plenty of
+    time to refill their bucket anyway.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, client) -> float:
+        """Take a token from the client's bucket.
+
+        Returns 0 if there was one, or otherwise how many seconds until there will be.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+
+class Admission:
+    """Whether a request was admitted, and if not, what to tell the client."""
+
+    def __init__(self, limit: ConcurrencyLimit = None, status: int = None, message: str = None, retry_after: float = None):
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+        self._limit = limit
+
+    @property
+    def admitted(self) -> bool:
+        return self.status is None
+
+    def release(self):
+        """Free up the request's place once it has been handled. This can safely be called twice."""
+        limit, self._limit = self._limit, None
+        if limit is not None:
+            limit.release()
+
+
+class AdmissionController:
+    """Decides which requests to handle, and which to shed, when there are too many.
+
+    Each class of route (e.g. reads and writes) has its own concurrency limit, so that a flood of
+    one can't hold up the other. Classes without a limit are always admitted. If rate and burst are
+    given, each client is also rate limited, separately for each class of route.
+    """
+
+    def __init__(self, limits: dict, queue_timeout: float, rate: float = None, burst: float = None):
+        self.limits = {
+            route_class: ConcurrencyLimit(limit, max_queue=limit)
+            for route_class, limit in limits.items()
+        }
+        self.queue_timeout = queue_timeout
+        self.rate_limiter = RateLimiter(rate, burst) if rate else None
+
+    def admit(self, route_class: str, client) -> Admission:
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take((client, route_class))
+            if wait:
+                logger.info(f"Rate limited {client} for {route_class} requests")
+                return Admission(status=429, message="Too many requests", retry_after=wait)
+
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return Admission()
+
+        if not limit.acquire(self.queue_timeout):
+            logger.info(f"Shedding a {route_class} request, {limit.active} active and {limit.waiting} waiting")
+            return Admission(status=503, message="Server is busy", retry_after=self.queue_timeout)
+
+        return Admission(limit=limit)
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After is in whole seconds, so round up, and never tell clients to retry straight away."""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,59 @@
+import os
+import json
+import zlib
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Archives are gzip files of newline-delimited JSON. Each chunk of records is appended as its own
+# gzip member, which a gzip reader sees as one continuous file, but which we can also seek to and
+# decompress on its own to read back a single record.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+READ_SIZE = 64 * 1024
+
+
+def archive_file_name(kind: str, time) -> str:
+    """The archive for the records of a kind (e.g. "appointments") in the month of time."""
+    return f"{kind}-{time:%Y-%m}.ndjson.gz"
+
+
+def append_archive_chunk(path: str, records) -> int:
+    """Append records to an archive as a new chunk, and wait for it to reach the disk.
+
+    Returns the offset of the chunk within the archive, for read_archived_record.
+    """
+    data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    chunk = compressor.compress(data) + compressor.flush()
+
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+    return offset
+
+
+def read_archive_chunk(path: str, offset: int) -> list:
+    """Read the records of the chunk at offset in an archive."""
+    decompressor = zlib.decompressobj(wbits=GZIP_WBITS)
+    data = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            compressed = f.read(READ_SIZE)
+            if not compressed:
+                raise ValueError(f"Archive {path} is truncated at offset {offset}")
+            data.append(decompressor.decompress(compressed))
+
+    return [json.loads(line) for line in b"".join(data).splitlines()]
+
+
+def read_archived_record(path: str, offset: int, id: str):
+    """Find the record with an ID in the chunk at offset in an archive, or None if it isn't there."""
+    for record in read_archive_chunk(path, offset):
+        if record["id"] == id:
+            return record
+
+    return None
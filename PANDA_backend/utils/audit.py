@@ -0,0 +1,270 @@
+import os
+import json
+import queue
+import time
+from threading import Condition, Lock, Thread
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class AuditLog:
+    """Records who read or changed which records, without making requests wait for it to be written.
+
+    Events are put on a bounded queue in memory, and a background thread takes them off in batches
+    and passes each batch to write, e.g. to insert them all in one statement. The thread waits up
+    to flush_interval seconds after the first event of a batch for more to arrive, so a busy server
+    writes a few big batches rather than many small ones.
+
+    If the queue is full, because events are being recorded faster than they can be written or
+    the audit store is down, recording an event waits up to put_timeout seconds for space. After
+    that the event is dropped, so a slow store can only hold requests up by so much. How often
+    this happens is reported by metrics.
+
+    A batch that fails to write is tried max_attempts times in all, retry_delay seconds apart.
+    Then, in case it is only some of its events that can't be written, it is split in half, and
+    each half tried once, and so on down to single events. Events that still can't be written are
+    passed to dead_letter (e.g. a RotatingFileWriter), or dropped if there isn't one, so that one
+    bad event can't hold up the rest of the log.
+
+    Changes can be staged against the database session making them, and only recorded once that
+    session commits, as for the change feed.
+    """
+
+    def __init__(
+        self,
+        write,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        put_timeout: float = 0.1,
+        retry_delay: float = 1,
+        max_attempts: int = 3,
+        dead_letter=None,
+    ):
+        self.write = write
+        self.dead_letter = dead_letter
+        self.max_attempts = max_attempts
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = Lock()
+        self._writer = None
+        self._closed = False
+        # Events that have been recorded, but not written yet, for flush to wait on
+        self._unwritten = 0
+        self._written = Condition()
+        self._counts = {
+            "recorded": 0,
+            "written": 0,
+            "dropped": 0,
+            "waited": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dead_lettered": 0,
+            "high_water": 0,
+        }
+        self._wait_seconds = 0.0
+        self._last_batch = None
+
+    def record(self, event: dict) -> bool:
+        """Queue an event to be written. Returns False if the queue stayed full, and it was dropped."""
+        self._start()
+        with self._written:
+            self._unwritten += 1
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            started = time.perf_counter()
+            try:
+                self._queue.put(event, timeout=self.put_timeout)
+                dropped = False
+            except queue.Full:
+                dropped = True
+
+            with self._lock:
+                self._counts["waited"] += 1
+                self._wait_seconds += time.perf_counter() - started
+                if dropped:
+                    self._counts["dropped"] += 1
+                    # Only say so when it starts, rather than for every event
+                    if self._counts["dropped"] == 1 or self._counts["dropped"] % 1000 == 0:
+                        logger.error(f"The audit queue is full, {self._counts['dropped']} events dropped so far")
+
+            if dropped:
+                self._finished(1)
+                return False
+
+        with self._lock:
+            self._counts["recorded"] += 1
+            self._counts["high_water"] = max(self._counts["high_water"], self._queue.qsize())
+        return True
+
+    def stage(self, session, event: dict):
+        """Queue an event to be recorded when the session commits."""
+        session.info.setdefault("audit_events", []).append(event)
+
+    def commit(self, session):
+        for event in session.info.pop("audit_events", []):
+            self.record(event)
+
+    def rollback(self, session):
+        session.info.pop("audit_events", None)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every event recorded so far has been written. Returns False if it timed out."""
+        with self._written:
+            return self._written.wait_for(lambda: self._unwritten == 0, timeout)
+
+    def close(self, timeout: float = 5):
+        """Write out what is left in the queue, giving up after timeout seconds."""
+        self._closed = True
+        if not self.flush(timeout):
+            logger.error(f"Gave up writing audit events on close, {self._queue.qsize()} were left in the queue")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                **self._counts,
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "wait_seconds": round(self._wait_seconds, 6),
+                "last_batch": self._last_batch,
+            }
+
+    def _start(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = Thread(target=self._run, name="audit-writer", daemon=True)
+                self._writer.start()
+
+    def _finished(self, count: int):
+        with self._written:
+            self._unwritten -= count
+            if self._unwritten == 0:
+                self._written.notify_all()
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._closed:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            self._write(batch, self.max_attempts)
+            with self._lock:
+                self._counts["batches"] += 1
+                self._last_batch = {
+                    "events": len(batch),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                }
+            self._finished(len(batch))
+
+    def _write(self, batch: list, attempts: int):
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.retry_delay)
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} audit events: {e}")
+                with self._lock:
+                    self._counts["failed_batches"] += 1
+                continue
+
+            with self._lock:
+                self._counts["written"] += len(batch)
+            return
+
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            self._write(batch[:middle], 1)
+            self._write(batch[middle:], 1)
+            return
+
+        self._write_dead_letter(batch)
+
+    def _write_dead_letter(self, batch: list):
+        if self.dead_letter is not None:
+            try:
+                self.dead_letter(batch)
+                with self._lock:
+                    self._counts["dead_lettered"] += len(batch)
+                logger.error("Wrote an audit event that couldn't be written to the dead letter file instead")
+                return
+            except Exception as e:
+                logger.error(f"Failed to write an audit event to the dead letter file: {e}")
+
+        logger.error(f"Dropped an audit event that couldn't be written: {batch}")
+        with self._lock:
+            self._counts["dropped"] += len(batch)
+
+
+def database_writer(engine, table):
+    """Make a write for AuditLog, which inserts each batch into a table in one transaction."""
+
+    def write(events: list):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), events)
+
+    return write
+
+
+class RotatingFileWriter:
+    """A write for AuditLog, which appends events to a file as newline-delimited JSON.
+
+    Each batch is synced to disk before it counts as written. When the file would grow past
+    max_bytes, it is renamed to path.1 (path.1 to path.2, and so on, keeping backups of them),
+    and a new file is started, as logging's RotatingFileHandler does. Only one process can write
+    to a file, so with several workers, put {pid} in the path to give each its own.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024, backups: int = 10):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def __call__(self, events: list):
+        # Formatted when writing, rather than when made, as workers are forked after that
+        path = self.path.format(pid=os.getpid())
+        data = "".join(json.dumps(event, default=encode_value) + "\n" for event in events).encode()
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size and size + len(data) > self.max_bytes:
+            self.rotate(path)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rotate(self, path: str):
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{number}"):
+                os.replace(f"{path}.{number}", f"{path}.{number + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+        logger.info(f"Rotated the audit file {path}")
+
+
+def encode_value(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Can't write {value!r} to the audit file")
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class TTLCache:
+    """A small, thread-safe, in-process cache whose entries expire after a fixed time.
+
+    Entries are also evicted, oldest first, once the cache holds more than max_size of them.
+    Each worker process has its own cache, so the TTL bounds how stale an entry can be in a worker
+    that didn't see the write which invalidated it.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
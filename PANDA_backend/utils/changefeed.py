@@ -0,0 +1,149 @@
+import json
+import queue
+import select
+import time
+from threading import Lock, Thread
+from logging import getLogger
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+logger = getLogger(__name__)
+
+
+class Subscription:
+    """A subscriber's queue of change events, and the filters it wants applied to them.
+
+    If the subscriber falls too far behind and its queue fills up, further events are dropped and
+    the subscription is marked as overflowed, so the subscriber knows it has missed something.
+    """
+
+    def __init__(self, filters: dict, max_queue: int):
+        self.filters = filters
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def matches(self, event: dict) -> bool:
+        return all(event.get(field) == value for field, value in self.filters.items())
+
+    def put(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: float):
+        """Wait up to timeout seconds for the next event. Returns None if there wasn't one."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalChangeFeed:
+    """Fans change events out to the subscribers in this process.
+
+    Events are staged against the database session that made the change, and only published once
+    that session commits, so subscribers never hear about changes that were rolled back. This only
+    reaches subscribers in the same process; with several workers, use PostgresChangeFeed.
+    """
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self._subscriptions = set()
+        self._lock = Lock()
+
+    def subscribe(self, **filters) -> Subscription:
+        subscription = Subscription(filters, self.max_queue)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def stage(self, session, event: dict):
+        """Queue an event to be published when the session commits."""
+        session.info.setdefault("change_events", []).append(event)
+
+    def commit(self, session):
+        for event in session.info.pop("change_events", []):
+            self.publish(event)
+
+    def rollback(self, session):
+        session.info.pop("change_events", None)
+
+
+class PostgresChangeFeed(LocalChangeFeed):
+    """Shares change events between every worker, using Postgres' LISTEN/NOTIFY.
+
+    Events are sent with NOTIFY inside the transaction that made the change, so Postgres only
+    delivers them if it commits. Each worker has one connection listening for them, in a background
+    thread that is started by the first subscriber, and fans them out to its own subscribers.
+    """
+
+    channel = "panda_changes"
+
+    def __init__(self, database_uri: str, max_queue: int = 1000, reconnect_delay: float = 5):
+        super().__init__(max_queue)
+        self.database_uri = database_uri
+        self.reconnect_delay = reconnect_delay
+        self._listener = None
+
+    def subscribe(self, **filters) -> Subscription:
+        with self._lock:
+            if self._listener is None:
+                self._listener = Thread(target=self._listen, name="change-feed", daemon=True)
+                self._listener.start()
+
+        return super().subscribe(**filters)
+
+    def stage(self, session, event: dict):
+        session.connection().execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": self.channel, "payload": json.dumps(event)},
+        )
+
+    def commit(self, session):
+        # Postgres delivers the notifications to our listener, along with everyone else's
+        pass
+
+    def rollback(self, session):
+        pass
+
+    def _listen(self):
+        engine = create_engine(self.database_uri, poolclass=NullPool)
+        while True:
+            connection = None
+            try:
+                # Take the connection out of the engine's hands, so it stays open for as long as we need it
+                pooled = engine.raw_connection()
+                pooled.detach()
+                connection = pooled.dbapi_connection
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {self.channel}")
+                logger.info(f"Listening for changes on {self.channel}")
+
+                while True:
+                    readable, _, _ = select.select([connection], [], [], self.reconnect_delay)
+                    if not readable:
+                        continue
+
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        self.publish(json.loads(notification.payload))
+            except Exception as e:
+                logger.error(f"Lost the change feed connection, reconnecting: {e}")
+                if connection is not None:
+                    connection.close()
+                time.sleep(self.reconnect_delay)
@@ -0,0 +1,25 @@
+from logging import getLogger
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = getLogger(__name__)
+
+INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def add_to_counts(connection, table, rows: list):
+    """Add to the counts in a table of counters, creating any that don't exist yet.
+
+    Each row gives the primary key of a counter, and how much to add to its "count" column. This is
+    one INSERT ... ON CONFLICT DO UPDATE, so it is safe against concurrent writers. Rows are locked in
+    the order given, so give them in a consistent order (e.g. sorted), or two writers could deadlock.
+    """
+    if not rows:
+        return
+
+    statement = INSERTS[connection.dialect.name](table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={"count": table.c["count"] + statement.excluded["count"]},
+    )
+    connection.execute(statement)
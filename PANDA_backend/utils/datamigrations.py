@@ -0,0 +1,104 @@
+import time
+from datetime import datetime, timezone
+from logging import getLogger
+
+from sqlalchemy import select
+from sqlalchemy.orm.exc import StaleDataError
+
+logger = getLogger(__name__)
+
+
+class DataMigration:
+    """A change to existing records, to be made a chunk at a time by run_data_migration.
+
+    Records of model are visited in order of key, a column which must be unique and indexed (e.g.
+    the primary key), optionally narrowed down by the conditions in where. apply is called with each
+    chunk of records, changes them in place, and returns how many it changed.
+    """
+
+    def __init__(self, name: str, description: str, model, key, apply, where=()):
+        self.name = name
+        self.description = description
+        self.model = model
+        self.key = key
+        self.apply = apply
+        self.where = where
+
+
+def run_data_migration(
+    session,
+    migration: DataMigration,
+    checkpoints,
+    chunk_size: int = 500,
+    pause: float = 0.1,
+    max_retries: int = 5,
+    max_chunks: int = None,
+):
+    """Run a data migration a chunk at a time, alongside live traffic, resuming where it left off.
+
+    Each chunk is locked, changed through the ORM (so versions, change events and so on all work as
+    for any other write), and committed along with a checkpoint of the last key it covered, in its
+    own short transaction. If a chunk clashes with a concurrent write, it is retried. Between
+    chunks, we pause for a while to leave the database to serve everyone else.
+
+    checkpoints is the model that checkpoints are kept in, with name, position, records, changed,
+    updated_at and finished_at columns. Returns the checkpoint, which has finished_at set once
+    every record has been done.
+    """
+    chunks = 0
+    retries = 0
+    while max_chunks is None or chunks < max_chunks:
+        # Locking the checkpoint means two runs of the same migration take turns, rather than
+        # both doing the same chunks
+        checkpoint = session.get(checkpoints, migration.name, with_for_update=True)
+        if checkpoint is None:
+            session.add(checkpoints(name=migration.name, records=0, changed=0))
+            session.commit()
+            continue
+        if checkpoint.finished_at is not None:
+            session.commit()
+            logger.info(f"Data migration {migration.name} has already finished")
+            return checkpoint
+
+        query = select(migration.model).where(*migration.where)
+        if checkpoint.position is not None:
+            query = query.where(migration.key > checkpoint.position)
+        query = query.order_by(migration.key).limit(chunk_size).with_for_update()
+
+        try:
+            # Sharded sessions gather each shard's chunk, so put them back in order and keep the
+            # first chunk of them, or we would skip past some records in the shards
+            records = sorted(session.scalars(query).all(), key=lambda record: getattr(record, migration.key.key))
+            records = records[:chunk_size]
+            if not records:
+                checkpoint.finished_at = checkpoint.updated_at = datetime.now(timezone.utc)
+                session.commit()
+                logger.info(
+                    f"Data migration {migration.name} finished, changing {checkpoint.changed} of {checkpoint.records} records"
+                )
+                return checkpoint
+
+            changed = migration.apply(records)
+            checkpoint.position = getattr(records[-1], migration.key.key)
+            checkpoint.records += len(records)
+            checkpoint.changed += changed
+            checkpoint.updated_at = datetime.now(timezone.utc)
+            session.commit()
+        except StaleDataError:
+            session.rollback()
+            retries += 1
+            if retries > max_retries:
+                raise
+            logger.info(f"Data migration {migration.name} clashed with another write, retrying the chunk")
+            continue
+
+        retries = 0
+        chunks += 1
+        logger.info(
+            f"Data migration {migration.name}: {checkpoint.records} records done, up to {checkpoint.position}"
+        )
+        # Don't keep every record we've visited in the session
+        session.expunge_all()
+        time.sleep(pause)
+
+    return session.get(checkpoints, migration.name)
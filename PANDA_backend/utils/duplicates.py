@@ -0,0 +1,149 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, combinations, groupby, islice
+
+from utils.validators import format_postcode
+
+# Honorifics left out when comparing names, so "Dr Jane Smith" and "Jane Smith" still match
+TITLES = {"dr", "mr", "mrs", "ms", "miss", "mx", "prof", "sir", "dame", "rev"}
+
+
+def jaro_winkler(a: str, b: str, prefix_scale: float = 0.1) -> float:
+    """How alike two strings are, from 0 (nothing alike) to 1 (the same).
+
+    This is the Jaro similarity, of how many characters the strings have in common near the same
+    places, and how many of those are out of order, boosted for strings that start the same way.
+    It suits names well, as typos and misspellings rarely change their first few letters.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+
+    window = max(len(a), len(b)) // 2 - 1
+    matched_b = [False] * len(b)
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+
+    matches = len(matches_a)
+    if not matches:
+        return 0.0
+
+    matches_b = [char for char, matched in zip(b, matched_b) if matched]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions) / matches) / 3
+
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def comparable_name(search_key: str) -> str:
+    """A normalized name (see normalize_name), without titles, and with its words in order."""
+    return " ".join(sorted(word for word in search_key.split() if word not in TITLES))
+
+
+@lru_cache(maxsize=100000)
+def block_postcode(postcode: str) -> str:
+    # Many patients share each postcode, and formatting one isn't quick
+    return format_postcode(postcode) or "".join(postcode.split()).upper()
+
+
+def block_key(postcode: str, date_of_birth) -> tuple:
+    """The block a patient is compared within: people who live at the same postcode, born on the same day.
+
+    Postcodes are compared formatted, so "n62fa" and "N6 2FA" are the same block. Anything that
+    can't be formatted is compared without its spaces.
+    """
+    return block_postcode(postcode), str(date_of_birth)
+
+
+def score_block(block: list, threshold: float) -> list:
+    """Score every pair of patients in a block, keeping those alike enough to be the same person.
+
+    Each patient is (nhs_number, name, search_key). Returns (score, first, second) for each pair,
+    with the patients as given.
+    """
+    names = [comparable_name(patient[2]) for patient in block]
+    candidates = []
+    for (i, first), (j, second) in combinations(enumerate(block), 2):
+        score = jaro_winkler(names[i], names[j])
+        if score >= threshold:
+            candidates.append((score, first, second))
+    return candidates
+
+
+def score_blocks(blocks: list, threshold: float) -> list:
+    return [(key, score_block(block, threshold)) for key, block in blocks]
+
+
+def read_blocks(patients):
+    """Group patients ordered by block (see block_key) into blocks, yielding each once it is complete.
+
+    patients is an iterable of (nhs_number, name, search_key, postcode, date_of_birth). Returns
+    (key, block) for each block with more than one patient, with the patients as (nhs_number,
+    name, search_key). Only the block being read is held, however many patients there are.
+    """
+    for key, group in groupby(patients, key=lambda patient: block_key(patient[3], patient[4])):
+        block = [(nhs_number, name, search_key) for nhs_number, name, search_key, _, _ in group]
+        # Anyone alone in their block has nobody to be a duplicate of
+        if len(block) > 1:
+            yield key, block
+
+
+def find_duplicates(patients, threshold: float = 0.9, processes: int = None, chunk_size: int = 500) -> list:
+    """Find pairs of patients who could be the same person, most alike first.
+
+    patients is an iterable of (nhs_number, name, search_key, postcode, date_of_birth), ordered so
+    that the patients in each block (see block_key) come together, e.g. by postcode without its
+    spaces, then date of birth. Only patients in the same block are compared, which keeps this
+    close to linear in the number of patients, rather than comparing every pair, and each block is
+    scored as soon as it has been read, so the patients needn't all fit in memory. The blocks are
+    scored chunk_size at a time in a pool of processes (by default, one per CPU), with only a few
+    chunks waiting at once, or one at a time in this process if processes is 1.
+
+    Returns (score, first, second, block) for each pair scoring at least threshold, with the
+    patients as (nhs_number, name, search_key).
+    """
+    blocks = read_blocks(patients)
+    if processes == 1:
+        return rank(score_blocks([block], threshold) for block in blocks)
+
+    chunks = iter(lambda: list(islice(blocks, chunk_size)), [])
+    first, second = next(chunks, []), next(chunks, None)
+    if second is None:
+        return rank([score_blocks(first, threshold)])
+
+    processes = processes or os.cpu_count()
+    results, pending = [], deque()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk in chain([first, second], chunks):
+            pending.append(executor.submit(score_blocks, chunk, threshold))
+            # Reading more patients than the processes can keep up with would only fill memory
+            if len(pending) > 2 * processes:
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+
+    return rank(results)
+
+
+def rank(results) -> list:
+    candidates = [
+        (score, first, second, key)
+        for chunk in results
+        for key, scored in chunk
+        for score, first, second in scored
+    ]
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1][0], candidate[2][0]))
+    return candidates
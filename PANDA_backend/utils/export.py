@@ -0,0 +1,49 @@
+import io
+import csv
+import json
+import zlib
+from itertools import islice
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def batched(records, batch_size: int):
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
+
+
+def encode_ndjson(records, batch_size: int = 1000):
+    """Encode dicts as newline-delimited JSON, yielding a string per batch of records."""
+    for batch in batched(records, batch_size):
+        yield "".join(json.dumps(record) + "\n" for record in batch)
+
+
+def encode_csv(records, fields: list, batch_size: int = 1000):
+    """Encode dicts as CSV with a header row, yielding a string per batch of records."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for batch in batched(records, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # An empty export is still a header
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_stream(chunks):
+    """Compress a stream of strings into a stream of gzip bytes."""
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode("utf-8"))
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
@@ -0,0 +1,69 @@
+import heapq
+from itertools import count
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def find_overlaps(intervals):
+    """Find every pair of overlapping intervals, with a sweep line.
+
+    Takes an iterable of (start, end, key) tuples, which must be sorted by start. Intervals are
+    half-open, so one that ends exactly when the next starts does not overlap it.
+
+    Rather than comparing every pair of intervals, we keep a heap of the intervals that are still
+    open as we sweep forwards through the start times. When a new interval starts, anything in the
+    heap that has already ended is dropped, and everything left must overlap the new interval.
+    This is O(n log n + k) for n intervals and k overlapping pairs.
+
+    Yields (key, other_key) tuples, where key started first.
+    """
+    open_intervals = []
+    tiebreak = count()
+    for start, end, key in intervals:
+        while open_intervals and open_intervals[0][0] <= start:
+            heapq.heappop(open_intervals)
+
+        for _, _, other_key in open_intervals:
+            yield other_key, key
+
+        # The counter breaks ties between equal end times, so we never compare keys
+        heapq.heappush(open_intervals, (end, next(tiebreak), key))
+
+
+def merge_intervals(intervals):
+    """Merge overlapping or touching (start, end) intervals. Returns a sorted list of intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def free_intervals(busy, window_start, window_end, min_length):
+    """Find the gaps between busy intervals, within a window.
+
+    Takes an iterable of busy (start, end) intervals, in any order and possibly overlapping or
+    extending outside the window. Returns a sorted list of the free (start, end) intervals inside
+    the window that are at least min_length long.
+    """
+    free = []
+    cursor = window_start
+    for start, end in merge_intervals(busy):
+        if start >= window_end:
+            break
+        if end <= cursor:
+            continue
+
+        if start - cursor >= min_length:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+
+    if window_end - cursor >= min_length:
+        free.append((cursor, window_end))
+
+    return free
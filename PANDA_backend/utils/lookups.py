@@ -0,0 +1,114 @@
+from threading import Lock
+from logging import getLogger
+
+from sqlalchemy import event, inspect, select
+
+from utils.counters import INSERTS
+
+logger = getLogger(__name__)
+
+
+class NameLookup:
+    """A cache of the IDs that names, like clinicians' names, are stored by, in a model of (id, name).
+
+    Names are only ever added to the table, never renamed or removed, so once a name's ID has
+    been committed it can be cached for as long as the process runs. A name added by a transaction
+    that hasn't committed yet isn't cached until it does, as its ID goes away if it rolls back.
+    Attach the lookup to the session class, so that it hears when that happens.
+
+    on_create, if given, is called with (session, name, id) whenever a name is added.
+    """
+
+    def __init__(self, model, max_size: int = 100000, on_create=None):
+        self.model = model
+        self.table = model.__table__
+        self.max_size = max_size
+        self.on_create = on_create
+        self._ids = {}
+        self._names = {}
+        self._lock = Lock()
+
+    def attach(self, session_class):
+        event.listen(session_class, "after_commit", self.after_commit)
+        event.listen(session_class, "after_rollback", self.after_rollback)
+
+    def cached_id(self, name: str):
+        return self._ids.get(name)
+
+    def remember(self, name: str, id: int):
+        with self._lock:
+            # A few thousand clinicians fit easily, so rather than evicting, start again if there
+            # are ever far more than expected
+            if len(self._ids) >= self.max_size:
+                self._ids.clear()
+                self._names.clear()
+            self._ids[name] = id
+            self._names[id] = name
+
+    def clear(self):
+        """Forget every cached ID, e.g. after the table has been emptied."""
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+    def added(self, session) -> dict:
+        """The names this session's transaction has added, which aren't committed yet."""
+        return session.info.setdefault("added_names", {}).setdefault(self.table.name, {})
+
+    def id_for(self, session, name: str, create: bool = False):
+        """Get the ID of a name, adding it to the table in the session's transaction if create is true.
+
+        Returns None if the name isn't in the table, and create is false.
+        """
+        id = self._ids.get(name)
+        if id is not None:
+            return id
+
+        added = self.added(session)
+        if name in added:
+            return added[name]
+
+        query = select(self.table.c.id).where(self.table.c.name == name)
+        id = session.execute(query).scalar()
+        if id is not None:
+            self.remember(name, id)
+            return id
+        if not create:
+            return None
+
+        # Another transaction could be adding the same name, in which case this waits for it, then
+        # uses its ID
+        dialect = session.get_bind(inspect(self.model)).dialect.name
+        session.execute(INSERTS[dialect](self.table).values(name=name).on_conflict_do_nothing(index_elements=["name"]))
+        id = session.execute(query).scalar()
+        added[name] = id
+        logger.info(f"Added {name} to {self.table.name}, as {id}")
+
+        if self.on_create is not None:
+            self.on_create(session, name, id)
+        return id
+
+    def name_for(self, session, id: int):
+        """Get the name with an ID, or None if there isn't one."""
+        if id is None:
+            return None
+
+        name = self._names.get(id)
+        if name is not None:
+            return name
+
+        for added_name, added_id in self.added(session).items():
+            if added_id == id:
+                return added_name
+
+        name = session.execute(select(self.table.c.name).where(self.table.c.id == id)).scalar()
+        if name is not None:
+            self.remember(name, id)
+        return name
+
+    def after_commit(self, session):
+        for name, id in session.info.get("added_names", {}).pop(self.table.name, {}).items():
+            self.remember(name, id)
+
+    def after_rollback(self, session):
+        session.info.get("added_names", {}).pop(self.table.name, None)
@@ -0,0 +1,121 @@
+import os
+import csv
+import mmap
+import struct
+from logging import getLogger
+
+from utils.validators import format_postcode
+
+logger = getLogger(__name__)
+
+# A postcode directory file is a header, followed by the formatted postcodes, sorted and padded with
+# NUL bytes to a fixed width so that the file can be binary searched in place.
+MAGIC = b"PANDAPC1"
+HEADER = struct.Struct("<8sQ")
+RECORD_SIZE = 8  # The longest postcodes are like "AA9A 9AA"
+
+
+def read_postcode_list(path: str):
+    """Read the postcodes from a published postcode list.
+
+    This can be a CSV with a header, such as the ONS Postcode Directory, in which case postcodes are
+    taken from its "pcds" or "postcode" column (or the first column, if it has neither). A file with
+    no header is read as one postcode per line.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        columns = [column.strip().lower() for column in header]
+        if "pcds" in columns:
+            column = columns.index("pcds")
+        elif "postcode" in columns:
+            column = columns.index("postcode")
+        else:
+            # No recognisable header, so the first row is a postcode too
+            column = 0
+            yield header[0]
+
+        for row in reader:
+            if len(row) > column:
+                yield row[column]
+
+
+def build_postcode_directory(postcodes, path: str) -> int:
+    """Compile postcodes into a directory file at path, for PostcodeDirectory to look them up in.
+
+    Each postcode is formatted with format_postcode, and any that can't be are skipped. The file is
+    written alongside path and moved into place once complete, so workers never see a partial file.
+    Returns the number of postcodes in the directory.
+    """
+    records = set()
+    skipped = 0
+    for postcode in postcodes:
+        formatted = format_postcode(postcode)
+        if not formatted:
+            skipped += 1
+            continue
+        records.add(formatted.encode("ascii").ljust(RECORD_SIZE, b"\0"))
+
+    if skipped:
+        logger.warning(f"Skipped {skipped} invalid postcodes")
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for record in sorted(records):
+            f.write(record)
+    os.replace(temporary_path, path)
+
+    logger.info(f"Wrote {len(records)} postcodes to {path}")
+    return len(records)
+
+
+class PostcodeDirectory:
+    """Looks up postcodes in a directory file built by build_postcode_directory.
+
+    The file is memory-mapped and binary searched in place, so lookups don't read the whole file,
+    and the operating system shares its pages between every worker that has it open.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * RECORD_SIZE:
+            self._map.close()
+            raise ValueError(f"{path} is not a postcode directory")
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, postcode: str) -> bool:
+        """Check whether a postcode, formatted as by format_postcode, is in the directory."""
+        try:
+            target = postcode.encode("ascii")
+        except UnicodeEncodeError:
+            return False
+        if len(target) > RECORD_SIZE:
+            return False
+        target = target.ljust(RECORD_SIZE, b"\0")
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD_SIZE
+            record = self._map[offset : offset + RECORD_SIZE]
+            if record < target:
+                low = middle + 1
+            elif record > target:
+                high = middle
+            else:
+                return True
+
+        return False
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,133 @@
+import os
+import re
+import sys
+import json
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from uuid import uuid4
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+PROFILE_ID = re.compile(r"^\d{8}T\d{12}Z-[0-9a-f]{8}$")
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def builtin_label(function) -> str:
+    module = getattr(function, "__module__", None) or "builtins"
+    return f"{module}.{getattr(function, '__qualname__', repr(function))}"
+
+
+class CallProfiler:
+    """Records where the time goes in the current thread, as folded stacks for a flame graph.
+
+    Every Python and builtin call made between start and stop is timed, through sys.setprofile, so
+    even a request that takes a few milliseconds gets a complete profile. That slows the code being
+    profiled down several times over, so only turn it on for the requests being profiled. Nothing
+    is recorded for other threads.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # The microseconds spent in each stack itself, not in what it called
+        self.stacks = Counter()
+        # The calls in progress: their stack, when they started, and how long their calls took
+        self._calls = []
+
+    def start(self):
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        now = self.clock()
+        while self._calls:
+            self._finish(now)
+
+    def _profile(self, frame, event, arg):
+        now = self.clock()
+        if event == "call":
+            self._begin(frame_label(frame.f_code), now)
+        elif event == "c_call":
+            self._begin(builtin_label(arg), now)
+        elif self._calls:
+            # A return, or a builtin returning or raising. Calls that were already in progress when
+            # the profiler started return without having begun, and are ignored.
+            self._finish(now)
+
+    def _begin(self, label: str, now: float):
+        parent = self._calls[-1][0] if self._calls else None
+        self._calls.append([f"{parent};{label}" if parent else label, now, 0.0])
+
+    def _finish(self, now: float):
+        stack, started, in_calls = self._calls.pop()
+        elapsed = now - started
+        self.stacks[stack] += (elapsed - in_calls) * 1e6
+        if self._calls:
+            self._calls[-1][2] += elapsed
+
+    def folded(self) -> str:
+        """The profile in the folded format of flamegraph.pl, also read by speedscope."""
+        return "".join(
+            f"{stack} {round(microseconds)}\n"
+            for stack, microseconds in sorted(self.stacks.items())
+            if round(microseconds) > 0
+        )
+
+
+class ProfileStore:
+    """Keeps the most recent profiles in a directory, each as a folded stacks file and its details.
+
+    Profiles are named by when they were taken, so every worker sharing the directory sees the
+    same list, newest first.
+    """
+
+    def __init__(self, directory: str, keep: int = 200):
+        self.directory = directory
+        self.keep = keep
+
+    def new_id(self) -> str:
+        return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}Z-{uuid4().hex[:8]}"
+
+    def path(self, profile_id: str, extension: str = "folded") -> str:
+        if not PROFILE_ID.match(profile_id):
+            raise ValueError(f"{profile_id} is not a profile ID")
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(self, profile_id: str, folded: str, details: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(profile_id), "w") as f:
+            f.write(folded)
+        # The details are written last, so a profile is only listed once it is all there
+        with open(self.path(profile_id, "json"), "w") as f:
+            json.dump({"id": profile_id, **details}, f)
+
+        self.prune()
+
+    def ids(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        names = (name[: -len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+        return sorted((name for name in names if PROFILE_ID.match(name)), reverse=True)
+
+    def recent(self, limit: int) -> list:
+        profiles = []
+        for profile_id in self.ids()[:limit]:
+            try:
+                with open(self.path(profile_id, "json"), "r") as f:
+                    profiles.append(json.load(f))
+            except (FileNotFoundError, ValueError):
+                # Pruned by another worker, or still being written
+                continue
+        return profiles
+
+    def prune(self):
+        for profile_id in self.ids()[self.keep :]:
+            for extension in ("json", "folded"):
+                try:
+                    os.remove(self.path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
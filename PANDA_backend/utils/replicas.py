@@ -0,0 +1,107 @@
+import time
+from itertools import count
+from threading import Lock
+from logging import getLogger
+
+from sqlalchemy import event, text
+
+logger = getLogger(__name__)
+
+# On a Postgres standby, how many seconds behind the primary it is. When it has replayed everything
+# it has received, it is up to date, however long ago the last transaction was. On a server that
+# isn't a standby, this is NULL.
+POSTGRES_REPLICATION_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.checked_at = None
+
+
+class ReplicaRouter:
+    """Chooses a healthy read replica for each read, taking turns between them.
+
+    Each replica is health checked when it is chosen, at most once every check_interval seconds,
+    by connecting to it and, for Postgres, checking it is no more than max_lag seconds behind the
+    primary. A replica that fails its check, or loses its connection mid-query, isn't chosen again
+    until it passes a later check. If no replica is healthy, choose returns None, and the caller
+    should fall back to the primary.
+    """
+
+    def __init__(self, check_interval: float = 10, max_lag: float = None):
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._replicas = []
+        self._turn = count()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._replicas)
+
+    def add(self, name: str, engine):
+        replica = Replica(name, engine)
+        event.listen(engine, "handle_error", lambda context: self._handle_error(replica, context))
+        with self._lock:
+            self._replicas.append(replica)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._replicas = [replica for replica in self._replicas if replica.name != name]
+
+    def choose(self):
+        """Return the engine of the next healthy replica, or None if there isn't one."""
+        replicas = self._replicas
+        if not replicas:
+            return None
+
+        start = next(self._turn) % len(replicas)
+        for replica in replicas[start:] + replicas[:start]:
+            if self._is_healthy(replica):
+                return replica.engine
+
+        return None
+
+    def _is_healthy(self, replica: Replica) -> bool:
+        # Only one thread checks a replica at a time. The others go on its last known health.
+        with self._lock:
+            now = time.monotonic()
+            due = replica.checked_at is None or now - replica.checked_at >= self.check_interval
+            if due:
+                replica.checked_at = now
+        if not due:
+            return replica.healthy
+
+        healthy = self.check(replica)
+        if healthy != replica.healthy:
+            logger.info(f"Replica {replica.name} is now {'healthy' if healthy else 'unhealthy'}")
+        replica.healthy = healthy
+        return healthy
+
+    def check(self, replica: Replica) -> bool:
+        try:
+            with replica.engine.connect() as connection:
+                if connection.dialect.name != "postgresql":
+                    connection.execute(text("SELECT 1"))
+                    return True
+
+                lag = connection.execute(POSTGRES_REPLICATION_LAG).scalar()
+        except Exception as e:
+            logger.warning(f"Health check failed for replica {replica.name}: {e}")
+            return False
+
+        if lag is not None and self.max_lag is not None and lag > self.max_lag:
+            logger.warning(f"Replica {replica.name} is {lag:.1f} seconds behind the primary")
+            return False
+
+        return True
+
+    def _handle_error(self, replica: Replica, context):
+        if context.is_disconnect:
+            logger.warning(f"Lost the connection to replica {replica.name}")
+            replica.healthy = False
@@ -0,0 +1,94 @@
+import unicodedata
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name into a search key, so that searches can ignore case, accents and punctuation.
+
+    The name is NFKC normalized and case-folded, accents are stripped from Latin letters, and any
+    run of punctuation or whitespace becomes a single space. e.g. "Zoë  O'Brien-Smith" becomes
+    "zoe o brien smith", and "महावीर, जगन्नाथ" becomes "महावीर जगन्नाथ".
+    """
+    name = unicodedata.normalize("NFKC", name).casefold()
+
+    # Only the combining diacritical marks block is stripped. Other scripts (e.g. Devanagari) use
+    # combining marks for their vowels, so stripping all marks would mangle them.
+    decomposed = unicodedata.normalize("NFKD", name)
+    name = unicodedata.normalize(
+        "NFC", "".join(char for char in decomposed if not "\u0300" <= char <= "\u036f")
+    )
+
+    # Letters, numbers and marks are kept, and everything else separates words
+    name = "".join(
+        char if unicodedata.category(char)[0] in "LNM" else " " for char in name
+    )
+    return " ".join(name.split())
+
+
+def trigrams(text: str) -> set:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """An in-memory trigram index of normalized names, for databases without one of their own.
+
+    A search matches every name which contains each of the words of the query, in any order. The
+    names are narrowed down to those which contain all of the query's trigrams before being checked.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._postings = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, key, name: str):
+        """Add or replace the normalized name indexed under key."""
+        with self._lock:
+            self._remove(key)
+            self._names[key] = name
+            for trigram in trigrams(name):
+                self._postings.setdefault(trigram, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        name = self._names.pop(key, None)
+        if name is None:
+            return
+
+        for trigram in trigrams(name):
+            postings = self._postings[trigram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[trigram]
+
+    def search(self, query: str, limit: int) -> list:
+        """Find the keys of the names matching a normalized query, ordered by name."""
+        words = query.split()
+        with self._lock:
+            candidates = None
+            for trigram in set().union(*(trigrams(word) for word in words)):
+                postings = self._postings.get(trigram, set())
+                candidates = postings if candidates is None else candidates & postings
+                if not candidates:
+                    return []
+
+            # Queries of short words have no trigrams to narrow the search down with
+            if candidates is None:
+                candidates = self._names.keys()
+
+            matches = [
+                (self._names[key], key)
+                for key in candidates
+                if all(word in self._names[key] for word in words)
+            ]
+
+        return [key for _, key in sorted(matches)[:limit]]
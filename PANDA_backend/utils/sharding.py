@@ -0,0 +1,222 @@
+import heapq
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+
+logger = getLogger(__name__)
+
+# The constants of the 64-bit linear congruential generator used by jump consistent hashing
+JUMP_MULTIPLIER = 2862933555777941757
+JUMP_MASK = (1 << 64) - 1
+
+
+def shard_for(key, shards: int) -> int:
+    """Choose which of a number of shards a key belongs to, from 0 to shards - 1.
+
+    This is jump consistent hashing (Lamping and Veach), over a hash that is the same in every
+    process. Going from n shards to n + 1 only moves about 1/(n + 1) of the keys, all of them onto
+    the new shard, so shards must only ever be added to the end of the list.
+    """
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    hashed = int.from_bytes(digest, "big")
+
+    shard, jump = -1, 0
+    while jump < shards:
+        shard = jump
+        hashed = (hashed * JUMP_MULTIPLIER + 1) & JUMP_MASK
+        jump = int((shard + 1) * ((1 << 31) / ((hashed >> 33) + 1)))
+
+    return shard
+
+
+def gather_sorted(rows, key, limit: int = None) -> list:
+    """Put rows gathered from several shards back in order, and keep the first limit of them.
+
+    Each shard sorts and limits its own rows, so the first limit rows overall are always among
+    the rows gathered, just not in order.
+    """
+    rows = sorted(rows, key=key)
+    return rows if limit is None else rows[:limit]
+
+
+def merge_shards(session, shard_ids, statement, key):
+    """Stream the rows of a sorted query from each shard, merged into one sorted stream."""
+    return heapq.merge(
+        *(session.execute(statement, bind_arguments={"shard_id": shard_id}) for shard_id in shard_ids),
+        key=key,
+    )
+
+
+class ShardRouter:
+    """Decides which shard each row of the sharded tables is stored in, for a ShardedSession.
+
+    keys maps the name of each sharded table to the column its rows are sharded by. Rows with the
+    same value in that column are kept together, e.g. a patient with their appointments. Every other
+    table is kept in the default shard.
+    """
+
+    def __init__(self, shard_ids: list, keys: dict, default: str = "primary"):
+        self.shard_ids = list(shard_ids)
+        self.keys = keys
+        self.default = default
+
+    def __len__(self):
+        return len(self.shard_ids)
+
+    def shard_id_for(self, key) -> str:
+        return self.shard_ids[shard_for(key, len(self.shard_ids))]
+
+    def is_sharded(self, mapper) -> bool:
+        return mapper is not None and mapper.local_table.name in self.keys
+
+    def session_options(self) -> dict:
+        return {
+            "shard_chooser": self.shard_chooser,
+            "identity_chooser": self.identity_chooser,
+            "execute_chooser": self.execute_chooser,
+        }
+
+    def shard_chooser(self, mapper, instance, clause=None, **kwargs) -> str:
+        """The shard to write an instance to."""
+        if not self.is_sharded(mapper):
+            return self.default
+
+        if instance is None:
+            # Asked for a connection for the table as a whole, e.g. to find out its dialect. The
+            # shards all have the same schema, so any of them will do.
+            return self.shard_ids[0]
+
+        column = self.keys[mapper.local_table.name]
+        key = getattr(instance, column)
+        if key is None:
+            raise ValueError(f"Can't choose a shard for {instance!r} without a {column}")
+
+        return self.shard_id_for(key)
+
+    def identity_chooser(self, mapper, primary_key, **kwargs) -> list:
+        """The shards a row could be in, given its primary key."""
+        if not self.is_sharded(mapper):
+            return [self.default]
+
+        if mapper.primary_key[0].name == self.keys[mapper.local_table.name]:
+            return [self.shard_id_for(primary_key[0])]
+
+        return self.shard_ids
+
+    def execute_chooser(self, orm_context) -> list:
+        """The shards to run a statement on: just those it can match rows in, if it says."""
+        mapper = orm_context.bind_mapper
+        if not self.is_sharded(mapper):
+            return [self.default]
+
+        column = mapper.local_table.c[self.keys[mapper.local_table.name]]
+        keys = keys_in_criteria(
+            getattr(orm_context.statement, "whereclause", None), column, orm_context.parameters
+        )
+        if keys is None:
+            return self.shard_ids
+        if not keys:
+            # An empty IN can't match anything, but the session still needs a shard to ask
+            return self.shard_ids[:1]
+
+        return sorted({self.shard_id_for(key) for key in keys})
+
+    def scatter(self, engines: dict, statement, max_workers: int = None) -> dict:
+        """Run a read-only statement on every shard at once, each with its own connection.
+
+        Returns each shard's rows, by shard ID. This is for cross-shard queries like counts, where
+        waiting for each shard in turn, as the session does, would make the slowest query N times slower.
+        """
+
+        def run(shard_id):
+            with engines[shard_id].connect() as connection:
+                return connection.execute(statement).all()
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.shard_ids)) as executor:
+            return dict(zip(self.shard_ids, executor.map(run, self.shard_ids)))
+
+
+def keys_in_criteria(criteria, column, parameters=None):
+    """Find the values a WHERE clause limits column to, or None if it could match any value.
+
+    Only conditions ANDed onto the whole clause count, like `column == value` or `column IN values`,
+    as anything ORed could match rows with other values. Values can also be given separately in
+    parameters, by the name of their bound parameter, as the session does for a get.
+    """
+    if criteria is None:
+        return None
+
+    if isinstance(criteria, BooleanClauseList) and criteria.operator is operators.and_:
+        conditions = criteria.clauses
+    else:
+        conditions = [criteria]
+
+    for condition in conditions:
+        if not (
+            isinstance(condition, BinaryExpression)
+            and isinstance(condition.right, BindParameter)
+            and condition.left.compare(column)
+        ):
+            continue
+
+        value = (parameters or {}).get(condition.right.key, condition.right.value)
+        if value is None:
+            continue
+        if condition.operator is operators.eq:
+            return [value]
+        if condition.operator is operators.in_op:
+            return list(value)
+
+    return None
+
+
+def rebalance(engines: dict, router: ShardRouter, tables: list, chunk_size: int = 1000) -> dict:
+    """Move every row that is in the wrong shard to the right one, offline.
+
+    After shards are added, rows in the existing shards which now belong in a new one are copied
+    across a chunk at a time, then deleted from where they were. A row that is already in the
+    target shard, because an earlier run was interrupted between the two, is replaced, so this can
+    safely be run again. It must not be run while the app is writing to the shards.
+
+    Returns how many rows of each table were moved.
+    """
+    moved = {table.name: 0 for table in tables}
+    for source_id in router.shard_ids:
+        source = engines[source_id]
+        for table in tables:
+            key = table.c[router.keys[table.name]]
+            primary_key = list(table.primary_key)[0]
+
+            position = None
+            while True:
+                query = select(table).order_by(primary_key).limit(chunk_size)
+                if position is not None:
+                    query = query.where(primary_key > position)
+                with source.connect() as connection:
+                    rows = connection.execute(query).mappings().all()
+                if not rows:
+                    break
+                position = rows[-1][primary_key.name]
+
+                misplaced = {}
+                for row in rows:
+                    target_id = router.shard_id_for(row[key.name])
+                    if target_id != source_id:
+                        misplaced.setdefault(target_id, []).append(dict(row))
+
+                for target_id, records in misplaced.items():
+                    ids = [record[primary_key.name] for record in records]
+                    with engines[target_id].begin() as connection:
+                        connection.execute(delete(table).where(primary_key.in_(ids)))
+                        connection.execute(insert(table), records)
+                    with source.begin() as connection:
+                        connection.execute(delete(table).where(primary_key.in_(ids)))
+
+                    moved[table.name] += len(records)
+                    logger.info(f"Moved {len(records)} {table.name} rows from {source_id} to {target_id}")
+
+    return moved
@@ -0,0 +1,169 @@
+import io
+import os
+import json
+import zlib
+import struct
+from datetime import date, datetime
+from logging import getLogger
+
+from sqlalchemy import Date, DateTime, insert, select
+
+logger = getLogger(__name__)
+
+# A snapshot is MAGIC, then a series of frames, each a little-endian 4-byte length and that many
+# bytes of zlib-compressed JSON. Every frame but the last is a chunk of rows from one table, stored
+# column by column, which compresses much better than row by row. The last frame says how many
+# rows of each table there were, so that a truncated snapshot can't be mistaken for a whole one.
+MAGIC = b"PANDASS1"
+FRAME_LENGTH = struct.Struct("<I")
+
+
+def encode_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class SnapshotWriter:
+    """Writes a snapshot file a chunk at a time. It only appears at path once it is closed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.counts = {}
+        self._file = open(f"{path}.tmp", "wb")
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(f"{self.path}.tmp")
+
+    def _write_frame(self, payload: dict):
+        data = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        self._file.write(FRAME_LENGTH.pack(len(data)))
+        self._file.write(data)
+
+    def write_chunk(self, table: str, columns: list, rows: list):
+        self._write_frame(
+            {
+                "table": table,
+                "columns": columns,
+                "data": [[encode_value(row[i]) for row in rows] for i in range(len(columns))],
+            }
+        )
+        self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+    def close(self):
+        self._write_frame({"counts": self.counts})
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+def read_snapshot(path: str):
+    """Read a snapshot back, yielding (table, columns, rows) for each chunk, in the order written.
+
+    Values are as they were encoded, so dates and times are ISO 8601 strings. Raises ValueError if
+    the file isn't a snapshot, or was cut short.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+
+        counts = {}
+        while True:
+            header = f.read(FRAME_LENGTH.size)
+            if len(header) < FRAME_LENGTH.size:
+                raise ValueError(f"Snapshot {path} is truncated")
+            (length,) = FRAME_LENGTH.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                raise ValueError(f"Snapshot {path} is truncated")
+
+            frame = json.loads(zlib.decompress(data))
+            if "counts" in frame:
+                if frame["counts"] != counts:
+                    raise ValueError(f"Snapshot {path} should have {frame['counts']} rows, but has {counts}")
+                return
+
+            rows = list(zip(*frame["data"]))
+            counts[frame["table"]] = counts.get(frame["table"], 0) + len(rows)
+            yield frame["table"], frame["columns"], rows
+
+
+def dump_table(connection, table, chunk_size: int = 10000):
+    """Read every row of a table, yielding lists of up to chunk_size rows.
+
+    Rows are streamed from a server-side cursor where the database has them, so the whole table is
+    never in memory. Run this on a connection in a REPEATABLE READ transaction to dump several
+    tables as they were at one moment.
+    """
+    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+        select(table)
+    )
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+
+# How NULL is written for COPY. Every other value is quoted, so a string can never be mistaken for it.
+COPY_NULL = "\\N"
+
+
+def encode_copy_csv(rows: list) -> str:
+    """Write rows as CSV for Postgres' COPY, with NULL as an unquoted COPY_NULL.
+
+    Every other value is quoted, so that an empty string stays an empty string. csv's own quoting
+    can't be used, as it writes None as a quoted empty string.
+    """
+    return "".join(
+        ",".join(COPY_NULL if value is None else '"' + str(value).replace('"', '""') + '"' for value in row) + "\n"
+        for row in rows
+    )
+
+
+def load_rows(connection, table, columns: list, rows: list):
+    """Bulk load rows, as read from a snapshot, into a table.
+
+    On Postgres, they are streamed in with COPY, which is many times faster than INSERTs. Anywhere
+    else, they are inserted with one executemany.
+    """
+    if not rows:
+        return
+
+    if connection.dialect.driver == "psycopg2":
+        buffer = io.StringIO(encode_copy_csv(rows))
+        column_list = ", ".join(connection.dialect.identifier_preparer.quote(column) for column in columns)
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {connection.dialect.identifier_preparer.format_table(table)} ({column_list}) "
+                f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                buffer,
+            )
+        finally:
+            cursor.close()
+        return
+
+    parsers = {}
+    for column in columns:
+        if isinstance(table.c[column].type, DateTime):
+            parsers[column] = datetime.fromisoformat
+        elif isinstance(table.c[column].type, Date):
+            parsers[column] = date.fromisoformat
+
+    connection.execute(
+        insert(table),
+        [
+            {
+                column: parsers[column](value) if value is not None and column in parsers else value
+                for column, value in zip(columns, row)
+            }
+            for row in rows
+        ],
+    )
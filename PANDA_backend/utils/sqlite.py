@@ -0,0 +1,124 @@
+from datetime import date, datetime, timezone
+from threading import Lock
+from logging import getLogger
+
+from sqlalchemy import Date, DateTime, event
+from sqlalchemy.types import TypeDecorator
+
+logger = getLogger(__name__)
+
+
+class UTCDateTime(TypeDecorator):
+    """A timestamp with a time zone, which comes back as an aware UTC datetime on every database.
+
+    Postgres keeps the time zone itself, but SQLite has no timestamp type, and would store the
+    datetime as text in whatever zone it was given, then give it back naive. So on SQLite, times are
+    converted to UTC before they are stored, which also keeps them in order as text. ISO 8601
+    strings, which Postgres parses itself, are parsed first.
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name != "sqlite" or value is None:
+            return value
+
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+class ISODate(TypeDecorator):
+    """A date, which can be given as an ISO 8601 string on SQLite too, as it can on Postgres."""
+
+    impl = Date
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name == "sqlite" and isinstance(value, str):
+            value = date.fromisoformat(value)
+        return value
+
+
+def sqlite_pragmas(busy_timeout: int = 5000, mmap_size: int = 256 * 1024 * 1024) -> dict:
+    """The pragmas for a SQLite database that a server is writing to from several threads.
+
+    WAL lets readers carry on while something is being written, and with it, synchronous=NORMAL only
+    syncs at checkpoints, which is still safe against the process crashing, if not against the
+    power going. busy_timeout (in milliseconds) is how long to wait for another process's write to
+    finish, and mmap_size (in bytes) how much of the database to read through memory mapping.
+    """
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": busy_timeout,
+        "mmap_size": mmap_size,
+        "foreign_keys": "ON",
+        "temp_store": "MEMORY",
+    }
+
+
+def apply_pragmas(engine, pragmas: dict):
+    """Set pragmas on every new connection to a SQLite database."""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    logger.info(f"SQLite pragmas for {engine.url.database}: {pragmas}")
+
+
+class SingleWriter:
+    """Lets one session at a time write to the database, while any number of them read.
+
+    SQLite only has one writer at a time anyway, and makes the others poll for the lock until
+    busy_timeout runs out. Queueing them on a lock in the process instead hands it straight to the
+    next writer, in order. A session takes the lock when it first writes, by flushing or running an
+    INSERT, UPDATE or DELETE, and keeps it until its transaction ends. Writes from other processes,
+    like the flask CLI, are still left to busy_timeout.
+    """
+
+    def __init__(self, timeout: float = 5):
+        self.timeout = timeout
+        self._lock = Lock()
+
+    def attach(self, session_class):
+        event.listen(session_class, "before_flush", self.before_flush)
+        event.listen(session_class, "do_orm_execute", self.do_orm_execute)
+        event.listen(session_class, "after_transaction_end", self.after_transaction_end)
+
+    def acquire(self, session):
+        if session.info.get("writer"):
+            return
+        if not self._lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Waited more than {self.timeout} seconds to write to the database")
+        session.info["writer"] = True
+
+    def release(self, session):
+        if session.info.pop("writer", False):
+            self._lock.release()
+
+    def before_flush(self, session, flush_context, instances):
+        self.acquire(session)
+
+    def do_orm_execute(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self.acquire(orm_execute_state.session)
+
+    def after_transaction_end(self, session, transaction):
+        # Only the outermost transaction ends the write, not savepoints
+        if transaction.parent is None:
+            self.release(session)
@@ -1,5 +1,5 @@
 import ukpostcodeparser
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import re
 from logging import getLogger
 
@@ -107,39 +107,41 @@ def parse_duration(duration_str: str) -> timedelta:
     return timedelta(hours=hours, minutes=minutes)
 
 
-def check_if_missed_appointment(appointment) -> bool:
-    """Check if the appointment was missed. Returns a boolean."""
-    # If we have a model, convert it to a dictionary
-    if hasattr(appointment, "serialize"):
-        appointment = appointment.serialize()
+def is_missed(status: str, end_time: datetime, now: datetime = None) -> bool:
+    """Check if an appointment was missed, i.e. it is still active, but it has finished.
 
-    # Only active appointments can be missed
-    if appointment["status"] != "active":
-        logger.info(
-            f"[{appointment['id']}] Appointment is not active, so cannot be missed"
-        )
-        return False
+    Takes the appointment's status and (timezone-aware) end time as they are, without serializing
+    and parsing them, so this is cheap enough to call for every appointment. Returns a boolean.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
 
-    # Parse the start time of the appointment
-    start_time_str = appointment["time"]
-    start_time = datetime.fromisoformat(start_time_str)
+    return status == "active" and now > end_time
 
-    # Parse the duration of the appointment
-    duration_str = appointment["duration"]
-    duration = parse_duration(duration_str)
 
-    # Calculate the end time of the appointment
-    end_time = start_time + duration
-    logger.debug(f"[{appointment['id']}] Appointment end time: {end_time}")
+def classify_missed(statuses, end_times, now: datetime = None):
+    """Check which of many appointments were missed, all at once.
 
-    # Get the current time
-    current_time = datetime.now().astimezone(start_time.tzinfo)
-    logger.debug(f"[{appointment['id']}] Current time: {current_time}")
+    Takes a sequence of statuses, and the appointments' end times as a NumPy array of UTC
+    datetime64s, and compares them all against the same now. Returns a NumPy array of booleans,
+    one per appointment. This is for data that is already in columns. For rows of Python objects,
+    calling is_missed on each is quicker than converting their datetimes to datetime64s, so end
+    times given as timezone-aware datetimes are converted, but only as a convenience.
+    """
+    # NumPy takes a while to import, and only the batch paths need it
+    import numpy as np
 
-    is_missed = current_time > end_time
-    logger.debug(
-        f"[{appointment['id']}] Checking if appointment was missed: {is_missed}"
-    )
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    if len(statuses) == 0:
+        return np.zeros(0, dtype=bool)
+
+    if not (isinstance(end_times, np.ndarray) and end_times.dtype.kind == "M"):
+        end_times = np.array(
+            [end_time.astimezone(timezone.utc).replace(tzinfo=None) for end_time in end_times],
+            dtype="datetime64[us]",
+        )
 
-    # Check if the current time is greater than the end time of the appointment
-    return is_missed
+    now = np.datetime64(now.astimezone(timezone.utc).replace(tzinfo=None), "us")
+    return (np.asarray(statuses) == "active") & (end_times < now)